@@ -0,0 +1,549 @@
+##########################################################################
+# mbffile.py
+# Read and write Minecraft Blocks Files (.mbf)
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Version 1 is a text file with one line per block
+#     x,y,z,id,data
+# Version 2 is a binary file with a fixed 64 byte header followed by
+# dense planes of block ids and then block data (one byte per block).
+# Header (little endian)
+#     magic "MBF2", header size (uint16), axis order (3 chars eg. "yxz"),
+#     pad byte, origin x,y,z (int32), size x,y,z (int32)
+# Blocks are stored in axis order, for "yxz" that is y outer, z inner
+# which is the same order as version 1 files are written.
+# Version 2 files can be memory mapped and viewed as NumPy arrays
+# (shape size_y, size_x, size_z) without any parsing.
+# Version 3 is a sparse binary file which only stores non-air blocks.
+# Header is the same as version 2 (magic "MBF3") followed by the number
+# of blocks (uint32). Each block is then 8 bytes
+#     x,y,z relative to origin (uint16), id (uint8), data (uint8)
+# Blocks are stored in axis order. Any position not stored is air.
+# File size scales with the number of solid blocks not the volume.
+#
+###########################################################################
+
+import os
+import mmap
+import struct
+from contextlib import contextmanager
+
+# NumPy is optional - only needed for as_arrays()
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+mbf_v2_magic = b"MBF2"
+mbf_v3_magic = b"MBF3"
+mbf_v2_header = struct.Struct("<4sH3sx3i3i")
+mbf_v3_header = struct.Struct("<4sH3sx3i3iI")
+mbf_v2_header_size = 64
+mbf_v3_entry = struct.Struct("<HHHBB")
+# Only order currently written - matches loops in save_blocks
+default_axis_order = "yxz"
+
+# Air is not stored in version 3 files (same as mcpi.block.AIR.id)
+air_block = 0
+
+# Bytes read at a time when streaming version 1 and 3 files
+read_buffer_size = 1024 * 1024
+
+
+# Returns the format version of an mbf file (1 = text, 2 = binary, 3 = sparse)
+def detect_version (filename):
+    with open(filename, 'rb') as fp:
+        magic = fp.read(len(mbf_v2_magic))
+    if (magic == mbf_v2_magic):
+        return 2
+    if (magic == mbf_v3_magic):
+        return 3
+    return 1
+
+
+# A cuboid of blocks, with ids and data stored in axis order
+# ids and data can be bytearray, memoryview (mmap) or numpy array
+class BlockCapture():
+
+    def __init__ (self, origin, size, ids = None, data = None, axis_order = default_axis_order):
+        if (axis_order != default_axis_order):
+            raise ValueError("Unsupported axis order "+axis_order)
+        self.origin = tuple(origin)
+        self.size = tuple(size)
+        self.axis_order = axis_order
+        num_blocks = self.size[0] * self.size[1] * self.size[2]
+        if (ids is None):
+            ids = bytearray(num_blocks)
+        if (data is None):
+            data = bytearray(num_blocks)
+        self.ids = ids
+        self.data = data
+        # mmap (if file is memory mapped) - closed by close()
+        self._mmap = None
+
+    def __len__ (self):
+        return self.size[0] * self.size[1] * self.size[2]
+
+    # Index into ids / data for a position relative to origin
+    def index (self, x, y, z):
+        return (y * self.size[0] + x) * self.size[2] + z
+
+    # Position relative to origin from an index
+    def position (self, index):
+        (yx, z) = divmod(index, self.size[2])
+        (y, x) = divmod(yx, self.size[0])
+        return (x, y, z)
+
+    def set_block (self, x, y, z, block_id, block_data = 0):
+        index = self.index(x, y, z)
+        self.ids[index] = block_id
+        self.data[index] = block_data
+
+    # Returns (id, data) for a position relative to origin
+    def get_block (self, x, y, z):
+        index = self.index(x, y, z)
+        return (self.ids[index], self.data[index])
+
+    # Generator returning (x,y,z,id,data) with absolute positions
+    # in the same order as a version 1 file
+    def blocks (self):
+        (origin_x, origin_y, origin_z) = self.origin
+        (size_x, size_y, size_z) = self.size
+        ids = bytes(self.ids)
+        data = bytes(self.data)
+        index = 0
+        for y in range (origin_y, origin_y + size_y):
+            for x in range (origin_x, origin_x + size_x):
+                for z in range (origin_z, origin_z + size_z):
+                    yield (x, y, z, ids[index], data[index])
+                    index += 1
+
+    # Returns index of each non-air block in axis order
+    # start and end limit the search to part of the capture
+    def solid_indexes (self, start = 0, end = None):
+        if (end == None):
+            end = len(self)
+        if (numpy != None):
+            return (numpy.flatnonzero(numpy.frombuffer(self.ids, dtype=numpy.uint8, count=end-start, offset=start)) + start).tolist()
+        ids = bytes(self.ids[start:end])
+        return [start + index for index in range(len(ids)) if ids[index] != air_block]
+
+    # Generator returning (x,y,z,id,data) with absolute positions
+    # for non-air blocks only
+    # Searched a layer at a time so memory use does not depend on the
+    # size of the capture
+    def solid_blocks (self):
+        (origin_x, origin_y, origin_z) = self.origin
+        layer_size = self.size[0] * self.size[2]
+        for start in range (0, len(self), max(layer_size, 1)):
+            for index in self.solid_indexes(start, start + layer_size):
+                (x, y, z) = self.position(index)
+                yield (origin_x + x, origin_y + y, origin_z + z, self.ids[index], self.data[index])
+
+    # Returns (ids, data) as numpy arrays with shape (size_y, size_x, size_z)
+    # These are views (no copy) where possible
+    def as_arrays (self):
+        if (numpy == None):
+            raise ImportError("NumPy is required for as_arrays")
+        shape = (self.size[1], self.size[0], self.size[2])
+        ids = numpy.frombuffer(self.ids, dtype=numpy.uint8, count=len(self)).reshape(shape)
+        data = numpy.frombuffer(self.data, dtype=numpy.uint8, count=len(self)).reshape(shape)
+        return (ids, data)
+
+    def close (self):
+        if (self._mmap != None):
+            # views must be released before the mmap can close
+            for view in (self.ids, self.data):
+                if isinstance(view, memoryview):
+                    view.release()
+            self.ids = bytes(0)
+            self.data = bytes(0)
+            try:
+                self._mmap.close()
+            except BufferError:
+                # still in use by numpy arrays - closed when they are freed
+                pass
+            self._mmap = None
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *args):
+        self.close()
+
+
+# Statistics for a capture in a single pass
+# exclude_blocks are ids (other than air) which are not counted as
+# printed blocks
+# Returns dict
+#     origin, size - bounds of the capture
+#     solid - number of non-air blocks
+#     printed - number of blocks not air or excluded
+#     lowest, highest - (x,y,z) absolute corners of the printed blocks
+#                       or None if there are none
+#     histogram - number of each block id (list of 256)
+#     histogram_no_data - number of each block id with data 0
+def block_stats (capture, exclude_blocks = ()):
+    exclude_blocks = set(exclude_blocks) | {air_block}
+    stats = {'origin':capture.origin, 'size':capture.size, 'lowest':None, 'highest':None}
+    if (numpy == None or len(capture) == 0):
+        return _block_stats_loop(capture, exclude_blocks, stats)
+    (ids, data) = capture.as_arrays()
+    histogram = numpy.bincount(ids.reshape(-1), minlength=256)
+    stats['histogram'] = histogram.tolist()
+    stats['histogram_no_data'] = numpy.bincount(ids[data == 0], minlength=256).tolist()
+    stats['solid'] = len(capture) - int(histogram[air_block])
+    stats['printed'] = len(capture) - int(histogram[list(exclude_blocks)].sum())
+    if (stats['printed'] > 0):
+        printed = ~numpy.isin(ids, list(exclude_blocks))
+        # (y,x,z) - layers / rows which contain any printed blocks
+        used_y = numpy.flatnonzero(printed.any(axis=(1, 2)))
+        used_x = numpy.flatnonzero(printed.any(axis=(0, 2)))
+        used_z = numpy.flatnonzero(printed.any(axis=(0, 1)))
+        (origin_x, origin_y, origin_z) = capture.origin
+        stats['lowest'] = (origin_x + int(used_x[0]), origin_y + int(used_y[0]), origin_z + int(used_z[0]))
+        stats['highest'] = (origin_x + int(used_x[-1]), origin_y + int(used_y[-1]), origin_z + int(used_z[-1]))
+    return stats
+
+
+def _block_stats_loop (capture, exclude_blocks, stats):
+    histogram = [0] * 256
+    histogram_no_data = [0] * 256
+    for (block_id, block_data) in zip(bytes(capture.ids), bytes(capture.data)):
+        histogram[block_id] += 1
+        if (block_data == 0):
+            histogram_no_data[block_id] += 1
+    stats['histogram'] = histogram
+    stats['histogram_no_data'] = histogram_no_data
+    stats['solid'] = len(capture) - histogram[air_block]
+    stats['printed'] = len(capture) - sum(histogram[block_id] for block_id in exclude_blocks)
+    for (x, y, z, block_id, block_data) in capture.solid_blocks():
+        if (block_id in exclude_blocks):
+            continue
+        if (stats['lowest'] == None):
+            stats['lowest'] = (x, y, z)
+            stats['highest'] = (x, y, z)
+        stats['lowest'] = tuple(min(a, b) for (a, b) in zip(stats['lowest'], (x, y, z)))
+        stats['highest'] = tuple(max(a, b) for (a, b) in zip(stats['highest'], (x, y, z)))
+    return stats
+
+
+# Generator returning (x,y,z,id,data) for each block in any version of file
+# If skip_air then air blocks are not returned, which for version 3
+# files means that only the stored blocks are read
+# Version 1 files are read a line at a time (through a large buffer) and
+# version 3 in chunks, so memory use is low
+def iter_blocks (filename, skip_air = False):
+    version = detect_version(filename)
+    if (version == 3):
+        for this_block in _iter_v3(filename, skip_air):
+            yield this_block
+        return
+    if (version == 2):
+        with load_mbf(filename) as capture:
+            if (skip_air):
+                all_blocks = capture.solid_blocks()
+            else:
+                all_blocks = capture.blocks()
+            for this_block in all_blocks:
+                yield this_block
+        return
+    with open(filename, 'r', buffering=read_buffer_size) as fp:
+        for this_line in fp:
+            values = this_line.split(",")
+            # Only air is skipped, so don't convert the rest of the line
+            block_id = int(values[3])
+            if (skip_air and block_id == air_block):
+                continue
+            yield (int(values[0]), int(values[1]), int(values[2]), block_id, int(values[4]))
+
+
+# Open a file for writing through a temporary file, which only replaces
+# filename if the with block completes without an exception, so that a
+# cancelled or failed write does not leave a partial file
+# with atomic_write(filename) as fp:
+@contextmanager
+def atomic_write (filename, mode = 'w'):
+    temp_filename = filename + ".tmp"
+    try:
+        with open(temp_filename, mode) as fp:
+            yield fp
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+# Returns (origin, size) of the cuboid in the file, or None if empty
+# Version 1 files are a cuboid in axis order so the first line is the
+# origin and the last line is the opposite corner
+def read_bounds (filename):
+    if (detect_version(filename) != 1):
+        with open(filename, 'rb') as fp:
+            header = mbf_v2_header.unpack(fp.read(mbf_v2_header.size))
+        return (header[3:6], header[6:9])
+    origin = read_origin(filename)
+    if (origin == None):
+        return None
+    with open(filename, 'rb') as fp:
+        # Read back from the end to find the start of the last line
+        end = fp.seek(0, os.SEEK_END)
+        position = max(0, end - 64)
+        while True:
+            fp.seek(position)
+            tail = fp.read().rstrip(b"\n")
+            if (b"\n" in tail or position == 0):
+                break
+            position = max(0, position - 64)
+    last = [int(i) for i in tail.split(b"\n")[-1].split(b",")[0:3]]
+    return (origin, tuple(last[i] - origin[i] + 1 for i in range(3)))
+
+
+# Returns position of the first block in the file (the origin for a cuboid)
+# or None if the file is empty
+# Used for the offset when converting, as air blocks may be skipped
+def read_origin (filename):
+    if (detect_version(filename) == 1):
+        with open(filename, 'r') as fp:
+            this_line = fp.readline()
+        if not this_line :
+            return None
+        return tuple(int(i) for i in this_line.split(",")[0:3])
+    with open(filename, 'rb') as fp:
+        header = fp.read(mbf_v2_header.size)
+    return mbf_v2_header.unpack(header)[3:6]
+
+
+# Load any version of file into a BlockCapture
+# Version 2 files are memory mapped unless use_mmap is False
+def load_mbf (filename, use_mmap = True):
+    version = detect_version(filename)
+    if (version == 3):
+        return _load_v3(filename)
+    if (version == 2):
+        return _load_v2(filename, use_mmap)
+    return _load_v1(filename)
+
+
+# Version 1 - text file, must be a cuboid (as created by save_blocks)
+# Any missing positions are left as air
+# With NumPy the file is parsed in chunks straight into the capture using
+# the bounds from the first and last lines, otherwise (or if the blocks
+# are not within those bounds) it is read twice (bounds and then blocks)
+# rather than holding all lines
+def _load_v1 (filename):
+    if (numpy != None):
+        capture = _load_v1_arrays(filename)
+        if (capture != None):
+            return capture
+    lowest = None
+    highest = None
+    for (x,y,z,block_id,block_data) in iter_blocks(filename):
+        if (lowest == None):
+            lowest = [x,y,z]
+            highest = [x,y,z]
+            continue
+        lowest = [min(lowest[0],x), min(lowest[1],y), min(lowest[2],z)]
+        highest = [max(highest[0],x), max(highest[1],y), max(highest[2],z)]
+    if (lowest == None):
+        return BlockCapture((0,0,0), (0,0,0))
+    capture = BlockCapture(lowest, [highest[i] - lowest[i] + 1 for i in range(3)])
+    for (x,y,z,block_id,block_data) in iter_blocks(filename):
+        capture.set_block(x - lowest[0], y - lowest[1], z - lowest[2], block_id, block_data)
+    return capture
+
+
+# Returns None if any block is outside the bounds from read_bounds
+def _load_v1_arrays (filename):
+    bounds = read_bounds(filename)
+    if (bounds == None):
+        return None
+    capture = BlockCapture(*bounds)
+    ids = numpy.frombuffer(capture.ids, dtype=numpy.uint8)
+    data = numpy.frombuffer(capture.data, dtype=numpy.uint8)
+    origin = numpy.array(capture.origin)
+    size = numpy.array(capture.size)
+    with open(filename, 'r') as fp:
+        while True:
+            lines = fp.readlines(read_buffer_size * 16)
+            if (len(lines) == 0):
+                break
+            values = numpy.fromstring(",".join(lines).replace("\n", ""), dtype=numpy.int64, sep=",").reshape(-1, 5)
+            position = values[:, 0:3] - origin
+            if ((position < 0).any() or (position >= size).any()):
+                return None
+            index = (position[:, 1] * size[0] + position[:, 0]) * size[2] + position[:, 2]
+            ids[index] = values[:, 3]
+            data[index] = values[:, 4]
+    return capture
+
+
+def _load_v2 (filename, use_mmap):
+    with open(filename, 'rb') as fp:
+        if (use_mmap):
+            buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buffer = fp.read()
+    (magic, header_size, axis_order, ox, oy, oz, sx, sy, sz) = mbf_v2_header.unpack_from(buffer, 0)
+    num_blocks = sx * sy * sz
+    if (len(buffer) < header_size + 2 * num_blocks):
+        raise ValueError("Truncated mbf file "+filename)
+    view = memoryview(buffer)
+    capture = BlockCapture((ox,oy,oz), (sx,sy,sz),
+        view[header_size:header_size+num_blocks],
+        view[header_size+num_blocks:header_size+2*num_blocks],
+        axis_order.decode('ascii'))
+    if (use_mmap):
+        capture._mmap = buffer
+    return capture
+
+
+# Returns (origin, size, axis_order, entries) for a version 3 file
+# entries is a bytes object of packed mbf_v3_entry
+def _read_v3 (filename):
+    with open(filename, 'rb') as fp:
+        buffer = fp.read()
+    (magic, header_size, axis_order, ox, oy, oz, sx, sy, sz, count) = mbf_v3_header.unpack_from(buffer, 0)
+    entries = buffer[header_size:header_size + count * mbf_v3_entry.size]
+    if (len(entries) < count * mbf_v3_entry.size):
+        raise ValueError("Truncated mbf file "+filename)
+    return ((ox,oy,oz), (sx,sy,sz), axis_order.decode('ascii'), entries)
+
+
+def _load_v3 (filename):
+    (origin, size, axis_order, entries) = _read_v3(filename)
+    capture = BlockCapture(origin, size, axis_order=axis_order)
+    if (numpy != None):
+        stored = numpy.frombuffer(entries, dtype=[('x','<u2'), ('y','<u2'), ('z','<u2'), ('id','u1'), ('data','u1')])
+        index = (stored['y'].astype(numpy.int64) * size[0] + stored['x']) * size[2] + stored['z']
+        numpy.frombuffer(capture.ids, dtype=numpy.uint8)[index] = stored['id']
+        numpy.frombuffer(capture.data, dtype=numpy.uint8)[index] = stored['data']
+        return capture
+    for (x, y, z, block_id, block_data) in mbf_v3_entry.iter_unpack(entries):
+        capture.set_block(x, y, z, block_id, block_data)
+    return capture
+
+
+# Generator returning the stored entries of a version 3 file, read in
+# chunks rather than loading the whole file
+def _iter_v3_entries (fp, count):
+    chunk_entries = max(read_buffer_size // mbf_v3_entry.size, 1)
+    while (count > 0):
+        entries = fp.read(min(count, chunk_entries) * mbf_v3_entry.size)
+        if (len(entries) == 0 or len(entries) % mbf_v3_entry.size != 0):
+            raise ValueError("Truncated mbf file "+fp.name)
+        count -= len(entries) // mbf_v3_entry.size
+        for entry in mbf_v3_entry.iter_unpack(entries):
+            yield entry
+
+
+# Version 3 blocks - if not skip_air then the air between the stored
+# blocks is returned so that the order is the same as version 1
+def _iter_v3 (filename, skip_air):
+    with open(filename, 'rb') as fp:
+        (magic, header_size, axis_order, ox, oy, oz, sx, sy, sz, count) = mbf_v3_header.unpack(fp.read(mbf_v3_header.size))
+        fp.seek(header_size)
+        stored = _iter_v3_entries(fp, count)
+        if (skip_air):
+            for (x, y, z, block_id, block_data) in stored:
+                yield (ox + x, oy + y, oz + z, block_id, block_data)
+            return
+        next_block = next(stored, None)
+        for y in range (0, sy):
+            for x in range (0, sx):
+                for z in range (0, sz):
+                    if (next_block != None and next_block[0:3] == (x, y, z)):
+                        yield (ox + x, oy + y, oz + z, next_block[3], next_block[4])
+                        next_block = next(stored, None)
+                    else:
+                        yield (ox + x, oy + y, oz + z, air_block, 0)
+
+
+# Save a BlockCapture as version 1 (text), 2 (binary) or 3 (sparse)
+# The file is replaced atomically so an error will not lose the original
+def save_mbf (filename, capture, version = 2):
+    if (version == 1):
+        with atomic_write(filename, 'w') as fp:
+            for this_block in capture.blocks():
+                fp.write("{},{},{},{},{}\n".format(*this_block))
+    elif (version == 2):
+        with atomic_write(filename, 'wb') as fp:
+            header = mbf_v2_header.pack(mbf_v2_magic, mbf_v2_header_size,
+                capture.axis_order.encode('ascii'), *(capture.origin + capture.size))
+            fp.write(header.ljust(mbf_v2_header_size, b"\0"))
+            fp.write(capture.ids)
+            fp.write(capture.data)
+    elif (version == 3):
+        if (max(capture.size) > 0xffff):
+            raise ValueError("Capture too large for mbf version 3")
+        indexes = capture.solid_indexes()
+        with atomic_write(filename, 'wb') as fp:
+            header = mbf_v3_header.pack(mbf_v3_magic, mbf_v2_header_size,
+                capture.axis_order.encode('ascii'), *(capture.origin + capture.size + (len(indexes),)))
+            fp.write(header.ljust(mbf_v2_header_size, b"\0"))
+            entries = bytearray(len(indexes) * mbf_v3_entry.size)
+            offset = 0
+            for index in indexes:
+                mbf_v3_entry.pack_into(entries, offset, *capture.position(index), capture.ids[index], capture.data[index])
+                offset += mbf_v3_entry.size
+            fp.write(entries)
+    else:
+        raise ValueError("Unsupported mbf version {}".format(version))
+
+
+# Create a version 2 file of air for an area, the blocks are then
+# written with patch_mbf. The file is extended without writing the
+# blocks so it is quick to create even for a very large area.
+def create_mbf (filename, origin, size):
+    with open(filename, 'wb') as fp:
+        header = mbf_v2_header.pack(mbf_v2_magic, mbf_v2_header_size,
+            default_axis_order.encode('ascii'), *(tuple(origin) + tuple(size)))
+        fp.write(header.ljust(mbf_v2_header_size, b"\0"))
+        fp.truncate(mbf_v2_header_size + 2 * size[0] * size[1] * size[2])
+
+
+# Write tiles (BlockCaptures within the area of the file) into a version
+# 2 file in place, so only the rows of the tiles are written rather than
+# the whole file (see mcpcapture.capture_incremental)
+# Returns False without changing the file if it is not version 2 or a
+# tile is outside its area - then the file needs saving in full
+def patch_mbf (filename, tiles):
+    if (detect_version(filename) != 2):
+        return False
+    with open(filename, 'r+b') as fp:
+        (magic, header_size, axis_order, ox, oy, oz, sx, sy, sz) = mbf_v2_header.unpack(fp.read(mbf_v2_header.size))
+        capture = BlockCapture((ox,oy,oz), (sx,sy,sz), ids=b"", data=b"", axis_order=axis_order.decode('ascii'))
+        if (fp.seek(0, os.SEEK_END) < header_size + 2 * len(capture)):
+            raise ValueError("Truncated mbf file "+filename)
+        for tile in tiles:
+            for i in range(3):
+                offset = tile.origin[i] - capture.origin[i]
+                if (offset < 0 or offset + tile.size[i] > capture.size[i]):
+                    return False
+        num_blocks = len(capture)
+        for tile in tiles:
+            (offset_x, offset_y, offset_z) = (tile.origin[i] - capture.origin[i] for i in range(3))
+            (size_x, size_y, size_z) = tile.size
+            for y in range (0, size_y):
+                for x in range (0, size_x):
+                    source = tile.index(x, y, 0)
+                    dest = header_size + capture.index(offset_x + x, offset_y + y, offset_z)
+                    fp.seek(dest)
+                    fp.write(tile.ids[source:source+size_z])
+                    fp.seek(dest + num_blocks)
+                    fp.write(tile.data[source:source+size_z])
+    return True
+
+
+# Convert a file to a different version (default upgrade to version 2)
+# Returns True if the file was converted, False if already that version
+def upgrade_mbf (filename, version = 2):
+    if (detect_version(filename) == version):
+        return False
+    with load_mbf(filename, use_mmap=False) as capture:
+        save_mbf(filename, capture, version)
+    return True
@@ -0,0 +1,280 @@
+##########################################################################
+# mcpasync.py
+# asyncio client for the Minecraft (mcpi) protocol
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# The mcpi connection waits for each reply before sending the next
+# request. AsyncMinecraft sends requests without waiting - replies are
+# returned by the server in the same order as the requests (commands
+# without a reply, eg. setBlock, don't have one) so each reply is
+# matched to the oldest request still waiting. Up to window requests are
+# waiting at a time so the replies don't fill the socket buffers.
+# Any number of connections (to one or several servers) can be used from
+# the same event loop, eg. capture_async fetches tiles over all of them.
+#
+# Does not need the mcpi package.
+#
+# async def example ():
+#     mc = await AsyncMinecraft.connect("localhost", 4711)
+#     blocks = await mc.get_blocks_with_data([(0,0,0), (1,0,0)])
+#     await mc.close()
+# asyncio.run(example())
+#
+###########################################################################
+
+import asyncio
+import time
+from collections import deque
+from mbffile import BlockCapture
+from mcpcapture import CancelledError, default_pipeline_size, default_tile_size, split_tiles, stitch_tile
+
+
+# Number of requests waiting for a reply on each connection
+default_window = default_pipeline_size
+
+# Bytes written before waiting for the socket to send them
+default_write_buffer = 64 * 1024
+
+# Replies can be long (getBlocks of a large tile)
+reply_limit = 64 * 1024 * 1024
+
+
+class AsyncMinecraft():
+
+    def __init__ (self, reader, writer, tracer = None, window = default_window):
+        self.reader = reader
+        self.writer = writer
+        self.tracer = tracer
+        # Requests waiting for a reply (future, command, time sent)
+        self.waiting = deque()
+        self.window = asyncio.Semaphore(window)
+        # Bytes written since the last drain
+        self.unsent = 0
+        # Exception which closed the connection (eg. server disconnected)
+        self.error = None
+        self.replies = asyncio.ensure_future(self._read_replies())
+
+    # Connect to the server - mc = await AsyncMinecraft.connect(...)
+    # tracer (optional) counts the commands (see mcptrace)
+    @classmethod
+    async def connect (cls, address = "localhost", port = 4711, tracer = None, window = default_window):
+        (reader, writer) = await asyncio.open_connection(address, port, limit=reply_limit)
+        return cls(reader, writer, tracer, window)
+
+    async def close (self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+        self.replies.cancel()
+        try:
+            await self.replies
+        except asyncio.CancelledError:
+            pass
+        self._fail(ConnectionError("Connection closed"))
+
+    # Queue a command without a reply (sent when the event loop runs)
+    def send (self, command, *args):
+        if (self.error != None):
+            raise self.error
+        line = b"%s(%s)\n" % (command.encode("cp437"), ",".join(str(value) for value in args).encode("cp437"))
+        self.writer.write(line)
+        self.unsent += len(line)
+        if (self.tracer != None):
+            self.tracer.command_sent(command, len(line))
+
+    # Send a command and return a future for the reply (str)
+    # Waits if window requests are already waiting for replies
+    async def request (self, command, *args):
+        await self.window.acquire()
+        if (self.error != None):
+            self.window.release()
+            raise self.error
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append((future, command, time.perf_counter()))
+        self.send(command, *args)
+        if (self.unsent >= default_write_buffer):
+            await self.drain()
+        return future
+
+    # Wait until the queued commands are sent to the socket
+    async def drain (self):
+        self.unsent = 0
+        await self.writer.drain()
+
+    # Wait until the server has run all the commands sent - replies are
+    # in order so a reply means the commands before it are complete
+    async def sync (self):
+        await self.getHeight(0, 0)
+
+    async def _read_replies (self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if (line == b""):
+                    raise ConnectionError("Server closed the connection")
+                now = time.perf_counter()
+                if (len(self.waiting) == 0):
+                    # Not a reply to any request - ignored like mcpi drain
+                    continue
+                (future, command, sent_time) = self.waiting.popleft()
+                self.window.release()
+                if (self.tracer != None):
+                    self.tracer.reply_received(command, len(line), now - sent_time)
+                reply = line.rstrip(b"\n").decode("cp437")
+                if (future.done()):
+                    continue
+                if (reply == "Fail"):
+                    future.set_exception(IOError("{} failed".format(command)))
+                else:
+                    future.set_result(reply)
+        except Exception as e:
+            self._fail(e)
+
+    # Fail all the waiting requests (and any new ones)
+    def _fail (self, error):
+        if (self.error == None):
+            self.error = error
+        while (len(self.waiting) > 0):
+            (future, command, sent_time) = self.waiting.popleft()
+            self.window.release()
+            if (not future.done()):
+                future.set_exception(error)
+
+    # Same methods as mcpi (world and player), except positions are tuples
+    async def getBlock (self, x, y, z):
+        return int(await (await self.request("world.getBlock", x, y, z)))
+
+    async def getBlockWithData (self, x, y, z):
+        (block_id, block_data) = (await (await self.request("world.getBlockWithData", x, y, z))).split(",")
+        return (int(block_id), int(block_data))
+
+    async def getBlocks (self, x0, y0, z0, x1, y1, z1):
+        reply = await (await self.request("world.getBlocks", x0, y0, z0, x1, y1, z1))
+        return [int(value) for value in reply.split(",")]
+
+    async def getHeight (self, x, z):
+        return int(await (await self.request("world.getHeight", x, z)))
+
+    async def getTilePos (self):
+        return tuple(int(value) for value in (await (await self.request("player.getTile"))).split(","))
+
+    def setBlock (self, x, y, z, block_id, block_data = 0):
+        self.send("world.setBlock", x, y, z, block_id, block_data)
+
+    def setBlocks (self, x0, y0, z0, x1, y1, z1, block_id, block_data = 0):
+        self.send("world.setBlocks", x0, y0, z0, x1, y1, z1, block_id, block_data)
+
+    def setPos (self, x, y, z):
+        self.send("player.setPos", x, y, z)
+
+    def postToChat (self, message):
+        self.send("chat.post", message)
+
+    # Get (id, data) for a list of (x,y,z) positions - all requested
+    # without waiting for the replies (up to window at a time)
+    async def get_blocks_with_data (self, positions):
+        futures = [await self.request("world.getBlockWithData", *position) for position in positions]
+        await self.drain()
+        results = []
+        for reply in await asyncio.gather(*futures):
+            (block_id, block_data) = reply.split(",")
+            results.append((int(block_id), int(block_data)))
+        return results
+
+    # Get the height of a list of (x,z) columns (see get_blocks_with_data)
+    async def get_heights (self, columns):
+        futures = [await self.request("world.getHeight", *column) for column in columns]
+        await self.drain()
+        return [int(reply) for reply in await asyncio.gather(*futures)]
+
+    # Sends boxes (x0,y0,z0,x1,y1,z1,id,data) from mcprestore.plan_restore
+    # single blocks use setBlock
+    # progress is an optional callback, returns True to cancel
+    # Returns the number of commands sent, or None if cancelled
+    async def set_boxes (self, boxes, progress = None):
+        for count in range (0, len(boxes)):
+            (x0, y0, z0, x1, y1, z1, block_id, block_data) = boxes[count]
+            if ((x0, y0, z0) == (x1, y1, z1)):
+                self.setBlock(x0, y0, z0, block_id, block_data)
+            else:
+                self.setBlocks(x0, y0, z0, x1, y1, z1, block_id, block_data)
+            if (self.unsent >= default_write_buffer):
+                await self.drain()
+            if (progress != None and count % 1000 == 0):
+                if (progress((count / len(boxes)) * 100)):
+                    await self.drain()
+                    return None
+        await self.drain()
+        return len(boxes)
+
+
+# Read a single tile using getBlocks, blocks with an id in data_blocks
+# are read again to get the data value (see mcpcapture.fetch_tile)
+async def fetch_tile_async (mc, tile_start, tile_size, data_blocks = ()):
+    (start_x, start_y, start_z) = tile_start
+    (size_x, size_y, size_z) = tile_size
+    tile = BlockCapture(tile_start, tile_size)
+    blocks = await mc.getBlocks(start_x, start_y, start_z, start_x+size_x-1, start_y+size_y-1, start_z+size_z-1)
+    if (len(blocks) != len(tile)):
+        raise IOError("getBlocks returned {} blocks, expected {}".format(len(blocks), len(tile)))
+    tile.ids[:] = bytes(blocks)
+    indexes = [index for index in range (0, len(blocks)) if blocks[index] in data_blocks]
+    positions = []
+    for index in indexes:
+        (x, y, z) = tile.position(index)
+        positions.append((start_x + x, start_y + y, start_z + z))
+    for (index, (block_id, block_data)) in zip(indexes, await mc.get_blocks_with_data(positions)):
+        tile.ids[index] = block_id
+        tile.data[index] = block_data
+    return tile
+
+
+# Capture an area in tiles shared between the connections (clients)
+# Each connection has tiles_in_flight tiles requested at a time, so the
+# next getBlocks is sent before the reply to the last has arrived
+# progress is called as each tile completes, returns True to cancel
+async def capture_async (clients, start_position, size, tile_size = default_tile_size, data_blocks = (),
+        progress = None, tiles_in_flight = 2):
+    capture = BlockCapture(start_position, size)
+    tiles = deque(split_tiles(start_position, size, tile_size))
+    total = len(tiles)
+    completed = 0
+
+    async def worker (mc):
+        nonlocal completed
+        while (len(tiles) > 0):
+            tile = await fetch_tile_async(mc, *tiles.popleft(), data_blocks)
+            stitch_tile(capture, tile)
+            completed += 1
+            if (progress != None and progress((completed / total) * 100)):
+                raise CancelledError()
+
+    workers = [asyncio.ensure_future(worker(mc)) for mc in clients for count in range (0, tiles_in_flight)]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    return capture
+
+
+# Sends the boxes from plan_restore on the first connection and waits
+# until the server has set them all (see AsyncMinecraft.set_boxes)
+async def write_boxes_async (clients, boxes, progress = None):
+    commands = await clients[0].set_boxes(boxes, progress)
+    await clients[0].sync()
+    return commands
+
+
+# Connect to each (address, port) - several connections to the same
+# server are allowed
+async def connect_all (servers, tracer = None):
+    return list(await asyncio.gather(*(AsyncMinecraft.connect(address, port, tracer) for (address, port) in servers)))
+
+
+async def close_all (clients):
+    await asyncio.gather(*(mc.close() for mc in clients))
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+import sys, os
+import argparse
+import json
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import mcpcore
+from mcpcore import McprintEngine
+from mcpblocks import load_registry
+from mbffile import BlockCapture, block_stats, iter_blocks, load_mbf, save_mbf
+
+# NumPy is required to generate the worlds
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+##########################################################################
+# mcpbench.py [options]
+# Offline benchmark of the minecraft-print readers and converters
+# Does not need Minecraft, mcpi or PyQt5 - requires NumPy
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Options:
+#     --sizes 32x32x32 128x64x128   worlds to generate (x by y by z)
+#     --layout terrain|random       height map or scattered blocks
+#     --fill 0.3                    proportion of the world that is solid
+#     --stairs 0.05 --slabs 0.05    proportion of solid blocks that are
+#                                   stairs / slabs (half blocks)
+#     --formats 1 2 3               mbf versions to save the worlds as
+#     --cases load_mbf convert_merged ...   default is all cases
+#     --repeat 3                    time is the fastest of the repeats
+#     --output results.json         save results
+#     --compare old.json            report changes against earlier results
+#     --threshold 1.2               ratio of time / memory which is a
+#                                   regression (exit status 1)
+#
+# Results are saved as json with one entry for each world, format and
+# case: seconds, blocks_per_second, peak_memory (bytes), output_size
+# (bytes). Peak memory is measured with tracemalloc in a separate run
+# (as it slows the code down) and is memory allocated by Python and
+# NumPy - it does not include memory mapped files.
+#
+###########################################################################
+
+
+# Increase if the results change so they can't be compared
+results_version = 1
+
+# Standard blocks used to build the worlds - stone, grass, dirt,
+# cobblestone, wood, sandstone, brick, stone brick
+world_blocks = [1, 2, 3, 4, 17, 24, 45, 98]
+
+# Time and memory below these are not compared (too small to measure)
+compare_min_seconds = 0.05
+compare_min_memory = 1024 * 1024
+
+
+# Cases - each takes (engine, filename, output filename) and returns
+# the filename of the output or None
+def case_load_mbf (engine, filename, output_filename):
+    with load_mbf(filename) as capture:
+        # copy so a memory mapped file is actually read
+        bytes(capture.ids)
+        bytes(capture.data)
+
+def case_iter_blocks (engine, filename, output_filename):
+    for this_block in iter_blocks(filename, skip_air=True):
+        pass
+
+def case_block_stats (engine, filename, output_filename):
+    with load_mbf(filename) as capture:
+        block_stats(capture, engine.blocks.excluded_ids())
+
+def case_load_mbf_dimensions (engine, filename, output_filename):
+    engine.load_mbf_dimensions(filename)
+
+def case_get_file_info (engine, filename, output_filename):
+    engine.get_file_info(filename)
+
+def case_convert_blocks (engine, filename, output_filename):
+    engine.convert_to_openscad_file(filename, output_filename + ".scad", mode='blocks')
+    return output_filename + ".scad"
+
+def case_convert_merged (engine, filename, output_filename):
+    engine.convert_to_openscad_file(filename, output_filename + ".scad", mode='merged')
+    return output_filename + ".scad"
+
+def case_convert_hollow (engine, filename, output_filename):
+    engine.wall_thickness = 1
+    engine.convert_to_openscad_file(filename, output_filename + ".scad", mode='merged')
+    return output_filename + ".scad"
+
+def case_mesh_stl (engine, filename, output_filename):
+    engine.export_mesh(filename, output_filename + ".stl")
+    return output_filename + ".stl"
+
+def case_mesh_3mf (engine, filename, output_filename):
+    engine.export_mesh(filename, output_filename + ".3mf")
+    return output_filename + ".3mf"
+
+cases = {
+    'load_mbf':case_load_mbf,
+    'iter_blocks':case_iter_blocks,
+    'block_stats':case_block_stats,
+    'load_mbf_dimensions':case_load_mbf_dimensions,
+    'get_file_info':case_get_file_info,
+    'convert_blocks':case_convert_blocks,
+    'convert_merged':case_convert_merged,
+    'convert_hollow':case_convert_hollow,
+    'mesh_stl':case_mesh_stl,
+    'mesh_3mf':case_mesh_3mf
+    }
+
+
+# "64x32x64" to (64, 32, 64)
+def parse_size (text):
+    size = tuple(int(value) for value in text.lower().split("x"))
+    if (len(size) != 3 or min(size) < 1):
+        raise argparse.ArgumentTypeError("size must be XxYxZ eg. 64x32x64")
+    return size
+
+
+def world_name (size, layout, fill, stairs, slabs):
+    return "{}x{}x{}-{}-f{}-s{}-h{}".format(size[0], size[1], size[2], layout, fill, stairs, slabs)
+
+
+# Returns a BlockCapture of a synthetic world
+# layout 'terrain' is solid up to a rolling height map (so large areas
+# can be merged), 'random' has each block solid with probability fill
+# stairs and slabs are the proportion of solid blocks of each
+# The world is built a layer at a time so memory is only the capture
+def generate_world (size, layout = 'terrain', fill = 0.3, stairs = 0.05, slabs = 0.05, seed = 1):
+    registry = load_registry()
+    stair_ids = registry.ids_where(lambda shape: shape != None and shape.mesh == 'stair')
+    slab_ids = registry.ids_where(lambda shape: shape != None and shape.mesh == 'half')
+    random = numpy.random.RandomState(seed)
+    (size_x, size_y, size_z) = size
+    capture = BlockCapture((0, 0, 0), size)
+    # height map averaging fill of the height
+    wave = numpy.sin(numpy.arange(size_x) / 7.0)[:, None] + numpy.cos(numpy.arange(size_z) / 11.0)[None, :]
+    height = fill * size_y * (1 + 0.25 * wave)
+    layer_size = size_x * size_z
+    for y in range (0, size_y):
+        if (layout == 'terrain'):
+            solid = y < height
+        else:
+            solid = random.random_sample((size_x, size_z)) < fill
+        ids = numpy.where(solid, random.choice(world_blocks, (size_x, size_z)), 0)
+        data = numpy.zeros((size_x, size_z), dtype=numpy.uint8)
+        shape_chance = random.random_sample((size_x, size_z))
+        is_stair = solid & (shape_chance < stairs)
+        is_slab = solid & (shape_chance >= stairs) & (shape_chance < stairs + slabs)
+        ids[is_stair] = random.choice(stair_ids, int(is_stair.sum()))
+        data[is_stair] = random.randint(0, 8, int(is_stair.sum()))
+        ids[is_slab] = random.choice(slab_ids, int(is_slab.sum()))
+        data[is_slab] = random.randint(0, 16, int(is_slab.sum()))
+        start = y * layer_size
+        capture.ids[start:start+layer_size] = ids.astype(numpy.uint8).tobytes()
+        capture.data[start:start+layer_size] = data.tobytes()
+    return capture
+
+
+# Runs case, returns the result (dict)
+def measure_case (case, filename, output_filename, repeat):
+    times = []
+    for count in range (0, repeat):
+        engine = McprintEngine()
+        start_time = time.perf_counter()
+        output = cases[case](engine, filename, output_filename)
+        times.append(time.perf_counter() - start_time)
+    result = {'seconds':min(times), 'output_size':None}
+    if (output != None):
+        result['output_size'] = os.path.getsize(output)
+        os.remove(output)
+    # Again to measure the memory
+    engine = McprintEngine()
+    tracemalloc.start()
+    try:
+        output = cases[case](engine, filename, output_filename)
+        result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    if (output != None):
+        os.remove(output)
+    return result
+
+
+# Returns a readable size in bytes
+def format_bytes (value):
+    if (value == None):
+        return "-"
+    for unit in ["B", "KB", "MB"]:
+        if (value < 1024):
+            return "{:.1f}{}".format(value, unit)
+        value /= 1024
+    return "{:.1f}GB".format(value)
+
+
+# Runs all the cases for each world / format, returns list of results
+def run_benchmarks (args, work_dir):
+    results = []
+    for size in args.sizes:
+        name = world_name(size, args.layout, args.fill, args.stairs, args.slabs)
+        capture = generate_world(size, args.layout, args.fill, args.stairs, args.slabs, args.seed)
+        num_blocks = len(capture)
+        for mbf_version in args.formats:
+            filename = os.path.join(work_dir, "{}-v{}.mbf".format(name, mbf_version))
+            save_mbf(filename, capture, mbf_version)
+            input_size = os.path.getsize(filename)
+            for case in args.cases:
+                result = {'world':name, 'format':mbf_version, 'case':case,
+                    'blocks':num_blocks, 'input_size':input_size}
+                try:
+                    result.update(measure_case(case, filename, os.path.join(work_dir, "output"), args.repeat))
+                except Exception as e:
+                    result['error'] = "{}: {}".format(type(e).__name__, e)
+                    print ("{} v{} {}: {}".format(name, mbf_version, case, result['error']))
+                    results.append(result)
+                    continue
+                results.append(result)
+                result['blocks_per_second'] = num_blocks / result['seconds'] if result['seconds'] > 0 else None
+                print ("{} v{} {:20} {:8.3f}s {:>12.0f} blocks/s  memory {:>9}  output {:>9}".format(
+                    name, mbf_version, case, result['seconds'], result['blocks_per_second'] or 0,
+                    format_bytes(result['peak_memory']), format_bytes(result['output_size'])))
+            os.remove(filename)
+        del capture
+    return results
+
+
+# Compare results against earlier results (same world, format, case)
+# Returns the number of regressions - time or memory more than
+# threshold times the earlier result
+def compare_results (results, old_results, threshold):
+    old = {}
+    for result in old_results['results']:
+        old[(result['world'], result['format'], result['case'])] = result
+    regressions = 0
+    for result in results:
+        old_result = old.get((result['world'], result['format'], result['case']))
+        if (old_result == None or 'error' in result or 'error' in old_result):
+            continue
+        changes = []
+        for (key, minimum) in (('seconds', compare_min_seconds), ('peak_memory', compare_min_memory)):
+            if (result[key] == None or old_result[key] == None or max(result[key], old_result[key]) < minimum):
+                continue
+            ratio = result[key] / max(old_result[key], 1e-9)
+            changes.append("{} x{:.2f}".format(key, ratio))
+            if (ratio > threshold):
+                changes[-1] += " REGRESSION"
+                regressions += 1
+        if (result['output_size'] != old_result['output_size']):
+            changes.append("output_size {} was {}".format(result['output_size'], old_result['output_size']))
+        print ("{} v{} {:20} {}".format(result['world'], result['format'], result['case'], ", ".join(changes)))
+    return regressions
+
+
+def create_parser ():
+    parser = argparse.ArgumentParser(description="Benchmark minecraft-print readers and converters")
+    parser.add_argument("--sizes", type=parse_size, nargs="+", default=[(32,32,32), (64,64,64), (128,64,128)], metavar="XxYxZ")
+    parser.add_argument("--layout", choices=["terrain","random"], default="terrain", help="height map or scattered blocks")
+    parser.add_argument("--fill", type=float, default=0.3, help="proportion of the world that is solid")
+    parser.add_argument("--stairs", type=float, default=0.05, help="proportion of solid blocks that are stairs")
+    parser.add_argument("--slabs", type=float, default=0.05, help="proportion of solid blocks that are slabs")
+    parser.add_argument("--formats", type=int, nargs="+", choices=[1,2,3], default=[1,2,3], help="mbf versions")
+    parser.add_argument("--cases", nargs="+", choices=list(cases.keys()), default=list(cases.keys()))
+    parser.add_argument("--repeat", type=int, default=1, help="time is the fastest of the repeats")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the worlds")
+    parser.add_argument("--output", default=None, help="save results (json)")
+    parser.add_argument("--compare", default=None, help="earlier results (json) to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="ratio which is a regression")
+    parser.add_argument("--work-dir", default=None, help="directory for the generated files (default temporary)")
+    return parser
+
+
+def main (argv = None):
+    args = create_parser().parse_args(argv)
+    if (numpy == None):
+        print ("The benchmark requires NumPy")
+        return 1
+    mcpcore.debug = False
+    work_dir = args.work_dir
+    if (work_dir == None):
+        work_dir = tempfile.mkdtemp(prefix="mcpbench-")
+    else:
+        os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = run_benchmarks(args, work_dir)
+    finally:
+        if (args.work_dir == None):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {
+        'version':results_version,
+        'date':time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python':platform.python_version(),
+        'numpy':numpy.__version__,
+        'platform':platform.platform(),
+        'settings':{'layout':args.layout, 'fill':args.fill, 'stairs':args.stairs,
+            'slabs':args.slabs, 'repeat':args.repeat, 'seed':args.seed},
+        'results':results
+        }
+    if (args.output != None):
+        with open(args.output, 'w') as fp:
+            json.dump(output, fp, indent=1)
+
+    if (args.compare != None):
+        with open(args.compare, 'r') as fp:
+            old_results = json.load(fp)
+        if (old_results.get('version') != results_version):
+            print ("Results in {} are a different version".format(args.compare))
+            return 1
+        regressions = compare_results(results, old_results, args.threshold)
+        print ("{} regressions".format(regressions))
+        if (regressions > 0):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
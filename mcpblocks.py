@@ -0,0 +1,166 @@
+##########################################################################
+# mcpblocks.py
+# Block registry - which shape (OpenSCAD module) is used for each block
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# The registry is loaded from a config file (data-files/blocks.ini) and
+# compiled into a 256 entry table giving the shape for each block id,
+# so classifying a block is a single index, and classifying a whole
+# capture is a single NumPy gather (see mask).
+#
+###########################################################################
+
+import os
+import copy
+import configparser
+
+# NumPy is optional - only needed for mask()
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+default_blocks_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data-files", "blocks.ini")
+
+# Geometry for mesh export (see mcpmesh)
+mesh_shapes = ['full', 'stair', 'half']
+# Shapes which depend on the adjacent blocks (see mcpneighbours)
+neighbour_rules = ['stair', 'fence', 'pane']
+# Rules where all the data comes from the adjacent blocks (stairs have
+# their direction in the Minecraft data, and only the corners are added)
+derived_rules = ['fence', 'pane']
+
+
+class BlockShape():
+
+    # name - used in the registry, module - OpenSCAD module
+    # data - module is passed the block data
+    # mesh - geometry for mesh export
+    # merge - adjacent blocks can be merged into a cube
+    # neighbours - rule used to set the data from the adjacent blocks
+    def __init__ (self, name, module = None, data = False, mesh = 'full', merge = False, neighbours = None):
+        if (not mesh in mesh_shapes):
+            raise ValueError("Unknown mesh {} for shape {}".format(mesh, name))
+        if (neighbours != None and not neighbours in neighbour_rules):
+            raise ValueError("Unknown neighbours {} for shape {}".format(neighbours, name))
+        self.name = name
+        self.module = module or name
+        self.data = data
+        self.mesh = mesh
+        self.merge = merge
+        self.neighbours = neighbours
+
+    def __repr__ (self):
+        return "BlockShape({!r}, {!r}, {!r}, {!r}, {!r}, {!r})".format(self.name, self.module, self.data, self.mesh, self.merge, self.neighbours)
+
+
+class BlockRegistry():
+
+    # shapes is a list of BlockShape
+    # blocks is dict of block id to shape name, any other id uses default
+    # exclude is list of block ids which are not printed
+    def __init__ (self, shapes, blocks, exclude, default = 'standard_block'):
+        # Index 0 is excluded blocks (no shape)
+        self.shapes = [None] + list(shapes)
+        shape_index = {}
+        for index in range (1, len(self.shapes)):
+            shape_index[self.shapes[index].name] = index
+        for name in list(blocks.values()) + [default]:
+            if (not name in shape_index):
+                raise ValueError("Unknown shape "+name)
+        table = bytearray([shape_index[default]]) * 256
+        for (block_id, name) in blocks.items():
+            table[block_id] = shape_index[name]
+        # Air is never printed
+        for block_id in set(exclude) | {0}:
+            table[block_id] = 0
+        self.table = bytes(table)
+        self.default = shape_index[default]
+
+    # Returns the BlockShape for a block id, or None if excluded
+    def shape (self, block_id):
+        return self.shapes[self.table[block_id]]
+
+    def is_excluded (self, block_id):
+        return self.table[block_id] == 0
+
+    # Returns list of block ids where test(shape) is True
+    # shape is None for excluded blocks
+    def ids_where (self, test):
+        return [block_id for block_id in range (0, 256) if test(self.shapes[self.table[block_id]])]
+
+    def excluded_ids (self):
+        return self.ids_where(lambda shape: shape == None)
+
+    # Blocks which need the data read from Minecraft (passed to the
+    # module) - not when the data is set from the adjacent blocks
+    def data_ids (self):
+        return self.ids_where(lambda shape: shape != None and shape.data and not shape.neighbours in derived_rules)
+
+    # Returns a copy of the registry to use without neighbour analysis -
+    # blocks where the data is only set from the adjacent blocks (eg.
+    # fences) use the default shape (eg. a full block) instead
+    def without_neighbours (self):
+        registry = copy.copy(self)
+        table = bytearray(self.table)
+        for block_id in self.ids_where(lambda shape: shape != None and shape.neighbours in derived_rules):
+            table[block_id] = self.default
+        registry.table = bytes(table)
+        return registry
+
+    # Blocks which don't fill the whole block (excluded or not a full mesh)
+    def open_ids (self):
+        return self.ids_where(lambda shape: shape == None or shape.mesh != 'full')
+
+    # Returns boolean array the same shape as ids (NumPy array) where
+    # test(shape) is True - a single lookup for every block
+    def mask (self, ids, test):
+        lookup = numpy.array([test(shape) for shape in self.shapes], dtype=bool)
+        return lookup[numpy.frombuffer(self.table, dtype=numpy.uint8)][ids]
+
+    # Summary of the registry - changes if any block would be converted
+    # differently (used in conversion cache keys)
+    def signature (self):
+        return (self.table.hex(), repr(self.shapes))
+
+
+# Loads the registry from a config file (default data-files/blocks.ini)
+def load_registry (filename = None):
+    if (filename == None):
+        filename = default_blocks_filename
+    config = configparser.ConfigParser()
+    # Keep the case of shape names
+    config.optionxform = str
+    if (len(config.read(filename)) == 0):
+        raise IOError("Unable to read block registry "+filename)
+    shapes = []
+    for section in config.sections():
+        if (not section.startswith("shape:")):
+            continue
+        name = section[len("shape:"):]
+        shapes.append(BlockShape(name,
+            config.get(section, "module", fallback=name),
+            config.getboolean(section, "data", fallback=False),
+            config.get(section, "mesh", fallback='full'),
+            config.getboolean(section, "merge", fallback=False),
+            config.get(section, "neighbours", fallback=None)))
+    blocks = {}
+    exclude = []
+    default = 'standard_block'
+    for (option, value) in config.items("blocks"):
+        if (option == "default"):
+            default = value
+        elif (option == "exclude"):
+            exclude = _block_ids(value)
+        else:
+            for block_id in _block_ids(value):
+                blocks[block_id] = option
+    return BlockRegistry(shapes, blocks, exclude, default)
+
+
+# Comma separated list of block ids
+def _block_ids (value):
+    return [int(block_id) for block_id in value.split(",") if block_id.strip() != ""]
@@ -0,0 +1,140 @@
+##########################################################################
+# mcpcache.py
+# On disk cache of conversion results
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Results are stored under a key made from a hash of the contents of the
+# mbf file and the settings used to convert it, so the same file
+# converted again (even if renamed or copied) is read from the cache.
+# Settings which only scale the output (block size) are not part of the
+# key - the cached result is scaled when it is used.
+# The hash of each file is remembered against its path, inode, size and
+# modification / change times so that unchanged files are not read
+# again. A file modified in the last racy_seconds is always hashed, as
+# it could be changed again (eg. patched in place keeping the same size)
+# within the resolution of the timestamps.
+# When the cache is larger than max_size the least recently used
+# results are removed - a result larger than max_size is not kept.
+#
+###########################################################################
+
+import os
+import hashlib
+import time
+from mbffile import atomic_write, read_buffer_size
+
+
+default_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "minecraft-print")
+default_cache_size = 256 * 1024 * 1024
+
+# Increase if the format of any cached result changes
+cache_version = 1
+
+# Files modified more recently than this (seconds) are always hashed
+racy_seconds = 2
+
+
+class ConversionCache():
+
+    def __init__ (self, cache_dir = default_cache_dir, max_size = default_cache_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        # Number of results found / not found
+        self.hits = 0
+        self.misses = 0
+
+    # Returns hash of the contents of filename
+    def file_hash (self, filename):
+        file_stat = os.stat(filename)
+        stat_key = "{}|{}|{}|{}|{}|{}".format(os.path.abspath(filename), file_stat.st_dev, file_stat.st_ino,
+            file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ctime_ns)
+        stat_filename = self._path(hashlib.sha256(stat_key.encode()).hexdigest(), ".hash")
+        racy = time.time() - max(file_stat.st_mtime, file_stat.st_ctime) < racy_seconds
+        if (not racy):
+            try:
+                with open(stat_filename, 'r') as fp:
+                    return fp.read()
+            except OSError:
+                pass
+        content_hash = hashlib.sha256()
+        with open(filename, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(read_buffer_size), b""):
+                content_hash.update(chunk)
+        if (not racy):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with atomic_write(stat_filename) as fp:
+                fp.write(content_hash.hexdigest())
+        return content_hash.hexdigest()
+
+    # Key for the result of converting filename
+    # kind is the type of result eg. "scad", settings is a dict
+    def key (self, filename, kind, settings):
+        settings_text = repr(sorted(settings.items()))
+        key_text = "{}|{}|{}|{}".format(cache_version, self.file_hash(filename), kind, settings_text)
+        return hashlib.sha256(key_text.encode()).hexdigest()
+
+    def _path (self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    # Returns the filename of a cached result, or None if not cached
+    def get (self, key, suffix):
+        filename = self._path(key, suffix)
+        if (not os.path.isfile(filename)):
+            self.misses += 1
+            return None
+        # Mark as recently used
+        os.utime(filename)
+        self.hits += 1
+        return filename
+
+    # Write a result to the cache - write(fp) writes the result, which is
+    # only stored if it completes
+    # The result is never evicted to make room for itself (only other
+    # results are) unless it is larger than max_size, which is not kept
+    # Returns the filename of the stored result, or None if too large
+    def put (self, key, suffix, write, mode = 'w'):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        filename = self._path(key, suffix)
+        with atomic_write(filename, mode) as fp:
+            write(fp)
+        if (os.path.getsize(filename) > self.max_size):
+            os.remove(filename)
+            return None
+        self.evict(keep=filename)
+        return filename
+
+    # Remove least recently used results until within max_size
+    # keep is a result which is not removed (eg. just written)
+    def evict (self, keep = None):
+        entries = []
+        total_size = 0
+        for this_entry in os.scandir(self.cache_dir):
+            if (not this_entry.is_file() or this_entry.name.endswith(".tmp")):
+                continue
+            if (this_entry.path == keep):
+                total_size += this_entry.stat().st_size
+                continue
+            entry_stat = this_entry.stat()
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, this_entry.path))
+            total_size += entry_stat.st_size
+        # Results too large to ever fit are removed first, rather than
+        # removing everything else
+        entries.sort(key=lambda entry: (entry[1] <= self.max_size, entry[0]))
+        for (mtime, size, path) in entries:
+            if (total_size <= self.max_size):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+    # Remove all results
+    def clear (self):
+        if (not os.path.isdir(self.cache_dir)):
+            return
+        for this_entry in os.scandir(self.cache_dir):
+            if (this_entry.is_file()):
+                os.remove(this_entry.path)
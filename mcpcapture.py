@@ -0,0 +1,487 @@
+##########################################################################
+# mcpcapture.py
+# Capture strategies for reading blocks from Minecraft into a BlockCapture
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Large areas are split into tiles, each fetched with its own getBlocks
+# request. Tiles are fetched concurrently over a pool of connections and
+# stitched back into the capture in the same y, x, z order as a single
+# getBlocks would return.
+# Very large areas can be captured straight to a file, with a journal so
+# that a failed or cancelled capture can be resumed (capture_to_file).
+#
+###########################################################################
+
+import os
+import json
+import itertools
+import queue
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from mbffile import BlockCapture, create_mbf, patch_mbf, read_bounds, detect_version
+
+
+# Default tile size (x,y,z) - 32k blocks per getBlocks request
+default_tile_size = (32, 32, 32)
+
+# Default chunk size (x,y,z) for an incremental capture - smaller than
+# the tiles so the blocks read again scale with the size of the change
+default_chunk_size = (16, 16, 16)
+
+# Number of getBlockWithData requests sent before reading the replies
+# Limited so that the server's replies don't fill the socket buffers
+# whilst we are still sending
+default_pipeline_size = 4096
+
+# Layers read above the height of each column (see capture_columns)
+# getHeight on some servers ignores blocks without a collision box (eg.
+# a torch or flower on top of the column)
+height_margin = 1
+
+
+# A tile which fails (eg. dropped connection or server error) is tried
+# again on a new connection up to default_retries times (see fetch_tiles)
+# Waits retry_wait seconds before the first retry, doubling for each
+# retry up to retry_max_wait
+default_retries = 5
+retry_wait = 0.5
+retry_max_wait = 30
+
+# Raised when an operation is cancelled through the progress callback
+class CancelledError(Exception):
+    pass
+
+
+# Returns a progress callback which maps 0 to 100 onto start to end of
+# another progress callback (for operations with several stages)
+def scale_progress (progress, start, end):
+    if (progress == None):
+        return None
+    return lambda value: progress(start + (value * (end - start) / 100))
+
+
+# Pool of Minecraft connections
+# Connections are created on demand (up to size) using factory
+# A connection that fails during a request is discarded (and closed) as
+# the socket may have replies still waiting to be read
+# Shared connections are never closed by the pool, they belong to the
+# caller
+class ConnectionPool():
+
+    def __init__ (self, factory, size = 1, connections = None):
+        self.factory = factory
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # Existing connections (eg. the GUI connection) can be shared
+        self._shared = list(connections) if connections != None else []
+        if (connections != None):
+            for mc in connections:
+                self._idle.put(mc)
+                self._created += 1
+
+    def acquire (self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if (create):
+                self._created += 1
+        if (create):
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    def release (self, mc):
+        self._idle.put(mc)
+
+    def discard (self, mc):
+        with self._lock:
+            self._created -= 1
+        if (not mc in self._shared):
+            close_connection(mc)
+
+    # with pool.connection() as mc:
+    @contextmanager
+    def connection (self):
+        mc = self.acquire()
+        try:
+            yield mc
+        except Exception:
+            self.discard(mc)
+            raise
+        self.release(mc)
+
+    # Close the idle connections
+    def close (self):
+        while True:
+            try:
+                mc = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self.discard(mc)
+
+
+# Close the socket of an mcpi connection
+def close_connection (mc):
+    conn = getattr(mc, 'conn', None)
+    if (getattr(conn, 'socket', None) != None):
+        try:
+            conn.socket.close()
+        except OSError:
+            pass
+
+
+# Splits an area into tiles, returns list of (tile_start, tile_size)
+# Tiles are in y, x, z order
+def split_tiles (start_position, size, tile_size = default_tile_size):
+    tiles = []
+    for y in range (0, size[1], tile_size[1]):
+        for x in range (0, size[0], tile_size[0]):
+            for z in range (0, size[2], tile_size[2]):
+                tiles.append((
+                    (start_position[0] + x, start_position[1] + y, start_position[2] + z),
+                    (min(tile_size[0], size[0] - x), min(tile_size[1], size[1] - y), min(tile_size[2], size[2] - z))
+                    ))
+    return tiles
+
+
+# True if mc is an mcpi socket connection (requests can be pipelined)
+def can_pipeline (mc):
+    return getattr(getattr(mc, 'conn', None), 'socket', None) != None
+
+
+# Sends command for each set of arguments in bursts of pipeline_size,
+# before reading the replies, so the time is bandwidth bound rather than
+# one round trip per request
+# Returns list of the replies (bytes) in the same order as arguments
+def pipeline_requests (mc, command, arguments, pipeline_size = default_pipeline_size):
+    conn = mc.conn
+    replies = []
+    # Discard anything left on the socket from earlier commands
+    conn.drain()
+    for batch_start in range (0, len(arguments), pipeline_size):
+        batch = arguments[batch_start:batch_start+pipeline_size]
+        request = b"".join(b"%s(%s)\n" % (command, b",".join(b"%d" % value for value in values)) for values in batch)
+        conn.lastSent = request
+        conn.socket.sendall(request)
+        # mcpi creates a new file each receive - which can lose buffered
+        # replies, so read all the replies for the batch through one file
+        reply_file = conn.socket.makefile('rb')
+        for values in batch:
+            reply = reply_file.readline().rstrip(b"\n")
+            if (reply == b"" or reply == b"Fail"):
+                raise IOError("{}{} failed".format(command.decode(), tuple(values)))
+            replies.append(reply)
+        reply_file.close()
+    return replies
+
+
+# Get block id and data for a list of (x,y,z) positions
+# Requests are pipelined (see pipeline_requests)
+# If the connection is not an mcpi socket connection then each block
+# is requested in turn
+# Returns list of (id, data) in the same order as positions
+def get_blocks_with_data (mc, positions, pipeline_size = default_pipeline_size):
+    if (not can_pipeline(mc)):
+        results = []
+        for (x, y, z) in positions:
+            block_obj = mc.getBlockWithData(x, y, z)
+            results.append((block_obj.id, block_obj.data))
+        return results
+
+    results = []
+    for reply in pipeline_requests(mc, b"world.getBlockWithData", positions, pipeline_size):
+        (block_id, block_data) = reply.split(b",")
+        results.append((int(block_id), int(block_data)))
+    return results
+
+
+# Get the height (y of the highest non air block) of each x,z column in
+# the area - requests are pipelined (see pipeline_requests)
+# Returns list of heights in x, z order (index x*size_z + z)
+def get_heights (mc, start_position, size, pipeline_size = default_pipeline_size):
+    (start_x, start_y, start_z) = start_position
+    (size_x, size_y, size_z) = size
+    columns = [(start_x+x, start_z+z) for x in range (0, size_x) for z in range (0, size_z)]
+    if (not can_pipeline(mc)):
+        return [mc.getHeight(x, z) for (x, z) in columns]
+    return [int(reply) for reply in pipeline_requests(mc, b"world.getHeight", columns, pipeline_size)]
+
+
+# Capture an area reading each block with getBlockWithData (Minecraft Pi
+# does not support getBlocks) - requests for each layer are pipelined
+# If heights is set (from get_heights) then only the blocks up to the
+# height of each column (plus height_margin) are read, the blocks above
+# are air. Saves most of the requests for terrain, where much of the
+# area is the air above the ground.
+# progress is called after each layer (see capture_tiled)
+def capture_columns (mc, start_position, size, heights = None, progress = None):
+    (start_x, start_y, start_z) = start_position
+    (size_x, size_y, size_z) = size
+    capture = BlockCapture(start_position, size)
+    columns = [(x, z) for x in range (0, size_x) for z in range (0, size_z)]
+    if (heights != None):
+        # Layers are read up to the highest column
+        top = [heights[x * size_z + z] + height_margin - start_y for (x, z) in columns]
+        size_y = min(size_y, max(top, default=-1) + 1)
+    for y in range (0, size_y):
+        if (heights == None):
+            layer = columns
+        else:
+            layer = [columns[column] for column in range (0, len(columns)) if top[column] >= y]
+        positions = [(start_x+x, start_y+y, start_z+z) for (x, z) in layer]
+        for ((x, z), (block_id, block_data)) in zip(layer, get_blocks_with_data(mc, positions)):
+            index = capture.index(x, y, z)
+            capture.ids[index] = block_id
+            capture.data[index] = block_data
+        if (progress != None and progress((y / size_y) * 100)):
+            raise CancelledError()
+    return capture
+
+
+# Read a single tile using getBlocks
+# Blocks with an id in data_blocks are read again to get the data value
+# Returns a BlockCapture for the tile
+def fetch_tile (mc, tile_start, tile_size, data_blocks = ()):
+    tile = fetch_tile_ids(mc, tile_start, tile_size)
+    fetch_tile_data(mc, tile, data_blocks)
+    return tile
+
+
+# Read the block ids of a tile using getBlocks (data is left as 0)
+def fetch_tile_ids (mc, tile_start, tile_size):
+    (start_x, start_y, start_z) = tile_start
+    (size_x, size_y, size_z) = tile_size
+    tile = BlockCapture(tile_start, tile_size)
+    blocks = list(mc.getBlocks(start_x, start_y, start_z, start_x+size_x-1, start_y+size_y-1, start_z+size_z-1))
+    if (len(blocks) != len(tile)):
+        raise IOError("getBlocks returned {} blocks, expected {}".format(len(blocks), len(tile)))
+    tile.ids[:] = bytes(blocks)
+    return tile
+
+
+# Get the data for the blocks in tile with an id in data_blocks, in a
+# single pipelined burst
+def fetch_tile_data (mc, tile, data_blocks):
+    (start_x, start_y, start_z) = tile.origin
+    indexes = [index for index in range (0, len(tile)) if tile.ids[index] in data_blocks]
+    positions = []
+    for index in indexes:
+        (x, y, z) = tile.position(index)
+        positions.append((start_x + x, start_y + y, start_z + z))
+    for (index, (block_id, block_data)) in zip(indexes, get_blocks_with_data(mc, positions)):
+        tile.ids[index] = block_id
+        tile.data[index] = block_data
+
+
+# Copy the area of a tile out of the capture (opposite of stitch_tile)
+def extract_tile (capture, tile_start, tile_size):
+    tile = BlockCapture(tile_start, tile_size)
+    offset_x = tile.origin[0] - capture.origin[0]
+    offset_y = tile.origin[1] - capture.origin[1]
+    offset_z = tile.origin[2] - capture.origin[2]
+    (size_x, size_y, size_z) = tile.size
+    for y in range (0, size_y):
+        for x in range (0, size_x):
+            source = capture.index(offset_x + x, offset_y + y, offset_z)
+            dest = tile.index(x, y, 0)
+            tile.ids[dest:dest+size_z] = capture.ids[source:source+size_z]
+            tile.data[dest:dest+size_z] = capture.data[source:source+size_z]
+    return tile
+
+
+# Copy a tile into the capture - each z row is contiguous in both
+def stitch_tile (capture, tile):
+    offset_x = tile.origin[0] - capture.origin[0]
+    offset_y = tile.origin[1] - capture.origin[1]
+    offset_z = tile.origin[2] - capture.origin[2]
+    (size_x, size_y, size_z) = tile.size
+    for y in range (0, size_y):
+        for x in range (0, size_x):
+            source = tile.index(x, y, 0)
+            dest = capture.index(offset_x + x, offset_y + y, offset_z)
+            capture.ids[dest:dest+size_z] = tile.ids[source:source+size_z]
+            capture.data[dest:dest+size_z] = tile.data[source:source+size_z]
+
+
+# Capture an area by fetching tiles concurrently over the pool
+# One worker thread per pool connection
+# progress is an optional callback called with the percentage complete,
+# if it returns True then the capture is cancelled (CancelledError)
+def capture_tiled (pool, start_position, size, tile_size = default_tile_size, data_blocks = (), progress = None):
+    capture = BlockCapture(start_position, size)
+    tiles = split_tiles(start_position, size, tile_size)
+    for (area, tile) in fetch_tiles(pool, tiles, lambda mc, tile_start, this_tile_size:
+            fetch_tile(mc, tile_start, this_tile_size, data_blocks), progress):
+        stitch_tile(capture, tile)
+    return capture
+
+
+# Generator running fetch(mc, tile_start, tile_size) for each tile
+# concurrently over the pool (one worker thread per pool connection)
+# returning (tile, result) as they complete
+# A failed tile is tried again up to retries times (the connection is
+# discarded from the pool so the retry is on a new connection)
+# progress is called as each completes (see capture_tiled)
+# tiles_in_flight tiles per connection are fetched (or waiting to be
+# collected) at a time
+def fetch_tiles (pool, tiles, fetch, progress = None, retries = 0, tiles_in_flight = 2):
+    if (len(tiles) == 0):
+        return
+    # Set when stopping so a retry doesn't wait
+    stopping = threading.Event()
+
+    def fetch_from_pool (tile_start, tile_size):
+        attempt = 0
+        while True:
+            try:
+                with pool.connection() as mc:
+                    return ((tile_start, tile_size), fetch(mc, tile_start, tile_size))
+            except Exception:
+                if (attempt >= retries or stopping.is_set()):
+                    raise
+            if (stopping.wait(min(retry_wait * (2 ** attempt), retry_max_wait))):
+                raise CancelledError()
+            attempt += 1
+
+    completed = 0
+    remaining = iter(tiles)
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        # Only tiles_in_flight tiles are submitted at a time, so the
+        # memory used doesn't depend on the number of tiles
+        pending = set()
+        try:
+            for tile in itertools.islice(remaining, pool.size * tiles_in_flight):
+                pending.add(executor.submit(fetch_from_pool, *tile))
+            while pending:
+                # Timeout so that cancel is checked even if tiles are slow
+                (done, pending) = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    completed += 1
+                    for tile in itertools.islice(remaining, 1):
+                        pending.add(executor.submit(fetch_from_pool, *tile))
+                if (progress != None and progress((completed / len(tiles)) * 100)):
+                    raise CancelledError()
+        except BaseException:
+            # Don't start any more tiles (those in progress will finish)
+            stopping.set()
+            for future in pending:
+                future.cancel()
+            raise
+
+
+# Recapture an area which was captured before (previous) reading again
+# only the chunks which have changed. The ids of each chunk are read with
+# getBlocks and compared to previous - mcpi has no way to fingerprint
+# the blocks on the server, so the ids are the cheapest check. Only
+# chunks with different ids have the data read (which is one request per
+# block) and are copied into the new capture, so the requests depend on
+# the size of the changes.
+# A change to just the data of a block (eg. turning a stair) is missed
+# unless another block in the chunk changed. If check_data is set then
+# the data of every chunk is read and compared as well - this finds
+# every change, but has the same requests as a full capture.
+# Returns (capture, changed) where changed is a list of the chunks
+# (BlockCaptures) which were different from previous
+def capture_incremental (pool, previous, chunk_size = default_chunk_size, data_blocks = (), progress = None,
+        check_data = False):
+    capture = BlockCapture(previous.origin, previous.size, bytearray(previous.ids), bytearray(previous.data))
+    chunks = split_tiles(previous.origin, previous.size, chunk_size)
+
+    def fetch_changed (mc, chunk_start, this_chunk_size):
+        chunk = fetch_tile_ids(mc, chunk_start, this_chunk_size)
+        previous_chunk = extract_tile(capture, chunk_start, this_chunk_size)
+        if (chunk.ids != previous_chunk.ids):
+            fetch_tile_data(mc, chunk, data_blocks)
+            return chunk
+        if (not check_data):
+            return None
+        fetch_tile_data(mc, chunk, data_blocks)
+        # Only the data of data_blocks is read (previous may have the
+        # data of every block, eg. from a Pi capture)
+        for index in range (0, len(chunk)):
+            if (chunk.ids[index] in data_blocks and chunk.data[index] != previous_chunk.data[index]):
+                return chunk
+        return None
+
+    changed = []
+    for (area, chunk) in fetch_tiles(pool, chunks, fetch_changed, progress):
+        if (chunk != None):
+            changed.append(chunk)
+    # Copied after all chunks are compared (the threads read capture)
+    for chunk in changed:
+        stitch_tile(capture, chunk)
+    return (capture, changed)
+
+
+# Capture an area straight to a version 2 file a tile at a time, so that
+# memory use is bounded by the tile size rather than the area
+# Tiles are written to filename.part and each completed tile is recorded
+# in filename.journal (after it is in the file). If the capture fails or
+# is cancelled the journal is kept, and capturing the same area (and
+# tile size) to the same file again resumes from the tiles not yet
+# completed. A failed tile is retried (see fetch_tiles) before giving up.
+# filename is only replaced once every tile is complete.
+def capture_to_file (pool, filename, start_position, size, tile_size = default_tile_size, data_blocks = (),
+        progress = None, retries = default_retries):
+    part_filename = filename + ".part"
+    journal_filename = filename + ".journal"
+    tiles = split_tiles(start_position, size, tile_size)
+    header = {'origin':list(start_position), 'size':list(size), 'tile_size':list(tile_size)}
+    completed = read_journal(journal_filename, header)
+    if (completed == None or not os.path.isfile(part_filename) or detect_version(part_filename) != 2
+            or read_bounds(part_filename) != (tuple(start_position), tuple(size))):
+        create_mbf(part_filename, start_position, size)
+        with open(journal_filename, 'w') as journal:
+            journal.write(json.dumps(header) + "\n")
+        completed = set()
+
+    remaining = [tile for tile in tiles if tile_key(tile) not in completed]
+    # Progress includes the tiles completed before resuming
+    done = (len(tiles) - len(remaining)) / len(tiles) * 100 if len(tiles) > 0 else 100
+    with open(journal_filename, 'a') as journal:
+        for (area, tile) in fetch_tiles(pool, remaining, lambda mc, tile_start, this_tile_size:
+                fetch_tile(mc, tile_start, this_tile_size, data_blocks), scale_progress(progress, done, 100), retries):
+            patch_mbf(part_filename, [tile])
+            journal.write(json.dumps(tile_key(area)) + "\n")
+            journal.flush()
+    os.replace(part_filename, filename)
+    os.remove(journal_filename)
+
+
+# Key for a tile in the journal
+def tile_key (tile):
+    (tile_start, tile_size) = tile
+    return (tuple(tile_start), tuple(tile_size))
+
+
+# Returns the set of tile keys completed in a journal, or None if there
+# is no journal or it is for a different capture (header)
+def read_journal (filename, header):
+    try:
+        with open(filename, 'r') as journal:
+            if (json.loads(journal.readline()) != header):
+                return None
+            completed = set()
+            for this_line in journal:
+                # Last line may be incomplete if the capture stopped
+                try:
+                    (tile_start, tile_size) = json.loads(this_line)
+                except (ValueError, TypeError):
+                    continue
+                completed.add(tile_key((tile_start, tile_size)))
+            return completed
+    except (OSError, ValueError):
+        return None
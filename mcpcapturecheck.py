@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+import sys, os
+import shutil
+import socket
+import tempfile
+import threading
+import mcpcore
+import mcpcapture
+from mcpcore import McprintEngine
+from mcpserver import McpiHandler, McpiServer, VoxelWorld
+from mcpbench import generate_world
+from mbffile import load_mbf
+
+# NumPy is required to generate the world
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+##########################################################################
+# mcpcapturecheck.py
+# Checks the resumable capture (see mcpcapture.capture_to_file) against
+# the stand in server (mcpserver.py)
+# Does not need Minecraft or PyQt5 - requires mcpi and NumPy
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Checks that:
+#     a capture where connections are dropped (every few getBlocks) is
+#         retried and the file is the same as the world
+#     a cancelled capture keeps its journal and is resumed, reading only
+#         the tiles not yet completed, and the file is the same as the
+#         world
+#     a capture with the server stopped fails and keeps the journal
+# Exits with status 1 if any check fails.
+#
+###########################################################################
+
+
+# Area captured (x, y, z) and tile size
+check_size = (80, 40, 70)
+check_tile_size = (16, 16, 16)
+
+# Every drop_every getBlocks the connection is closed
+drop_every = 5
+
+
+# Server connection which closes (without a reply) every drop_every
+# getBlocks when the server's drop is set
+class DroppingHandler(McpiHandler):
+
+    def handle (self):
+        for line in self.rfile:
+            if (line.startswith(b"world.getBlocks(") and self.server.drop.is_set()):
+                with self.server.stats.lock:
+                    self.server.get_blocks_count += 1
+                    drop = self.server.get_blocks_count % drop_every == 0
+                if (drop):
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+            (reply, blocks) = self.run_command(line.decode("cp437").strip())
+            self.schedule(len(line), reply, blocks)
+
+
+def start_server (world):
+    server = McpiServer(world, 0, "localhost")
+    server.RequestHandlerClass = DroppingHandler
+    server.drop = threading.Event()
+    server.get_blocks_count = 0
+    return server.start()
+
+
+# True if filename has the same blocks as capture
+def file_matches (filename, capture):
+    with load_mbf(filename, use_mmap=False) as saved:
+        return bytes(saved.ids) == bytes(capture.ids) and bytes(saved.data) == bytes(capture.data)
+
+
+def create_engine (server):
+    engine = McprintEngine(address="localhost", port=server.port)
+    if (not engine.connect_to_minecraft()):
+        raise IOError("Unable to connect to the server")
+    engine.resumable_capture = True
+    engine.tile_size = check_tile_size
+    engine.connections = 2
+    return engine
+
+
+# Returns list of errors
+def check_resumable_capture (work_dir):
+    errors = []
+    capture = generate_world(check_size, 'terrain', 0.3, 0.1, 0.05, 3)
+    # Only the data of the data blocks is captured
+    data_blocks = set(McprintEngine().blocks.data_ids())
+    capture.data[:] = bytes(capture.data[index] if capture.ids[index] in data_blocks else 0
+        for index in range (0, len(capture)))
+    capture.origin = (0, 1, 0)
+    world = VoxelWorld((-4, 0, -4), (check_size[0] + 8, check_size[1] + 8, check_size[2] + 8))
+    world.load(capture)
+    server = start_server(world)
+    filename = os.path.join(work_dir, "capture.mbf")
+    journal_filename = filename + ".journal"
+    try:
+        # Dropped connections are retried
+        server.drop.set()
+        engine = create_engine(server)
+        if (not engine.save_blocks(filename, capture.origin, check_size)):
+            errors.append("capture with dropped connections failed: {}".format(engine.capture_error))
+        elif (not file_matches(filename, capture)):
+            errors.append("capture with dropped connections is different from the world")
+        elif (server.get_blocks_count < drop_every):
+            errors.append("no connections were dropped")
+        server.drop.clear()
+        engine.disconnect()
+        os.remove(filename)
+
+        # Cancel part way, then resume
+        engine = create_engine(server)
+        if (engine.save_blocks(filename, capture.origin, check_size, progress=lambda value: value > 40)):
+            errors.append("cancelled capture was not cancelled")
+        if (os.path.exists(filename) or not os.path.exists(journal_filename)):
+            errors.append("cancelled capture did not keep the journal")
+        server.stats.reset()
+        if (not engine.save_blocks(filename, capture.origin, check_size)):
+            errors.append("resumed capture failed: {}".format(engine.capture_error))
+        elif (not file_matches(filename, capture)):
+            errors.append("resumed capture is different from the world")
+        elif (os.path.exists(journal_filename)):
+            errors.append("resumed capture did not remove the journal")
+        tiles = len(mcpcapture.split_tiles(capture.origin, check_size, check_tile_size))
+        if (server.stats.commands.get("world.getBlocks", 0) >= tiles):
+            errors.append("resumed capture read every tile again")
+        engine.disconnect()
+        os.remove(filename)
+    finally:
+        server.stop()
+
+    # Server stopped - fails (after the retries) and keeps the journal
+    engine = McprintEngine(address="localhost", port=server.port)
+    engine.resumable_capture = True
+    engine.tile_size = check_tile_size
+    if (engine.save_blocks(filename, capture.origin, check_size)):
+        errors.append("capture with the server stopped did not fail")
+    if (not os.path.exists(journal_filename)):
+        errors.append("failed capture did not keep the journal")
+    return errors
+
+
+def main ():
+    if (numpy == None):
+        print ("The capture check requires NumPy")
+        return 1
+    mcpcore.debug = False
+    # Retry quickly
+    mcpcapture.retry_wait = 0.05
+    work_dir = tempfile.mkdtemp(prefix="mcpcapturecheck-")
+    try:
+        errors = check_resumable_capture(work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    for error in errors:
+        print ("Check failed: {}".format(error))
+    if (len(errors) > 0):
+        return 1
+    print ("Resumable capture checks passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
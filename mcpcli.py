@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+import sys, os
+import argparse
+import shlex
+import time
+import cProfile
+from multiprocessing import Pool
+from mcpcore import McprintEngine, detect_platform, default_block_size
+from mcpmesh import mesh_formats
+from mcpcache import ConversionCache
+from mcpblocks import load_registry
+from mbffile import upgrade_mbf
+from mcptrace import Tracer
+
+##########################################################################
+# mcpcli.py command [args]
+# Command line (headless) version of minecraft-print
+# Does not need PyQt5 - conversions do not need mcpi either
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Commands:
+#     capture  file.mbf --start x y z --size x y z [--connections n]
+#              [--tile-size x y z] [--format 1|2|3] [--no-heightmap]
+#              [--incremental] [--check-data] [--chunk-size x y z]
+#              [--resumable]
+#     convert  file.mbf [file.scad] [--block-size mm] [--mode blocks|merged]
+#              [--hollow blocks] [--drain-holes] [--cache] [--blocks file.ini]
+#              [--no-neighbours] [--workers n]
+#     mesh     file.mbf [file.stl|file.3mf] [--format stl|3mf] [--block-size mm]
+#              [--hollow blocks] [--drain-holes] [--cache] [--blocks file.ini]
+#              [--no-neighbours] [--workers n]
+#     restore  undo-file [--mode fill|diff]
+#     upgrade  file.mbf [file.mbf ...] [--format 1|2|3]
+#     batch    manifest [--workers n]
+#
+# capture and restore also take [--host address] [--port port] [--notpi]
+# [--asyncio]
+#
+# convert / mesh --workers splits large captures between worker processes
+# (0 = one per core, see mcpshard). Ignored for batch jobs, which already
+# run in worker processes.
+#
+# Options (before the command, not batch):
+#     --trace trace.json   save the time of each phase, the commands sent
+#                          and blocks per second (see mcptrace)
+#     --profile file.prof  run with cProfile (view with python -m pstats)
+#
+# A batch manifest has one job per line using the same syntax as the
+# capture / convert / restore commands (without mcpcli.py). Blank lines
+# and lines starting with # are ignored. eg.
+#     convert house.mbf house.scad --block-size 5
+#     convert castle.mbf
+#     upgrade old1.mbf old2.mbf
+#
+###########################################################################
+
+
+# Options used to connect to minecraft (capture and restore)
+def add_connection_args (parser):
+    parser.add_argument("--host", default="localhost", help="Minecraft server address")
+    parser.add_argument("--port", type=int, default=4711, help="Minecraft API port")
+    parser.add_argument("--notpi", action="store_true", help="disable Raspberry Pi detection")
+    parser.add_argument("--asyncio", action="store_true", help="send requests without waiting for each reply (see mcpasync.py)")
+
+
+def create_parser ():
+    parser = argparse.ArgumentParser(prog="mcpcli.py",
+        description="Capture Minecraft areas and convert to OpenSCAD for 3D printing")
+    parser.add_argument("--trace", default=None, metavar="FILE", help="save phase timings and commands sent (json)")
+    parser.add_argument("--profile", default=None, metavar="FILE", help="save cProfile stats")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    capture = subparsers.add_parser("capture", help="capture an area to a .mbf file")
+    capture.add_argument("filename", help="minecraft blocks file to create")
+    capture.add_argument("--start", type=int, nargs=3, required=True, metavar=("X","Y","Z"))
+    capture.add_argument("--size", type=int, nargs=3, required=True, metavar=("X","Y","Z"))
+    capture.add_argument("--all-data", action="store_true", help="get data for all blocks (slow)")
+    capture.add_argument("--connections", type=int, default=1, help="number of connections to fetch tiles with")
+    capture.add_argument("--tile-size", type=int, nargs=3, default=None, metavar=("X","Y","Z"), help="size of each getBlocks request")
+    capture.add_argument("--format", type=int, choices=[1,2,3], default=2, help="mbf version (1 = text, 2 = binary, 3 = sparse)")
+    capture.add_argument("--incremental", action="store_true", help="if filename is a capture of the same area only read the chunks where the block ids have changed (a change to only the data, eg. turning a stair, is missed)")
+    capture.add_argument("--check-data", action="store_true", help="with --incremental read the data of every chunk too, so all changes are found (as slow as a full capture)")
+    capture.add_argument("--chunk-size", type=int, nargs=3, default=None, metavar=("X","Y","Z"), help="size of each chunk compared by --incremental")
+    capture.add_argument("--resumable", action="store_true", help="write tiles straight to the file with a journal, run again to resume a failed capture (large areas)")
+    capture.add_argument("--no-heightmap", action="store_true", help="read every block when reading blocks individually (Pi or --all-data), not just up to the height of each column")
+    add_connection_args(capture)
+
+    convert = subparsers.add_parser("convert", help="convert a .mbf file to OpenSCAD")
+    convert.add_argument("filename", help="minecraft blocks file to convert")
+    convert.add_argument("scad_filename", nargs="?", help="default is filename with .scad extension")
+    convert.add_argument("--block-size", type=float, default=default_block_size, help="size of each block (mm)")
+    convert.add_argument("--mode", choices=["blocks","merged"], default="blocks", help="module per block, or merge standard blocks into cubes (faster to render)")
+    convert.add_argument("--hollow", type=int, default=None, metavar="BLOCKS", help="remove hidden blocks leaving a wall this thick (requires numpy)")
+    convert.add_argument("--drain-holes", action="store_true", help="cut a drain hole below each hollow")
+    convert.add_argument("--cache", action="store_true", help="reuse earlier conversions of the same file")
+    convert.add_argument("--blocks", default=None, metavar="FILE", help="block registry (default data-files/blocks.ini)")
+    convert.add_argument("--no-neighbours", action="store_true", help="don't add stair corners and fence / pane connections")
+    convert.add_argument("--workers", type=int, default=None, help="convert over this many processes (0 = cpu count)")
+
+    mesh = subparsers.add_parser("mesh", help="export a .mbf file as an STL or 3MF mesh (requires numpy)")
+    mesh.add_argument("filename", help="minecraft blocks file to export")
+    mesh.add_argument("mesh_filename", nargs="?", help="default is filename with the format extension")
+    mesh.add_argument("--format", choices=mesh_formats, default=None, help="default from mesh_filename extension (stl or 3mf), or stl if no mesh_filename")
+    mesh.add_argument("--block-size", type=float, default=default_block_size, help="size of each block (mm)")
+    mesh.add_argument("--hollow", type=int, default=None, metavar="BLOCKS", help="remove hidden blocks leaving a wall this thick")
+    mesh.add_argument("--drain-holes", action="store_true", help="cut a drain hole below each hollow")
+    mesh.add_argument("--cache", action="store_true", help="reuse earlier conversions of the same file")
+    mesh.add_argument("--blocks", default=None, metavar="FILE", help="block registry (default data-files/blocks.ini)")
+    mesh.add_argument("--no-neighbours", action="store_true", help="don't add stair corners and fence / pane connections")
+    mesh.add_argument("--workers", type=int, default=None, help="export over this many processes (0 = cpu count)")
+
+    restore = subparsers.add_parser("restore", help="restore an undo file back into minecraft")
+    restore.add_argument("filename", help="undo file to restore")
+    restore.add_argument("--mode", choices=["fill","diff"], default="diff", help="fill area then set blocks, or only set changed blocks")
+    add_connection_args(restore)
+
+    upgrade = subparsers.add_parser("upgrade", help="convert .mbf files to a different version")
+    upgrade.add_argument("filenames", nargs="+", help="minecraft blocks files (replaced)")
+    upgrade.add_argument("--format", type=int, choices=[1,2,3], default=2, help="mbf version (1 = text, 2 = binary, 3 = sparse)")
+
+    batch = subparsers.add_parser("batch", help="run jobs from a manifest file")
+    batch.add_argument("manifest", help="file listing one job per line")
+    batch.add_argument("--workers", type=int, default=None, help="number of worker processes (default cpu count)")
+
+    return parser
+
+
+# Default scad filename is mbf filename with the extension replaced
+def scad_filename_for (minecraft_filename, extension = ".scad"):
+    (filepath, mbf_extension) = os.path.splitext(minecraft_filename)
+    if (mbf_extension == '.mbf'):
+        return filepath + extension
+    return minecraft_filename + extension
+
+
+# Create an engine for convert / mesh with the conversion options
+# tracer (optional) is shared so the trace can be saved after the command
+def conversion_engine (args, tracer = None):
+    engine = McprintEngine()
+    if (tracer != None):
+        engine.tracer = tracer
+    engine.wall_thickness = args.hollow
+    engine.drain_holes = args.drain_holes
+    engine.neighbour_shapes = not args.no_neighbours
+    if (args.blocks != None):
+        engine.blocks = load_registry(args.blocks)
+    if (args.cache):
+        engine.cache = ConversionCache()
+    engine.workers = args.workers
+    return engine
+
+
+# Create an engine connected to minecraft
+# Returns None if unable to connect
+def connected_engine (args, tracer = None):
+    engine = McprintEngine(detect_platform(args.notpi), address=args.host, port=args.port)
+    if (tracer != None):
+        engine.tracer = tracer
+    engine.use_asyncio = args.asyncio
+    if (not engine.connect_to_minecraft()):
+        return None
+    return engine
+
+
+# Run a single (non batch) command, returns True if successful
+def run_command (args, tracer = None):
+    if (args.command == "convert"):
+        scad_filename = args.scad_filename
+        if (scad_filename == None):
+            scad_filename = scad_filename_for(args.filename)
+        engine = conversion_engine(args, tracer)
+        return engine.convert_to_openscad_file(args.filename, scad_filename, args.block_size, mode=args.mode)
+    elif (args.command == "mesh"):
+        mesh_filename = args.mesh_filename
+        mesh_format = args.format
+        if (mesh_filename == None):
+            mesh_filename = scad_filename_for(args.filename, "." + (mesh_format or "stl"))
+        elif (mesh_format == None):
+            mesh_format = os.path.splitext(mesh_filename)[1].lstrip('.').lower()
+            if (not mesh_format in mesh_formats):
+                print ("Unknown mesh format for {} - use --format {}".format(mesh_filename, "|".join(mesh_formats)))
+                return False
+        engine = conversion_engine(args, tracer)
+        return engine.export_mesh(args.filename, mesh_filename, args.block_size, mesh_format=mesh_format)
+    elif (args.command == "upgrade"):
+        for filename in args.filenames:
+            if (upgrade_mbf(filename, args.format)):
+                print ("Converted {} to version {}".format(filename, args.format))
+        return True
+
+    engine = connected_engine(args, tracer)
+    if (engine == None):
+        return False
+    if (args.command == "capture"):
+        engine.mbf_version = args.format
+        engine.connections = args.connections
+        engine.use_heightmap = not args.no_heightmap
+        engine.incremental_capture = args.incremental
+        engine.incremental_check_data = args.check_data
+        if (args.chunk_size != None):
+            engine.chunk_size = args.chunk_size
+        if (args.tile_size != None):
+            engine.tile_size = args.tile_size
+        engine.resumable_capture = args.resumable
+        success = engine.save_blocks(args.filename, args.start, args.size, args.all_data)
+        if (engine.capture_chunks != None):
+            print ("Captured {} of {} chunks (others unchanged)".format(*engine.capture_chunks))
+        if (engine.capture_error != None):
+            print ("Capture failed: {}".format(engine.capture_error))
+            if (args.resumable):
+                print ("Run the same command again to resume")
+        return success
+    elif (args.command == "restore"):
+        success = engine.restore_undo(args.filename, mode=args.mode)
+        if (engine.restore_plan != None):
+            print ("Restore sent {} commands ({} before merging)".format(
+                engine.restore_commands, engine.restore_plan['commands_before']))
+        return success
+    return False
+
+
+# Run a job from a manifest line - called in the worker processes
+# Returns (line, success, message, seconds)
+def run_job (line):
+    start_time = time.time()
+    try:
+        args = create_parser().parse_args(shlex.split(line))
+        if (args.command == "batch"):
+            return (line, False, "nested batch not supported", 0)
+        # Pool processes can't start their own pool
+        if (getattr(args, 'workers', None) != None):
+            args.workers = None
+        success = run_command(args)
+        message = "ok" if success else "failed"
+    except SystemExit:
+        # argparse exits on invalid arguments
+        return (line, False, "invalid job", 0)
+    except Exception as e:
+        success = False
+        message = str(e)
+    return (line, success, message, time.time() - start_time)
+
+
+# Read jobs from manifest, ignoring blank lines and comments
+def read_manifest (filename):
+    jobs = []
+    with open(filename, 'r') as fp:
+        for this_line in fp:
+            this_line = this_line.strip()
+            if (this_line == "" or this_line.startswith("#")):
+                continue
+            jobs.append(this_line)
+    return jobs
+
+
+# Runs all jobs in manifest on a pool of worker processes
+# Returns True if all jobs were successful
+def run_batch (manifest, workers = None):
+    jobs = read_manifest(manifest)
+    failed = 0
+    with Pool(workers) as pool:
+        for (line, success, message, seconds) in pool.imap_unordered(run_job, jobs):
+            if (not success):
+                failed += 1
+            print ("{:.3f}s {}: {}".format(seconds, message, line))
+    print ("{} jobs, {} failed".format(len(jobs), failed))
+    return failed == 0
+
+
+# Runs a single command with --trace / --profile
+def run_traced (args):
+    tracer = Tracer()
+    if (args.profile != None):
+        profile = cProfile.Profile()
+        try:
+            success = profile.runcall(run_command, args, tracer)
+        finally:
+            profile.dump_stats(args.profile)
+    else:
+        success = run_command(args, tracer)
+    if (args.trace != None):
+        tracer.write_json(args.trace)
+    return success
+
+
+def main (argv = None):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if (args.command == "batch"):
+        if (args.trace != None or args.profile != None):
+            parser.error("--trace and --profile are not supported with batch")
+        success = run_batch(args.manifest, args.workers)
+    elif (args.trace != None or args.profile != None):
+        success = run_traced(args)
+    else:
+        success = run_command(args)
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
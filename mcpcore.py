@@ -0,0 +1,742 @@
+##########################################################################
+# mcpcore.py
+# Core capture / restore / convert engine for minecraft-print
+# This module has no GUI dependencies so that it can be used from the
+# command line (see mcpcli.py) or on headless servers. The Qt GUI in
+# mcprint.py is a front end to this engine.
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+###########################################################################
+
+import os
+import asyncio
+import platform
+import shutil
+import struct
+from mbffile import BlockCapture, block_stats, detect_version, iter_blocks, load_mbf, save_mbf, patch_mbf, read_origin, read_bounds, atomic_write, read_buffer_size
+from mcpcapture import CancelledError, ConnectionPool, close_connection, capture_columns, capture_incremental, capture_tiled, capture_to_file, default_chunk_size, default_tile_size, get_heights, scale_progress, split_tiles
+from mcprestore import diff_captures, plan_restore, write_boxes
+from mcpwriter import BlockWriter
+from mcpscad import write_blocks, write_merged
+from mcphollow import hollow_capture
+from mcpmesh import build_mesh_faces, load_mesh_faces, mesh_formats, save_mesh_faces, scale_mesh, write_stl, write_3mf
+from mcpcache import ConversionCache
+from mcpblocks import load_registry
+from mcpneighbours import apply_neighbour_shapes, neighbours_supported
+from mcptrace import Tracer, trace_connection
+from mcpasync import capture_async, close_all, connect_all, write_boxes_async
+from mcpshard import block_stats_sharded, build_mesh_faces_sharded, write_blocks_sharded, write_merged_sharded
+
+
+# x (longitude), y (height), z (latitude)
+# getBlocks returns in incrementing order of z, x, y
+
+undo_buildplate_filename = "undo-build.tmp"
+undo_otherblocks_filename = "undo-print.tmp"
+
+debug = True
+
+# No block is actually an air block (same as mcpi.block.AIR.id)
+# Defined here rather than importing mcpi so that conversion does not
+# need mcpi installed
+no_block = 0
+
+# Default size of each block in the OpenSCAD file (mm)
+default_block_size = 10
+
+
+# Returns 'raspberrypi' if we think this is running on a Raspberry Pi
+# (as Minecraft Pi has limited functionality) else 'raspberryjuice'
+# This is only approximate - detects arm processor if running full
+# minecraft client on a ARM processor then can override with notpi
+def detect_platform (override_pi = False):
+    if (not override_pi and "arm" in platform.platform()):
+        return 'raspberrypi'
+    return 'raspberryjuice'
+
+
+class McprintEngine():
+
+    mc = None
+
+    # Platform = other, can be linux or windows
+    # If change to RaspberryPi then drop use of getBlocks
+    mcpi_platform = 'raspberryjuice'
+    full_undo = True
+
+    # Version of mbf file to save (1 = text, 2 = binary, 3 = sparse)
+    # Files of any version can be loaded
+    mbf_version = 2
+
+    # Number of connections used for capture (tiles are fetched concurrently)
+    # and the size of each tile (x,y,z) requested with getBlocks
+    connections = 1
+    tile_size = default_tile_size
+    pool = None
+
+    # When reading each block (Minecraft Pi or get_all_data) only read up
+    # to the height of each column, the air above is not requested
+    use_heightmap = True
+
+    # If the file being saved is a capture of the same area then only
+    # read the chunks (of chunk_size) which have changed (see save_blocks)
+    # Chunks are compared by the block ids - a change to only the data
+    # (eg. turning a stair) is missed unless incremental_check_data is
+    # set, which reads the data of every chunk (as slow as a full capture)
+    # capture_chunks is (changed, total) chunks of the last capture or
+    # None if it was not incremental
+    incremental_capture = False
+    incremental_check_data = False
+    chunk_size = default_chunk_size
+    capture_chunks = None
+
+    # Capture tiles straight to the file with a journal, so memory is
+    # bounded by the tile size and a failed capture can be resumed (see
+    # mcpcapture.capture_to_file) - for very large areas
+    resumable_capture = False
+
+    # Exception from the last save_blocks that failed (None if successful)
+    capture_error = None
+
+    # Capture (getBlocks tiles) and restore with asyncio connections (see
+    # mcpasync) - requests on each connection don't wait for the replies
+    use_asyncio = False
+
+    # How undo files are restored ('fill' or 'diff' - see restore_undo)
+    # the plan (see mcprestore.plan_restore) and the number of commands
+    # sent by the last restore
+    restore_mode = 'diff'
+    restore_plan = None
+    restore_commands = None
+
+    # OpenSCAD output ('blocks' or 'merged' - see convert_to_openscad_file)
+    scad_mode = 'blocks'
+    # Hollow shell - None for solid, or the thickness of the wall (blocks)
+    # with optional drain holes (see mcphollow)
+    wall_thickness = None
+    drain_holes = False
+    # Set the shape of stairs (corners), fences and panes from the adjacent
+    # blocks (see mcpneighbours) - only if NumPy is installed
+    neighbour_shapes = True
+    # Conversion cache (see mcpcache) - None to always convert
+    cache = None
+    # Convert over a pool of processes (see mcpshard) - number of
+    # processes, 0 for one per core, or None to convert in this process
+    # (neighbour shapes and hollowing are always done in this process)
+    workers = None
+    # Block registry (see mcpblocks) - shape used for each block, and
+    # which blocks are excluded (eg. air, water) or need the data value
+    blocks = None
+
+    # Save smallest and largest x,y,z values for print size
+    # Note that this uses xyz openscad rather than minecraft
+    # Only printed blocks (excludes blocks excluded in the block registry)
+    print_dimension_smallest = None
+    print_dimension_largest = None
+    # Statistics (see mbffile.block_stats) of the last capture / file loaded
+    file_stats = None
+    # Time of each phase, commands sent etc. (see mcptrace)
+    tracer = None
+
+
+    def __init__ (self, mcpi_platform = 'raspberryjuice', full_undo = True, address = "localhost", port = 4711):
+        self.mcpi_platform = mcpi_platform
+        self.full_undo = full_undo
+        self.address = address
+        self.port = port
+        self.blocks = load_registry()
+        self.tracer = Tracer()
+
+
+    # Returns true if we think this is a raspberry pi, else false
+    def is_pi (self):
+        if (self.mcpi_platform == 'raspberrypi'):
+            return True
+        return False
+
+
+    # Connect to Minecraft if not already connected
+    # Returns True if connected
+    # mcpi is imported here so that conversion only use does not require it
+    def connect_to_minecraft (self):
+        if (self.mc == None):
+            try:
+                self.mc = self.create_connection()
+            except Exception as e:
+                print ("Error connecting to Minecraft\nPlease ensure that Minecraft is running")
+                return False
+        return True
+
+
+    # Create a new connection to the minecraft server
+    # Commands on the connection are counted by the tracer
+    def create_connection (self):
+        from mcpi.minecraft import Minecraft
+        return trace_connection(Minecraft.create(self.address, self.port), self.tracer)
+
+
+    # Close the connections to minecraft
+    def disconnect (self):
+        if (self.pool != None):
+            self.pool.close()
+            self.pool = None
+        if (self.mc != None):
+            close_connection(self.mc)
+            self.mc = None
+
+
+    # Returns pool of connections used for capture
+    # The pool shares the main connection and creates extra connections
+    # when needed (up to self.connections)
+    def get_pool (self):
+        if (self.pool == None or self.pool.size != self.connections):
+            # The old pool's connections (not the main connection) are closed
+            if (self.pool != None):
+                self.pool.close()
+            connections = []
+            if (self.mc != None):
+                connections.append(self.mc)
+            self.pool = ConnectionPool(self.create_connection, max(self.connections, 1), connections)
+        return self.pool
+
+
+    # Change blocks for buildplate
+    # Will only create on first layer - so size_y is ignored
+    # Undo file (if required) should be created before this
+    def draw_buildplate(self, start_position, size, block_type):
+        (start_x,start_y,start_z) = start_position
+        (size_x,size_y,size_z) = size
+
+        # Does not support data values (eg. different textures)
+        with self.tracer.phase("buildplate"):
+            self.mc.postToChat ("Setting build plate blocks")
+            self.mc.setBlocks(start_x,start_y,start_z,start_x+size_x-1,start_y+size_y-1,start_z+size_z-1,block_type)
+            self.tracer.add_blocks(size_x * size_y * size_z)
+
+
+    # save minecraft block data (undo file or print export)
+    # overwrites contents of save_filename
+    # get_all_data is an optional parameter. If set to true then it will get the block
+    # data for all blocks. This is more accurate (less loss of information), but
+    # much slower - recommended for build plate, but not large areas
+    # progress is an optional callback which is called with the percentage
+    # complete after each layer. If it returns True then the capture is cancelled
+    # If incremental_capture is set and save_filename is a capture of the
+    # same area then only the chunks with different block ids (or data if
+    # incremental_check_data) are read, and written to the file in place
+    # if it is version 2
+    # If resumable_capture is set then a failed or cancelled capture is
+    # resumed by calling again with the same filename, area and tile size
+    # Returns False if cancelled or unable to write file, otherwise True
+    # (the error is in capture_error)
+    def save_blocks (self, save_filename, start_position, size, get_all_data = False, progress = None):
+        start_x,start_y,start_z = start_position
+        size_x,size_y,size_z = size
+
+        self.print_dimension_smallest = None
+        self.capture_chunks = None
+        self.capture_error = None
+        previous = None
+        if (self.incremental_capture and not self.is_pi() and get_all_data == False):
+            previous = self._previous_capture(save_filename, start_position, size)
+        changed = None
+        # True if the capture is already in the file (resumable_capture)
+        saved = False
+
+        # Blocks are held in memory and written to the file at the end
+        # so a cancelled or failed capture does not leave a partial file
+        capture = BlockCapture(start_position, size)
+
+        # Enclose within try catch in case of file errors
+        try:
+            if (progress != None):
+                progress(1)
+
+            with self.tracer.phase("capture"):
+                if (previous != None):
+                    with previous:
+                        (capture, changed) = capture_incremental(self.get_pool(), previous, self.chunk_size,
+                            set(self.blocks.data_ids()), progress, self.incremental_check_data)
+                    self.capture_chunks = (len(changed), len(split_tiles(start_position, size, self.chunk_size)))
+                    self.tracer.add_blocks(sum(len(chunk) for chunk in changed))
+                elif (self.resumable_capture and not self.is_pi() and get_all_data == False):
+                    # Connections which fail are discarded, so the main
+                    # connection is not used
+                    pool = ConnectionPool(self.create_connection, max(self.connections, 1))
+                    try:
+                        capture_to_file(pool, save_filename, start_position, size, self.tile_size,
+                            set(self.blocks.data_ids()), progress)
+                    finally:
+                        pool.close()
+                    saved = True
+                    # Memory mapped rather than read (unless saving as another version)
+                    capture = load_mbf(save_filename, use_mmap=(self.mbf_version == 2))
+                    self.tracer.add_blocks(len(capture))
+                elif (not self.is_pi() and get_all_data == False):
+                    # getBlocks in tiles over the connection pool
+                    # blocks which use the data (eg. stairs) are read again to get the data
+                    capture = self._capture_tiled(start_position, size, set(self.blocks.data_ids()), progress)
+                    self.tracer.add_blocks(len(capture))
+                else:
+                    # Read each block individually (Pi does not support getBlocks)
+                    # Only up to the height of each column if use_heightmap
+                    heights = None
+                    if (self.use_heightmap):
+                        with self.tracer.phase("heightmap"):
+                            heights = get_heights(self.mc, start_position, size)
+                    capture = capture_columns(self.mc, start_position, size, heights, progress)
+                    self.tracer.add_blocks(len(capture))
+
+            # record smallest and largest printed blocks so we can workout size
+            with self.tracer.phase("analyse"):
+                self._set_dimensions(block_stats(capture, self.blocks.excluded_ids()))
+                self.tracer.add_blocks(len(capture))
+
+            with self.tracer.phase("write_file"):
+                if (saved and self.mbf_version == 2):
+                    # Already written by capture_to_file
+                    pass
+                elif (changed != None and detect_version(save_filename) == self.mbf_version and patch_mbf(save_filename, changed)):
+                    self.tracer.add_file_io(written=sum(len(chunk) * 2 for chunk in changed))
+                else:
+                    save_mbf(save_filename, capture, self.mbf_version)
+                    self.tracer.add_file_io(written=os.path.getsize(save_filename))
+
+            if (progress != None):
+                progress(100)
+
+        except CancelledError:
+            return False
+        except Exception as e:
+            # Unable to read the blocks or write to file - warn to console
+            self.capture_error = e
+            if (debug == True):
+                print ("Unable to capture to file "+save_filename+" "+str(e))
+            return False
+        finally:
+            capture.close()
+        return True
+
+
+    # Capture an area with getBlocks tiles over the connection pool, or
+    # the asyncio connections if use_asyncio
+    def _capture_tiled (self, start_position, size, data_blocks, progress):
+        if (self.use_asyncio):
+            return self._run_async(capture_async, start_position, size, self.tile_size, data_blocks, progress)
+        return capture_tiled(self.get_pool(), start_position, size, self.tile_size, data_blocks, progress)
+
+
+    # Runs function (a coroutine function taking a list of connections
+    # and args) with self.connections asyncio connections (see mcpasync)
+    # Returns the result of function
+    def _run_async (self, function, *args):
+        async def run ():
+            clients = await connect_all([(self.address, self.port)] * max(self.connections, 1), self.tracer)
+            try:
+                return await function(clients, *args)
+            finally:
+                await close_all(clients)
+        return asyncio.run(run())
+
+
+    # Returns the capture in filename if it is the same area (see
+    # save_blocks), otherwise None (eg. no file or a different area)
+    def _previous_capture (self, filename, start_position, size):
+        try:
+            if (not os.path.isfile(filename) or read_bounds(filename) != (tuple(start_position), tuple(size))):
+                return None
+            return load_mbf(filename)
+        except (OSError, ValueError, struct.error):
+            # Corrupt file is replaced by a full capture
+            return None
+
+
+    # Records the print dimensions from block_stats (see mbffile)
+    # Stored as x,z,y (OpenSCAD axis), None if no printed blocks
+    def _set_dimensions (self, stats):
+        self.file_stats = stats
+        if (stats['lowest'] == None):
+            self.print_dimension_smallest = None
+            self.print_dimension_largest = None
+            return
+        (x, y, z) = stats['lowest']
+        self.print_dimension_smallest = [x, z, y]
+        (x, y, z) = stats['highest']
+        self.print_dimension_largest = [x, z, y]
+
+
+    # Restores content of undo file - either just buildplate or entire
+    # use whichever file is appropriate - eg buildplate / area undo file
+    # mode is 'fill' or 'diff' (default self.restore_mode)
+    # 'fill' sets the area to the most used block and then sets the others
+    # 'diff' reads the current area and only sets blocks which differ
+    # from the undo file (not supported on Minecraft Pi - uses fill)
+    # progress is an optional callback (see save_blocks)
+    # Returns False if the undo file is missing or corrupt, or cancelled
+    def restore_undo (self, filename, progress = None, mode = None):
+        if (mode == None):
+            mode = self.restore_mode
+
+        bounds = read_bounds(filename)
+        # Make sure we have a valid file
+        if (bounds == None):
+            print ("No undo file, or undo file is corrupt")
+            return False
+
+        try:
+            with self.tracer.phase("restore"):
+                if (mode == 'diff' and not self.is_pi()):
+                    success = self._restore_diff(filename, progress)
+                else:
+                    success = self._restore_fill(filename, progress)
+        except CancelledError:
+            return False
+        if (not success):
+            return False
+
+        (origin, size) = bounds
+        with self.tracer.phase("player"):
+            self._move_player_to_top(origin[1], origin[1] + size[1] - 1)
+        if (progress != None):
+            progress(100)
+        return True
+
+
+    # Restore by filling area with a single block and then setting others
+    # Most common block is used for performance reasons as each setBlock
+    # adds delay in executing
+    # Set all blocks to the most common and then replace those that don't
+    # match. Improves time, more significant with large number of blocks
+    # of same type eg Air Blocks
+    # The blocks that don't match are merged into boxes (see mcprestore)
+    # and the fill block is chosen to give the fewest commands
+    # The alternative (diff mode) uses getBlocks and compares to decide
+    # if need to change block. Which is faster when most blocks are
+    # unchanged, but will not work with Raspberry Pi (which doesn't
+    # have getBlocks() )
+    def _restore_fill (self, filename, progress):
+        with self.tracer.phase("read_file"):
+            target = load_mbf(filename)
+            self.tracer.add_file_io(read=os.path.getsize(filename))
+        with target:
+            with self.tracer.phase("plan"):
+                plan = plan_restore(target)
+            return self._write_plan(plan, progress)
+
+
+    # Restore by reading the current blocks (in tiles over the connection
+    # pool) and only setting those which differ from the undo file
+    # Progress is 0 to 50% reading and 50 to 100% writing
+    def _restore_diff (self, filename, progress):
+        data_blocks = set(self.blocks.data_ids())
+        with self.tracer.phase("read_file"):
+            target = load_mbf(filename)
+            self.tracer.add_file_io(read=os.path.getsize(filename))
+        with target:
+            with self.tracer.phase("capture"):
+                current = self._capture_tiled(target.origin, target.size, data_blocks, scale_progress(progress, 0, 50))
+                self.tracer.add_blocks(len(current))
+            with self.tracer.phase("plan"):
+                changes = diff_captures(target, current, data_blocks)
+                plan = plan_restore(target, changes)
+            return self._write_plan(plan, scale_progress(progress, 50, 100))
+
+
+    # Sends the restore plan, and records the number of commands
+    # Commands are buffered (see mcpwriter) and then synced so that the
+    # restore is complete in the world before returning
+    # If cancelled then the commands already queued are still sent
+    def _write_plan (self, plan, progress):
+        if (debug == True):
+            print ("Restore commands {} merged to {}".format(plan['commands_before'], plan['commands_after']))
+        self.restore_plan = plan
+        with self.tracer.phase("write"):
+            if (self.use_asyncio):
+                self.restore_commands = self._run_async(write_boxes_async, plan['boxes'], progress)
+            else:
+                writer = BlockWriter(self.mc)
+                self.restore_commands = write_boxes(writer, plan['boxes'], progress)
+                writer.sync()
+            self.tracer.add_blocks(sum((x1-x0+1) * (y1-y0+1) * (z1-z0+1) for (x0, y0, z0, x1, y1, z1, block_id, data) in plan['boxes']))
+        return self.restore_commands != None
+
+
+    # Move player on top of the highest block of the restored area
+    # (bottom_y to top_y) in current x,z position
+    # Only if that block is above bottom_y (eg. the buildplate)
+    # The height of the column is a single request - if it is above the
+    # restored area (eg. under a tree) then the column of the area is
+    # searched, so the player isn't moved on top of the tree
+    def _move_player_to_top (self, bottom_y, top_y):
+        position = self.mc.player.getTilePos()
+        y = self.mc.getHeight(position.x, position.z)
+        if (y > top_y):
+            # Work through that position x,z looking for highest y with air
+            for y in range (top_y, bottom_y, -1):
+                if (self.mc.getBlock(position.x, y, position.z) != no_block):
+                    break
+            else:
+                y = bottom_y
+        if (y > bottom_y):
+            self.mc.player.setPos (position.x, y+1, position.z)
+
+
+    # From file get information on the restore file
+    # Restore file must be cuboid (eg buildplate or full undo file)
+    # mostusedblock is the most common block with data 0
+    def get_file_info (self, filename):
+        with load_mbf(filename) as capture:
+            stats = block_stats(capture)
+        (origin, size) = (stats['origin'], stats['size'])
+        most_common_block = None
+        if (max(stats['histogram_no_data']) > 0):
+            most_common_block = stats['histogram_no_data'].index(max(stats['histogram_no_data']))
+        return {'bottomleft':list(origin), 'topright':[origin[i] + size[i] - 1 for i in range(3)],
+            'mostusedblock':most_common_block}
+
+
+    # Clears any blocks in the area above the buildplate
+    # If undo_filename is set then an undo file is created first
+    def clear_area (self, start_pos, size, undo_filename = None):
+        if (undo_filename != None):
+            self.save_blocks (undo_filename, start_pos, size)
+
+        (start_x,start_y,start_z) = start_pos
+        (size_x, size_y, size_z) = size
+        with self.tracer.phase("clear"):
+            self.mc.setBlocks(
+                start_x,start_y,start_z,
+                start_x+size_x-1, start_y+size_y-1, start_z+size_z-1,
+                no_block
+                )
+            self.tracer.add_blocks(size_x * size_y * size_z)
+
+
+    # Converts a minecraft blocks file to an OpenSCAD file
+    # mode is 'blocks' or 'merged' (default self.scad_mode)
+    # 'blocks' writes a module for every block
+    # 'merged' merges adjacent standard blocks into cubes (see mcpscad)
+    # If wall_thickness is set then hidden blocks are removed first
+    # If neighbour_shapes is set then corners / connections are added
+    # progress is an optional callback (see save_blocks)
+    # The scad file is only replaced when complete
+    # Returns False if cancelled, or if the file has no origin (no blocks
+    # - the scad file is still written without any blocks)
+    def convert_to_openscad_file (self, minecraft_filename, scad_filename, block_size = default_block_size, progress = None, mode = None):
+        if (mode == None):
+            mode = self.scad_mode
+        # offset values for x, y, z
+        # This moves the blocks to be near to the 0,0,0 axis
+        # Taken from the first block in the file (even if air) in the same
+        # way as the x,y,z of the blocks below (swap y/z and invert x)
+        # Due to the way we have to invert the x axis this means that the
+        # x axis is negative.
+        # This is not classified as a bug as OpenSCAD works just as well with the
+        # X axis being negative as positive.
+        origin = read_origin(minecraft_filename)
+        if (origin != None):
+            offset = [origin[0], -1 * origin[2], -1 * origin[1]]
+            bounds = read_bounds(minecraft_filename)
+        with self.tracer.phase("convert"):
+            # Enclosed in try so that a cancel removes the partial file
+            try:
+                with atomic_write(scad_filename) as outfile:
+                    # import module file
+                    outfile.write("include <minecraft-print.scad>\n")
+                    # Set blocksize variable
+                    outfile.write("block_size = {};\n".format(block_size))
+
+                    if (origin == None):
+                        pass
+                    elif (self.cache != None):
+                        # Everything after the block_size is the same for any
+                        # block size, so is cached
+                        body_filename = self._cached_scad_body(minecraft_filename, mode, offset, bounds, progress)
+                        if (body_filename == None):
+                            # Too large to cache
+                            self._write_scad_body(outfile, minecraft_filename, mode, offset, bounds, progress)
+                        else:
+                            with open(body_filename, 'r') as body:
+                                shutil.copyfileobj(body, outfile, read_buffer_size)
+                    else:
+                        self._write_scad_body(outfile, minecraft_filename, mode, offset, bounds, progress)
+            except CancelledError:
+                return False
+            self.tracer.add_file_io(written=os.path.getsize(scad_filename))
+        if (progress != None):
+            progress(100)
+        return origin != None
+
+
+    # Writes the blocks (everything after block_size) of the OpenSCAD file
+    def _write_scad_body (self, outfile, minecraft_filename, mode, offset, bounds, progress):
+        self.tracer.add_file_io(read=os.path.getsize(minecraft_filename))
+        if (bounds != None):
+            (origin, size) = bounds
+            self.tracer.add_blocks(size[0] * size[1] * size[2])
+        if (mode == 'merged' or self.wall_thickness != None or self._use_neighbours() or self.workers != None):
+            with load_mbf(minecraft_filename) as capture:
+                self._write_scad_capture(outfile, capture, mode, offset, bounds, progress)
+        else:
+            write_blocks(outfile, iter_blocks(minecraft_filename, skip_air=True), offset, bounds,
+                self._shape_blocks(), progress)
+
+
+    # Returns the filename of the OpenSCAD body in the cache, which is
+    # created if not already cached
+    # Returns None if the body is too large for the cache
+    def _cached_scad_body (self, minecraft_filename, mode, offset, bounds, progress):
+        key = self.cache.key(minecraft_filename, "scad", self._conversion_settings(mode))
+        body_filename = self.cache.get(key, ".scad")
+        if (body_filename == None):
+            body_filename = self.cache.put(key, ".scad", lambda body:
+                self._write_scad_body(body, minecraft_filename, mode, offset, bounds, progress))
+        return body_filename
+
+
+    # Settings which change the conversion (other than block size)
+    # used as part of the cache key
+    def _conversion_settings (self, mode):
+        return {
+            'mode':mode,
+            'blocks':self.blocks.signature(),
+            'wall_thickness':self.wall_thickness,
+            'drain_holes':self.drain_holes,
+            'neighbours':self._use_neighbours(),
+            # Merged boxes don't cross between shards
+            'sharded':mode == 'merged' and self.workers != None
+            }
+
+
+    # Neighbour analysis needs NumPy, otherwise the blocks are converted
+    # without it
+    def _use_neighbours (self):
+        return self.neighbour_shapes and neighbours_supported()
+
+
+    # Block registry used to convert - without neighbour analysis blocks
+    # such as fences are full blocks rather than just the post
+    def _shape_blocks (self):
+        if (self._use_neighbours()):
+            return self.blocks
+        return self.blocks.without_neighbours()
+
+
+    # Returns capture with the shapes set from the neighbours (if
+    # neighbour_shapes) then hollowed (if wall_thickness is set)
+    # Neighbours are analysed first so that blocks next to those removed
+    # keep the same shape
+    def _prepare_capture (self, capture):
+        if (self._use_neighbours()):
+            with self.tracer.phase("neighbours"):
+                capture = apply_neighbour_shapes(capture, self.blocks)
+                self.tracer.add_blocks(len(capture))
+        if (self.wall_thickness == None):
+            return capture
+        with self.tracer.phase("hollow"):
+            (capture, removed) = hollow_capture(capture, self.blocks.open_ids(),
+                self.wall_thickness, self.drain_holes)
+            self.tracer.add_blocks(len(capture))
+        if (debug == True):
+            print ("Hollow removed {} blocks".format(removed))
+        return capture
+
+
+    # Writes a loaded capture (see _prepare_capture)
+    def _write_scad_capture (self, outfile, capture, mode, offset, bounds, progress):
+        capture = self._prepare_capture(capture)
+        if (self.workers != None):
+            if (mode == 'merged'):
+                write_merged_sharded(outfile, capture, offset, self._shape_blocks(), self._pool_size(), progress)
+            else:
+                write_blocks_sharded(outfile, capture, offset, self._shape_blocks(), self._pool_size(), progress)
+        elif (mode == 'merged'):
+            write_merged(outfile, capture, offset, self._shape_blocks(), progress)
+        else:
+            write_blocks(outfile, capture.solid_blocks(), offset, bounds, self._shape_blocks(), progress)
+
+
+    # Exports a minecraft blocks file as a mesh (see mcpmesh)
+    # mesh_format is 'stl' or '3mf', default from the filename extension
+    # The mesh is in the same position as the OpenSCAD file
+    # progress is an optional callback (see save_blocks)
+    # Returns False if cancelled or the file is empty
+    def export_mesh (self, minecraft_filename, mesh_filename, block_size = default_block_size, progress = None, mesh_format = None):
+        if (mesh_format == None):
+            mesh_format = os.path.splitext(mesh_filename)[1].lstrip('.').lower()
+        if (not mesh_format in mesh_formats):
+            raise ValueError("Unsupported mesh format {}".format(mesh_format))
+        origin = read_origin(minecraft_filename)
+        if (origin == None):
+            return False
+        offset = [origin[0], -1 * origin[2], -1 * origin[1]]
+        try:
+            with self.tracer.phase("mesh"):
+                (triangles, normals, base) = self._mesh_faces(minecraft_filename, offset, progress)
+                triangles = scale_mesh(triangles, base, block_size)
+            if (debug == True):
+                print ("Mesh {} triangles".format(len(triangles)))
+            with self.tracer.phase("write_file"):
+                if (mesh_format == 'stl'):
+                    write_stl(mesh_filename, triangles, normals, progress)
+                else:
+                    write_3mf(mesh_filename, triangles, normals, progress)
+                self.tracer.add_file_io(written=os.path.getsize(mesh_filename))
+        except CancelledError:
+            return False
+        if (progress != None):
+            progress(100)
+        return True
+
+
+    # Returns (triangles, normals, base) from build_mesh_faces - from the
+    # cache if enabled
+    def _mesh_faces (self, minecraft_filename, offset, progress):
+        if (self.cache != None):
+            key = self.cache.key(minecraft_filename, "mesh", self._conversion_settings('mesh'))
+            mesh_filename = self.cache.get(key, ".npz")
+            if (mesh_filename != None):
+                return load_mesh_faces(mesh_filename)
+        self.tracer.add_file_io(read=os.path.getsize(minecraft_filename))
+        with load_mbf(minecraft_filename) as capture:
+            self.tracer.add_blocks(len(capture))
+            if (self.workers != None):
+                faces = build_mesh_faces_sharded(self._prepare_capture(capture), offset, self._shape_blocks(),
+                    self._pool_size(), progress)
+            else:
+                faces = build_mesh_faces(self._prepare_capture(capture), offset, self._shape_blocks(), progress)
+        if (self.cache != None):
+            self.cache.put(key, ".npz", lambda fp: save_mesh_faces(fp, faces), 'wb')
+        return faces
+
+
+    # Load mbf file to get dimensions (and statistics - file_stats)
+    def load_mbf_dimensions (self, filename):
+        with self.tracer.phase("analyse"), load_mbf(filename) as capture:
+            self.tracer.add_file_io(read=os.path.getsize(filename))
+            self.tracer.add_blocks(len(capture))
+            if (self.workers != None):
+                self._set_dimensions(block_stats_sharded(capture, self.blocks.excluded_ids(), self._pool_size()))
+            else:
+                self._set_dimensions(block_stats(capture, self.blocks.excluded_ids()))
+
+
+    # Number of processes for multiprocessing.Pool (None is one per core)
+    def _pool_size (self):
+        if (self.workers == None or self.workers < 1):
+            return None
+        return self.workers
+
+
+    # Returns the print size (x,y,z in OpenSCAD axis) for a block size
+    # or None if dimensions not known (no capture / file loaded)
+    def get_print_size (self, block_size):
+        if (self.print_dimension_largest == None or self.print_dimension_smallest == None):
+            return None
+        return (
+            (self.print_dimension_largest[0] - self.print_dimension_smallest[0] + 1) * block_size,
+            (self.print_dimension_largest[1] - self.print_dimension_smallest[1] + 1) * block_size,
+            (self.print_dimension_largest[2] - self.print_dimension_smallest[2] + 1) * block_size
+            )
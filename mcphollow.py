@@ -0,0 +1,151 @@
+##########################################################################
+# mcphollow.py
+# Hollow shell - removes blocks that can't be seen from outside the
+# model, leaving a wall of a chosen thickness
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# The outside is found by flood filling from around the capture through
+# any cells that are not a full block (air, excluded blocks, stairs and
+# half blocks). Blocks more than wall_thickness blocks from the outside
+# (in any direction, including diagonally) are removed, so the number of
+# blocks (and the filament used) depends on the surface area rather than
+# the volume of the model. mcphollowcheck.py checks that the wall is
+# sealed.
+# Optional drain holes are cut from the lowest point of each hollow down
+# through the wall, so that resin / powder can be removed after printing.
+# Requires NumPy.
+#
+###########################################################################
+
+from mbffile import BlockCapture
+
+# NumPy is optional for minecraft-print, but required for hollowing
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Grow mask by one cell in each of the 6 directions
+def _dilate (mask):
+    grown = mask.copy()
+    grown[1:] |= mask[:-1]
+    grown[:-1] |= mask[1:]
+    grown[:, 1:] |= mask[:, :-1]
+    grown[:, :-1] |= mask[:, 1:]
+    grown[:, :, 1:] |= mask[:, :, :-1]
+    grown[:, :, :-1] |= mask[:, :, 1:]
+    return grown
+
+
+# Grow mask by one cell in all 26 directions (3x3x3 box) - done one
+# axis at a time
+def _dilate_box (mask):
+    grown = mask.copy()
+    grown[1:] |= mask[:-1]
+    grown[:-1] |= mask[1:]
+    mask = grown.copy()
+    grown[:, 1:] |= mask[:, :-1]
+    grown[:, :-1] |= mask[:, 1:]
+    mask = grown.copy()
+    grown[:, :, 1:] |= mask[:, :, :-1]
+    grown[:, :, :-1] |= mask[:, :, 1:]
+    return grown
+
+
+# Fill from seed through cells that are passable (6 connected)
+def flood_fill (seed, passable):
+    filled = seed & passable
+    count = int(filled.sum())
+    while True:
+        filled = _dilate(filled) & passable
+        new_count = int(filled.sum())
+        if (new_count == count):
+            return filled
+        count = new_count
+
+
+# Returns a boolean array of the cells that can be reached from outside
+# open_blocks are ids which don't fill the cell (air is always open)
+# The array is padded by one cell on each side (y+2,x+2,z+2) so that all
+# the area around the capture is outside
+def outside_mask (capture, open_blocks):
+    (ids, data) = capture.as_arrays()
+    passable = (ids == 0) | numpy.isin(ids, list(open_blocks))
+    passable = numpy.pad(passable, 1, constant_values=True)
+    seed = numpy.zeros(passable.shape, dtype=bool)
+    seed[0] = seed[-1] = True
+    seed[:, 0] = seed[:, -1] = True
+    seed[:, :, 0] = seed[:, :, -1] = True
+    return flood_fill(seed, passable)
+
+
+# Returns a boolean array (y,x,z) of cells to keep - anything within
+# wall_thickness of the outside (open blocks reached from outside are
+# kept as well)
+# Grown in 26 directions - only growing through the faces would remove
+# the block inside a concave edge (which only touches the outside
+# diagonally) leaving the two walls joined along an edge with no
+# thickness, so the hollow would not be sealed
+def shell_mask (outside, wall_thickness = 1):
+    keep = outside
+    for count in range (0, wall_thickness):
+        keep = _dilate_box(keep)
+    return keep[1:-1, 1:-1, 1:-1]
+
+
+# True if the hollow cells (not in keep) are all separated from the
+# outside by at least one kept cell in every direction (including
+# diagonally) - ie. the shell is sealed
+# keep is from shell_mask, outside from outside_mask (with the padding)
+def shell_is_closed (keep, outside):
+    hollow = numpy.pad(~keep, 1, constant_values=False) & ~outside
+    return not (_dilate_box(outside) & hollow).any()
+
+
+# Cut a hole from the lowest block of each hollow straight down to the
+# outside (or the bottom of the capture)
+# keep is the array from shell_mask, it is updated
+# outside is the array from outside_mask (without the padding)
+# Returns the number of holes
+def cut_drain_holes (keep, outside):
+    hollow = ~keep & ~outside
+    remaining = hollow.copy()
+    holes = 0
+    while remaining.any():
+        # Lowest cell (minimum y) of the next hollow, and the whole hollow
+        index = int(numpy.flatnonzero(remaining)[0])
+        (y, x, z) = numpy.unravel_index(index, remaining.shape)
+        seed = numpy.zeros(remaining.shape, dtype=bool)
+        seed[y, x, z] = True
+        remaining &= ~flood_fill(seed, hollow)
+        # Cells below the lowest cell are not in this hollow
+        for hole_y in range (y - 1, -1, -1):
+            if (outside[hole_y, x, z]):
+                break
+            keep[hole_y, x, z] = False
+        holes += 1
+    return holes
+
+
+# Returns a copy of capture with the blocks inside the shell set to air
+# and the number of blocks removed
+# open_blocks - see outside_mask
+def hollow_capture (capture, open_blocks, wall_thickness = 1, drain_holes = False):
+    if (numpy == None):
+        raise ImportError("Hollowing requires NumPy")
+    if (wall_thickness < 1):
+        raise ValueError("Wall thickness must be at least 1 block")
+    outside = outside_mask(capture, open_blocks)
+    keep = shell_mask(outside, wall_thickness)
+    if (drain_holes):
+        cut_drain_holes(keep, outside[1:-1, 1:-1, 1:-1])
+
+    (ids, data) = capture.as_arrays()
+    remove = ~keep & (ids != 0)
+    hollowed = BlockCapture(capture.origin, capture.size)
+    hollowed.ids[:] = numpy.where(remove, 0, ids).tobytes()
+    hollowed.data[:] = numpy.where(remove, 0, data).tobytes()
+    return (hollowed, int(remove.sum()))
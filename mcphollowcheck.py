@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import sys
+from mbffile import BlockCapture
+from mcphollow import hollow_capture, outside_mask, shell_is_closed, shell_mask
+
+# NumPy is required for hollowing
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+##########################################################################
+# mcphollowcheck.py
+# Checks that the hollow shell (see mcphollow.py) is sealed
+# Does not need Minecraft, mcpi or PyQt5 - requires NumPy
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Hollows solids with concave edges and corners for several wall
+# thicknesses, and fails (exit status 1) if any hollow touches the
+# outside - even only diagonally, which would leave a seam with no
+# thickness in the printed wall.
+#
+###########################################################################
+
+
+# Wall thicknesses checked
+wall_thicknesses = (1, 2, 3)
+
+
+# Returns a capture size (x, y, z) of stone where solid(x, y, z) is True
+def solid_capture (size, solid):
+    capture = BlockCapture((0, 0, 0), size)
+    for index in range (0, len(capture)):
+        if (solid(*capture.position(index))):
+            capture.ids[index] = 1
+    return capture
+
+
+# Solids to check - name: capture
+def check_solids ():
+    return {
+        'cube':solid_capture((10, 10, 10), lambda x, y, z: True),
+        # L shape in x, y (concave edge along z)
+        'l_shape':solid_capture((16, 16, 16), lambda x, y, z: x < 8 or y < 8),
+        # Cube with one corner removed (concave corner)
+        'notched_cube':solid_capture((16, 16, 16), lambda x, y, z: x < 8 or y < 8 or z < 8)
+        }
+
+
+# Returns list of errors
+def check_hollow_shell ():
+    errors = []
+    for (name, capture) in check_solids().items():
+        outside = outside_mask(capture, ())
+        for wall_thickness in wall_thicknesses:
+            if (not shell_is_closed(shell_mask(outside, wall_thickness), outside)):
+                errors.append("{}: wall {} is not sealed".format(name, wall_thickness))
+            # Something must have been removed, or the check means nothing
+            (hollowed, removed) = hollow_capture(capture, (), wall_thickness)
+            if (removed == 0):
+                errors.append("{}: wall {} removed no blocks".format(name, wall_thickness))
+    return errors
+
+
+def main ():
+    if (numpy == None):
+        print ("The hollow check requires NumPy")
+        return 1
+    errors = check_hollow_shell()
+    for error in errors:
+        print ("Check failed: {}".format(error))
+    if (len(errors) > 0):
+        return 1
+    print ("Hollow shell checks passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
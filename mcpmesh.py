@@ -0,0 +1,228 @@
+##########################################################################
+# mcpmesh.py
+# Mesh export - writes a triangle mesh (binary STL or 3MF) directly
+# from the blocks, without going through OpenSCAD
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# The blocks are converted into a grid of half blocks (in OpenSCAD axis
+# order) so that stairs and half blocks have the same shape as the
+# stair_block / half_block modules in minecraft-print.scad (the mesh of
+# each shape in the block registry). Only the faces
+# between a filled and an empty half block are written, so faces hidden
+# between blocks are never generated. Positions are the same as the
+# OpenSCAD file so a mesh lines up with a converted .scad file.
+# Requires NumPy.
+#
+###########################################################################
+
+import struct
+import zipfile
+from mbffile import atomic_write
+from mcpcapture import CancelledError
+from mcpneighbours import left_direction, opposite_direction
+
+# NumPy is optional for minecraft-print, but required for mesh export
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+mesh_formats = ['stl', '3mf']
+
+# Triangles / vertices written to the file at a time
+mesh_write_chunk = 100000
+
+# Binary STL triangle - normal, 3 vertices, attribute
+stl_triangle = [('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')]
+
+
+# Returns which half (0 or 1) of each block is filled for half block hx,
+# hy, hz (OpenSCAD axis) - matching the modules in minecraft-print.scad
+# data 8 and above are corners (see mcpneighbours)
+def _stair_half (data, hx, hy, hz):
+    direction = data % 4
+    upside_down = (data % 8) > 3
+    shape = data // 8
+    # whole block on bottom if 3 or less / top if higher
+    filled = upside_down == (hz == 1)
+    # quarter on top for 0 to 3, underneath for 4 to 7
+    quarter = numpy.array([hx == 0, hx == 1, hy == 1, hy == 0])
+    in_quarter = quarter[direction]
+    # corners - side to the left for 1 and 3, right for 2 and 4
+    other = numpy.where((shape == 1) | (shape == 3), numpy.array(left_direction)[direction],
+        numpy.array(opposite_direction)[numpy.array(left_direction)[direction]])
+    in_other = quarter[other]
+    in_quarter = numpy.where(shape == 0, in_quarter,
+        numpy.where(shape <= 2, in_quarter | in_other, in_quarter & in_other))
+    return filled | ((upside_down == (hz == 0)) & in_quarter)
+
+
+def _half_block_half (data, hz):
+    # upper half if data > 7
+    return (data > 7) == (hz == 1)
+
+
+# Builds the half block grid (OpenSCAD x, y, z) from a capture
+# Returns (grid, base) where base is the OpenSCAD block position of the
+# grid corner, using offset in the same way as convert_to_openscad_file
+# registry is the BlockRegistry (see mcpblocks) - the mesh of each shape
+# gives the geometry
+def half_block_grid (capture, offset, registry):
+    (ids, data) = capture.as_arrays()
+    # capture is (y,x,z) - OpenSCAD is (-x,z,y)
+    ids = ids.transpose(1, 2, 0)[::-1]
+    data = data.transpose(1, 2, 0)[::-1]
+    is_stair = registry.mask(ids, lambda shape: shape != None and shape.mesh == 'stair')
+    is_half = registry.mask(ids, lambda shape: shape != None and shape.mesh == 'half')
+    standard = registry.mask(ids, lambda shape: shape != None and shape.mesh == 'full')
+
+    (size_x, size_y, size_z) = ids.shape
+    grid = numpy.zeros((size_x * 2, size_y * 2, size_z * 2), dtype=bool)
+    for hx in (0, 1):
+        for hy in (0, 1):
+            for hz in (0, 1):
+                grid[hx::2, hy::2, hz::2] = (standard
+                    | (is_stair & _stair_half(data, hx, hy, hz))
+                    | (is_half & _half_block_half(data, hz)))
+
+    return (grid, grid_base(capture, offset))
+
+
+# OpenSCAD block position of the corner of the half block grid
+def grid_base (capture, offset):
+    (origin_x, origin_y, origin_z) = capture.origin
+    return (-1 * (origin_x + capture.size[0] - 1) + offset[0], origin_z + offset[1], origin_y + offset[2])
+
+
+# Returns the faces between filled and empty cells
+# list of (axis, direction, cells) where cells is an array (n,3) of the
+# filled cell for each face
+def exposed_faces (grid):
+    padded = numpy.pad(grid, 1)
+    inner = padded[1:-1, 1:-1, 1:-1]
+    faces = []
+    for axis in range (0, 3):
+        for direction in (1, -1):
+            # the neighbouring cell in the direction of the face
+            neighbour = [slice(1, -1)] * 3
+            neighbour[axis] = slice(1 + direction, padded.shape[axis] - 1 + direction)
+            exposed = inner & ~padded[tuple(neighbour)]
+            faces.append((axis, direction, numpy.argwhere(exposed)))
+    return faces
+
+
+# Two triangles for each face, counter clockwise when seen from outside
+# Returns (triangles (n,3,3), normals (n,3)) in grid units
+def face_triangles (axis, direction, cells):
+    unit = numpy.eye(3, dtype=numpy.int64)
+    u = unit[(axis + 1) % 3]
+    v = unit[(axis + 2) % 3]
+    if (direction == 1):
+        corner = cells + unit[axis]
+        quad = [corner, corner + u, corner + u + v, corner + v]
+    else:
+        corner = cells
+        quad = [corner, corner + v, corner + u + v, corner + u]
+    triangles = numpy.empty((len(cells) * 2, 3, 3), dtype=numpy.int64)
+    triangles[0::2] = numpy.stack([quad[0], quad[1], quad[2]], axis=1)
+    triangles[1::2] = numpy.stack([quad[0], quad[2], quad[3]], axis=1)
+    normals = numpy.zeros((len(triangles), 3), dtype=numpy.float32)
+    normals[:, axis] = direction
+    return (triangles, normals)
+
+
+# Returns (triangles, normals, base) for the whole capture
+# triangles are in half blocks from base (see half_block_grid) so do not
+# depend on the block size - see scale_mesh
+def build_mesh_faces (capture, offset, registry, progress = None):
+    if (numpy == None):
+        raise ImportError("Mesh export requires NumPy")
+    (grid, base) = half_block_grid(capture, offset, registry)
+    if (progress != None and progress(20)):
+        raise CancelledError()
+    all_triangles = []
+    all_normals = []
+    for (axis, direction, cells) in exposed_faces(grid):
+        (triangles, normals) = face_triangles(axis, direction, cells)
+        all_triangles.append(triangles.astype(numpy.int32))
+        all_normals.append(normals)
+    if (progress != None and progress(50)):
+        raise CancelledError()
+    return (numpy.concatenate(all_triangles), numpy.concatenate(all_normals), base)
+
+
+# Save / load the result of build_mesh_faces (.npz)
+def save_mesh_faces (fp, faces):
+    (triangles, normals, base) = faces
+    numpy.savez(fp, triangles=triangles, normals=normals, base=numpy.array(base))
+
+
+def load_mesh_faces (filename):
+    with numpy.load(filename) as saved:
+        return (saved['triangles'], saved['normals'], tuple(saved['base'].tolist()))
+
+
+# Triangles from build_mesh_faces in mm as float32
+def scale_mesh (triangles, base, block_size):
+    # half blocks to mm
+    return (triangles * (block_size / 2) + numpy.array(base) * block_size).astype(numpy.float32)
+
+
+# Returns (triangles, normals) for the whole capture, triangles are in
+# mm as float32
+def build_mesh (capture, offset, block_size, registry, progress = None):
+    (triangles, normals, base) = build_mesh_faces(capture, offset, registry, progress)
+    return (scale_mesh(triangles, base, block_size), normals)
+
+
+# Binary STL
+def write_stl (filename, triangles, normals, progress = None):
+    with atomic_write(filename, 'wb') as outfile:
+        outfile.write(b"minecraft-print".ljust(80, b" "))
+        outfile.write(struct.pack("<I", len(triangles)))
+        for start in range (0, len(triangles), mesh_write_chunk):
+            if (progress != None and progress(50 + (start / len(triangles)) * 50)):
+                raise CancelledError()
+            chunk = numpy.zeros(len(triangles[start:start+mesh_write_chunk]), dtype=stl_triangle)
+            chunk['normal'] = normals[start:start+mesh_write_chunk]
+            chunk['vertices'] = triangles[start:start+mesh_write_chunk]
+            outfile.write(chunk.tobytes())
+
+
+# 3MF - zip containing the model xml, vertices are shared between triangles
+def write_3mf (filename, triangles, normals, progress = None):
+    (vertices, indexes) = numpy.unique(triangles.reshape(-1, 3), axis=0, return_inverse=True)
+    indexes = indexes.reshape(-1, 3)
+    with atomic_write(filename, 'wb') as outfile:
+        with zipfile.ZipFile(outfile, 'w', zipfile.ZIP_DEFLATED) as package:
+            package.writestr("[Content_Types].xml",
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">\n'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>\n'
+                '<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>\n'
+                '</Types>\n')
+            package.writestr("_rels/.rels",
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">\n'
+                '<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>\n'
+                '</Relationships>\n')
+            with package.open("3D/3dmodel.model", 'w') as model:
+                model.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                    b'<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">\n'
+                    b'<resources>\n<object id="1" type="model">\n<mesh>\n<vertices>\n')
+                for start in range (0, len(vertices), mesh_write_chunk):
+                    if (progress != None and progress(50 + (start / len(vertices)) * 25)):
+                        raise CancelledError()
+                    model.write("".join('<vertex x="{}" y="{}" z="{}"/>\n'.format(*vertex)
+                        for vertex in vertices[start:start+mesh_write_chunk].tolist()).encode())
+                model.write(b'</vertices>\n<triangles>\n')
+                for start in range (0, len(indexes), mesh_write_chunk):
+                    if (progress != None and progress(75 + (start / len(indexes)) * 25)):
+                        raise CancelledError()
+                    model.write("".join('<triangle v1="{}" v2="{}" v3="{}"/>\n'.format(*triangle)
+                        for triangle in indexes[start:start+mesh_write_chunk].tolist()).encode())
+                model.write(b'</triangles>\n</mesh>\n</object>\n</resources>\n'
+                    b'<build>\n<item objectid="1"/>\n</build>\n</model>\n')
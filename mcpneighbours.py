@@ -0,0 +1,153 @@
+##########################################################################
+# mcpneighbours.py
+# Neighbour analysis - shapes which depend on the adjacent blocks
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Stairs next to another stair at right angles become inner or outer
+# corners, and fences / panes connect to the blocks beside them. The
+# shape of these blocks is not part of the data in Minecraft so it is
+# worked out here and stored in the data passed to the OpenSCAD module.
+# Each rule is applied to every block of a kind at once by looking up
+# the neighbours at a fixed offset in the capture arrays, so the time
+# is linear in the size of the capture.
+# Which blocks are stairs / fences / panes is set by neighbours in the
+# block registry (see mcpblocks).
+# Requires NumPy - without it the blocks are not changed.
+#
+###########################################################################
+
+from mbffile import BlockCapture
+
+# NumPy is optional for minecraft-print, but required for neighbour analysis
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Directions are the same as the stair data
+# 0=East (+x), 1=West (-x), 2=South (+z), 3=North (-z)
+# Side to the left (counter clockwise seen from above) / opposite of each
+left_direction = [3, 2, 0, 1]
+opposite_direction = [1, 0, 3, 2]
+
+# Stair corners are stored as data + 8 * shape (same order as the
+# Minecraft stair shape)
+stair_straight = 0
+stair_inner_left = 1
+stair_inner_right = 2
+stair_outer_left = 3
+stair_outer_right = 4
+
+# Fence / pane data is the sides connected - 1 << direction
+# eg. 1=East, 2=West, 4=South, 8=North
+
+# Kinds of block that fences / panes connect to
+neighbour_none = 0
+neighbour_solid = 1
+
+
+# True if neighbour analysis can be used
+def neighbours_supported ():
+    return numpy != None
+
+
+# Returns the value in values (capture order) of the neighbour of each
+# of cells in direction (int or array of directions) or fill if the
+# neighbour is outside the capture
+def neighbour_values (values, cells, direction, size, fill):
+    (size_x, size_y, size_z) = size
+    direction = numpy.broadcast_to(direction, cells.shape)
+    x = (cells // size_z) % size_x
+    z = cells % size_z
+    along_x = direction < 2
+    position = numpy.where(along_x, x, z)
+    limit = numpy.where(along_x, size_x, size_z)
+    inside = numpy.where(direction % 2 == 0, position < limit - 1, position > 0)
+    step = numpy.array([size_z, -size_z, 1, -1])[direction]
+    result = numpy.full(cells.shape, fill, dtype=values.dtype)
+    result[inside] = values[cells[inside] + step[inside]]
+    return result
+
+
+# Returns the stair shape (see stair_straight etc.) for each of cells
+# key is the stair data (direction and upside down) of every block in
+# the capture, or -1 if not a stair
+def stair_shapes (key, cells, size):
+    own = key[cells]
+    direction = own & 3
+    upside_down = own >> 2
+    left = numpy.array(left_direction)[direction]
+    opposite = numpy.array(opposite_direction)
+
+    # Stair facing this one at right angles (same way up)
+    def corner (neighbour):
+        other = neighbour & 3
+        return (neighbour >= 0) & ((neighbour >> 2) == upside_down) & ((other >> 1) != (direction >> 1))
+
+    shapes = numpy.full(cells.shape, stair_straight, dtype=numpy.uint8)
+
+    # Stair behind (the high side) facing across - outer corner, unless
+    # there is a stair the same on the other side
+    front = neighbour_values(key, cells, direction, size, -1)
+    front_direction = front & 3
+    outer = corner(front) & (neighbour_values(key, cells, opposite[front_direction], size, -1) != own)
+    shapes[outer] = numpy.where(front_direction == left, stair_outer_left, stair_outer_right)[outer]
+
+    # Stair in front (the low side) facing across - inner corner
+    back = neighbour_values(key, cells, opposite[direction], size, -1)
+    back_direction = back & 3
+    inner = ~outer & corner(back) & (neighbour_values(key, cells, back_direction, size, -1) != own)
+    shapes[inner] = numpy.where(back_direction == left, stair_inner_left, stair_inner_right)[inner]
+    return shapes
+
+
+# Returns the sides connected (see fence data) for each of cells
+# kinds is the neighbour kind of every block in the capture, and
+# connects the kinds which are joined to
+def connected_sides (kinds, cells, size, connects):
+    sides = numpy.zeros(cells.shape, dtype=numpy.uint8)
+    for direction in range (0, 4):
+        neighbour = neighbour_values(kinds, cells, direction, size, neighbour_none)
+        sides[numpy.isin(neighbour, connects)] |= 1 << direction
+    return sides
+
+
+# Returns a copy of capture with the data of stairs, fences and panes
+# set from their neighbours (ids are shared with capture) or capture if
+# there are none of these blocks
+def apply_neighbour_shapes (capture, registry):
+    if (numpy == None):
+        return capture
+    (ids, data) = capture.as_arrays()
+    ids = ids.reshape(-1)
+    data = data.reshape(-1)
+    # Kind for each registry shape - solid, or a number for each type of
+    # neighbours (eg. stair, fence)
+    neighbour_kinds = sorted(set(shape.neighbours for shape in registry.shapes[1:] if shape.neighbours != None))
+    kind_lookup = [neighbour_none]
+    for shape in registry.shapes[1:]:
+        if (shape.neighbours != None):
+            kind_lookup.append(neighbour_solid + 1 + neighbour_kinds.index(shape.neighbours))
+        elif (shape.mesh == 'full'):
+            kind_lookup.append(neighbour_solid)
+        else:
+            kind_lookup.append(neighbour_none)
+    kinds = numpy.array(kind_lookup, dtype=numpy.uint8)[numpy.frombuffer(registry.table, dtype=numpy.uint8)][ids]
+    if (not kinds[kinds > neighbour_solid].any()):
+        return capture
+
+    new_data = data.copy()
+    for (kind_number, neighbours) in enumerate(neighbour_kinds, neighbour_solid + 1):
+        cells = numpy.flatnonzero(kinds == kind_number)
+        if (len(cells) == 0):
+            continue
+        if (neighbours == 'stair'):
+            key = numpy.where(kinds == kind_number, data & 7, -1).astype(numpy.int16)
+            new_data[cells] = (data[cells] & 7) + 8 * stair_shapes(key, cells, capture.size)
+        else:
+            # fence / pane - join to the same kind or a solid block
+            new_data[cells] = connected_sides(kinds, cells, capture.size, [neighbour_solid, kind_number])
+    return BlockCapture(capture.origin, capture.size, capture.ids, bytearray(new_data.tobytes()))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+import sys, os
+import argparse
+import json
+import platform
+import random
+import shutil
+import tempfile
+import time
+import mcpcore
+from mcpcore import McprintEngine
+from mcpserver import McpiServer, VoxelWorld
+from mcpbench import generate_world, parse_size, world_name
+from mbffile import load_mbf, save_mbf
+
+##########################################################################
+# mcpnetbench.py [options]
+# Benchmark of capture and restore against the stand in server
+# (mcpserver.py) - measures the commands, bytes and time for each way of
+# capturing and restoring
+# Does not need Minecraft or PyQt5 - requires mcpi and NumPy
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Options:
+#     --size 32x16x32              area to capture / restore
+#     --layout / --fill / --stairs / --slabs   world (see mcpbench.py)
+#     --rtt 0.01 --bandwidth 1000000 --command-cost 0.00005
+#     --block-cost 0                network / server (see mcpserver.py)
+#     --changes 0.05                proportion of blocks changed before
+#                                   each restore
+#     --cases capture_tiled restore_diff ...   default is all cases
+#     --output results.json         save results
+#
+# The world is reset before each case. Captures are checked against the
+# world and restores against the original world (verified in the
+# results, a case that is not verified fails). Each case ends with a
+# getBlock so that the time includes the server running any commands
+# without a reply (eg. setBlocks) - this is included in the commands.
+#
+###########################################################################
+
+
+# Increase if the results change so they can't be compared
+results_version = 1
+
+# Space around the area in the world (x and z)
+world_margin = 8
+
+# Build plate block (stone)
+buildplate_block = 1
+
+
+# Cases - each takes (engine, area, filename) where area is (start, size)
+# and filename is an undo file of the area (before any changes)
+# Restore cases change the world first (not included in the results)
+def case_capture_tiled (engine, area, filename):
+    return engine.save_blocks(filename + ".capture", area[0], area[1])
+
+def case_capture_tiled_4 (engine, area, filename):
+    engine.connections = 4
+    return engine.save_blocks(filename + ".capture", area[0], area[1])
+
+def case_capture_all_data (engine, area, filename):
+    return engine.save_blocks(filename + ".capture", area[0], area[1], get_all_data=True)
+
+def case_capture_pi (engine, area, filename):
+    engine.mcpi_platform = 'raspberrypi'
+    return engine.save_blocks(filename + ".capture", area[0], area[1])
+
+def case_restore_fill (engine, area, filename):
+    return engine.restore_undo(filename, mode='fill')
+
+def case_restore_diff (engine, area, filename):
+    return engine.restore_undo(filename, mode='diff')
+
+def case_restore_diff_4 (engine, area, filename):
+    engine.connections = 4
+    return engine.restore_undo(filename, mode='diff')
+
+def case_capture_async (engine, area, filename):
+    engine.use_asyncio = True
+    return engine.save_blocks(filename + ".capture", area[0], area[1])
+
+def case_restore_diff_async (engine, area, filename):
+    engine.use_asyncio = True
+    return engine.restore_undo(filename, mode='diff')
+
+def case_clear_area (engine, area, filename):
+    engine.clear_area(area[0], area[1], filename + ".clear")
+    return True
+
+def case_draw_buildplate (engine, area, filename):
+    (start, size) = area
+    engine.draw_buildplate((start[0], start[1] - 1, start[2]), (size[0], 1, size[2]), buildplate_block)
+    return True
+
+cases = {
+    'capture_tiled':case_capture_tiled,
+    'capture_tiled_4':case_capture_tiled_4,
+    'capture_all_data':case_capture_all_data,
+    'capture_pi':case_capture_pi,
+    'restore_fill':case_restore_fill,
+    'restore_diff':case_restore_diff,
+    'restore_diff_4':case_restore_diff_4,
+    'capture_async':case_capture_async,
+    'restore_diff_async':case_restore_diff_async,
+    'clear_area':case_clear_area,
+    'draw_buildplate':case_draw_buildplate
+    }
+
+
+# Change proportion of the blocks in the area of world (air to stone,
+# anything else to air)
+def change_blocks (world, capture, proportion, seed = 1):
+    chooser = random.Random(seed)
+    (origin_x, origin_y, origin_z) = capture.origin
+    for index in chooser.sample(range (0, len(capture)), int(len(capture) * proportion)):
+        (x, y, z) = capture.position(index)
+        block_id = 1 if capture.ids[index] == 0 else 0
+        world.set_block(origin_x + x, origin_y + y, origin_z + z, block_id)
+
+
+# True if the area of world is the same as capture
+# If data_blocks is set then the data is only compared for those blocks
+# (a capture only reads the data of data_blocks, the others are 0)
+def world_matches (world, capture, data_blocks = None):
+    (origin_x, origin_y, origin_z) = capture.origin
+    (size_x, size_y, size_z) = capture.size
+    rows = world._rows(origin_x, origin_y, origin_z, origin_x+size_x-1, origin_y+size_y-1, origin_z+size_z-1)
+    for (row, (index, before, length, after)) in enumerate(rows):
+        start = row * size_z
+        if (world.capture.ids[index:index+length] != capture.ids[start:start+size_z]):
+            return False
+        world_data = world.capture.data[index:index+length]
+        capture_data = capture.data[start:start+size_z]
+        if (world_data == capture_data):
+            continue
+        if (data_blocks == None):
+            return False
+        for z in range (0, size_z):
+            if (capture_data[z] != world_data[z] and (capture_data[z] != 0 or capture.ids[start+z] in data_blocks)):
+                return False
+    return True
+
+
+# Runs case, returns the result (dict)
+def measure_case (case, server, original, area, filename, changes):
+    world = server.world
+    # Reset the world
+    world.capture.ids[:] = original[0]
+    world.capture.data[:] = original[1]
+    if (case.startswith("restore")):
+        with load_mbf(filename) as capture:
+            change_blocks(world, capture, changes)
+    engine = McprintEngine(address="localhost", port=server.port)
+    if (not engine.connect_to_minecraft()):
+        raise IOError("Unable to connect to the server")
+    server.stats.reset()
+    engine.tracer.reset()
+    start_time = time.perf_counter()
+    try:
+        success = cases[case](engine, area, filename)
+        # Wait until the server has run every command
+        engine.mc.getBlock(*area[0])
+        seconds = time.perf_counter() - start_time
+    finally:
+        engine.disconnect()
+    result = {'case':case, 'success':bool(success), 'seconds':seconds}
+    result.update(server.stats.as_dict())
+    # Time and commands of each phase seen by the client (see mcptrace)
+    result['phases'] = {name:{'seconds':stats['seconds'], 'commands':stats['total_commands']}
+        for (name, stats) in engine.tracer.as_dict()['phases'].items()}
+    if (case.startswith("restore")):
+        with load_mbf(filename) as capture:
+            result['verified'] = world_matches(world, capture)
+    elif (case.startswith("capture")):
+        # The capture is from the original world
+        if (success):
+            with load_mbf(filename + ".capture") as capture:
+                result['verified'] = world_matches(world, capture, set(engine.blocks.data_ids()))
+            os.remove(filename + ".capture")
+        else:
+            result['verified'] = False
+    return result
+
+
+def create_parser ():
+    parser = argparse.ArgumentParser(description="Benchmark minecraft-print capture and restore")
+    parser.add_argument("--size", type=parse_size, default=(32,16,32), metavar="XxYxZ", help="area to capture / restore")
+    parser.add_argument("--layout", choices=["terrain","random"], default="terrain", help="height map or scattered blocks")
+    parser.add_argument("--fill", type=float, default=0.3, help="proportion of the world that is solid")
+    parser.add_argument("--stairs", type=float, default=0.05, help="proportion of solid blocks that are stairs")
+    parser.add_argument("--slabs", type=float, default=0.05, help="proportion of solid blocks that are slabs")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the world")
+    parser.add_argument("--rtt", type=float, default=0.01, help="round trip time (seconds)")
+    parser.add_argument("--bandwidth", type=float, default=1000000, help="bytes per second (0 = unlimited)")
+    parser.add_argument("--command-cost", type=float, default=0.00005, help="server time for each command (seconds)")
+    parser.add_argument("--block-cost", type=float, default=0, help="server time for each block (seconds)")
+    parser.add_argument("--changes", type=float, default=0.05, help="proportion of blocks changed before restoring")
+    parser.add_argument("--cases", nargs="+", choices=list(cases.keys()), default=list(cases.keys()))
+    parser.add_argument("--output", default=None, help="save results (json)")
+    return parser
+
+
+def main (argv = None):
+    args = create_parser().parse_args(argv)
+    mcpcore.debug = False
+    capture = generate_world(args.size, args.layout, args.fill, args.stairs, args.slabs, args.seed)
+    # Area starts at y=1 so the build plate is in the world
+    capture.origin = (0, 1, 0)
+    area = (capture.origin, capture.size)
+    world = VoxelWorld((-world_margin, 0, -world_margin),
+        (args.size[0] + world_margin * 2, args.size[1] + 2, args.size[2] + world_margin * 2))
+    world.load(capture)
+    original = (bytes(world.capture.ids), bytes(world.capture.data))
+
+    work_dir = tempfile.mkdtemp(prefix="mcpnetbench-")
+    filename = os.path.join(work_dir, "undo.mbf")
+    save_mbf(filename, capture)
+    server = McpiServer(world, 0, "localhost", args.rtt, args.bandwidth, args.command_cost, args.block_cost).start()
+    results = []
+    try:
+        for case in args.cases:
+            result = measure_case(case, server, original, area, filename, args.changes)
+            results.append(result)
+            status = ""
+            if (not result['success']):
+                status = "FAILED"
+            elif (result.get('verified') == False):
+                status = "NOT VERIFIED"
+            # bytes sent / received by the client
+            print ("{:16} {:8.3f}s {:>8} commands {:>10} bytes sent {:>10} bytes received {}".format(
+                case, result['seconds'], result['commands'], result['bytes_received'], result['bytes_sent'], status))
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if (args.output != None):
+        output = {
+            'version':results_version,
+            'date':time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python':platform.python_version(),
+            'platform':platform.platform(),
+            'world':world_name(args.size, args.layout, args.fill, args.stairs, args.slabs),
+            'settings':{'rtt':args.rtt, 'bandwidth':args.bandwidth, 'command_cost':args.command_cost,
+                'block_cost':args.block_cost, 'changes':args.changes, 'seed':args.seed},
+            'results':results
+            }
+        with open(args.output, 'w') as fp:
+            json.dump(output, fp, indent=1)
+    failed = [result for result in results if not result['success'] or result.get('verified') == False]
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
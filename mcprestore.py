@@ -0,0 +1,184 @@
+##########################################################################
+# mcprestore.py
+# Restore planning - works out which blocks need to be written to return
+# an area of the world to the contents of an undo file
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Blocks that need writing are merged into the largest boxes of the same
+# id and data that can be found (greedy - extend along z, then x, then y)
+# so that each box is a single setBlocks command. A box may also cover
+# blocks that are already correct if they have the same id and data.
+# Optionally the whole area is first filled with one block, which is
+# chosen to give the fewest commands.
+# Merging requires NumPy, without it each block is a separate command.
+#
+###########################################################################
+
+from collections import Counter
+
+# NumPy is optional - used to compare and merge large areas
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of most used blocks tried as the fill block
+fill_candidates = 3
+
+
+# Compares the target (undo file) with the current contents of the world
+# Both must be BlockCaptures of the same area
+# Data values are only compared for ids in data_blocks, as the current
+# world data is only read for those blocks (getBlocks returns ids only)
+# Returns list of indexes where the blocks differ
+def diff_captures (target, current, data_blocks = ()):
+    if (target.origin != current.origin or target.size != current.size):
+        raise ValueError("Captures must be of the same area")
+    if (numpy != None):
+        return numpy.flatnonzero(_diff_mask(target, current, data_blocks)).tolist()
+    changes = []
+    for index in range (0, len(target)):
+        if (target.ids[index] != current.ids[index]):
+            changes.append(index)
+        elif (target.ids[index] in data_blocks and target.data[index] != current.data[index]):
+            changes.append(index)
+    return changes
+
+
+# Boolean array (y,x,z) of changed blocks
+def _diff_mask (target, current, data_blocks):
+    (target_ids, target_data) = target.as_arrays()
+    (current_ids, current_data) = current.as_arrays()
+    changed = target_ids != current_ids
+    if (len(data_blocks) > 0):
+        has_data = numpy.isin(target_ids, list(data_blocks))
+        changed |= has_data & (target_data != current_data)
+    return changed
+
+
+# Merge the needed blocks into boxes of the same label (id and data)
+# labels and needed are arrays with shape (y,x,z)
+# If overlap is True then boxes may also cover blocks that are already in
+# an earlier box (fewer boxes - fine for setBlocks), if False then every
+# block is in exactly one box
+# Returns list of (x0,y0,z0,x1,y1,z1,label) relative and inclusive
+def merge_boxes (labels, needed, overlap = True):
+    (size_y, size_x, size_z) = labels.shape
+    remaining = needed.copy()
+    remaining_flat = remaining.reshape(-1)
+    # Blocks that can be included in a box of the same label
+    if (overlap):
+        usable = numpy.ones(labels.shape, dtype=bool)
+    else:
+        usable = remaining
+    boxes = []
+    for index in numpy.flatnonzero(needed).tolist():
+        if (not remaining_flat[index]):
+            continue
+        (yx, z) = divmod(index, size_z)
+        (y, x) = divmod(yx, size_x)
+        label = labels[y, x, z]
+        # extend along z
+        row = (labels[y, x, z:] != label) | ~usable[y, x, z:]
+        z1 = z + (int(row.argmax()) if row.any() else len(row))
+        # extend along x while the whole row matches
+        x1 = x + 1
+        while (x1 < size_x and (labels[y, x1, z:z1] == label).all() and usable[y, x1, z:z1].all()):
+            x1 += 1
+        # extend along y while the whole slab matches
+        y1 = y + 1
+        while (y1 < size_y and (labels[y1, x:x1, z:z1] == label).all() and usable[y1, x:x1, z:z1].all()):
+            y1 += 1
+        remaining[y:y1, x:x1, z:z1] = False
+        boxes.append((x, y, z, x1-1, y1-1, z1-1, int(label)))
+    return boxes
+
+
+# Works out the commands needed to restore target (BlockCapture)
+# changed is an optional list of indexes of blocks that differ from the
+# world (from diff_captures), if None then every block needs to be set
+# Returns dict
+#     boxes - list of (x0,y0,z0,x1,y1,z1,id,data) absolute and inclusive
+#             the first may be a fill of the whole area
+#     commands_before - number of commands without merging
+#     commands_after - number of commands in boxes
+def plan_restore (target, changed = None):
+    if (numpy == None):
+        return _plan_unmerged(target, changed)
+    (ids, data) = target.as_arrays()
+    labels = (ids.astype(numpy.uint16) << 8) | data
+    if (changed is None):
+        needed = numpy.ones(labels.shape, dtype=bool)
+        # Without merging the fill block would be the most used
+        counts = numpy.bincount(labels.reshape(-1))
+        commands_before = 1 + len(target) - int(counts.max()) if len(target) > 0 else 0
+    else:
+        needed = numpy.zeros(labels.shape, dtype=bool)
+        needed.reshape(-1)[changed] = True
+        commands_before = len(changed)
+
+    # Try without a fill, and with a fill of each of the most used blocks
+    best = None
+    candidates = numpy.unique(labels[needed], return_counts=True)
+    order = numpy.argsort(-candidates[1])[0:fill_candidates]
+    for fill_label in [None] + [int(candidates[0][i]) for i in order]:
+        if (fill_label == None):
+            if (changed is None):
+                continue
+            plan = merge_boxes(labels, needed)
+        else:
+            # After the fill all blocks other than the fill need setting
+            plan = merge_boxes(labels, labels != fill_label)
+            plan.insert(0, (0, 0, 0, target.size[0]-1, target.size[1]-1, target.size[2]-1, fill_label))
+        if (best == None or len(plan) < len(best)):
+            best = plan
+
+    (origin_x, origin_y, origin_z) = target.origin
+    boxes = []
+    for (x0, y0, z0, x1, y1, z1, label) in (best or []):
+        boxes.append((origin_x + x0, origin_y + y0, origin_z + z0,
+            origin_x + x1, origin_y + y1, origin_z + z1, label >> 8, label & 0xff))
+    return {'boxes':boxes, 'commands_before':commands_before, 'commands_after':len(boxes)}
+
+
+# Plan without NumPy - fill with most used block (unless diff) and
+# then one command per block
+def _plan_unmerged (target, changed):
+    (origin_x, origin_y, origin_z) = target.origin
+    boxes = []
+    if (changed == None):
+        indexes = range (0, len(target))
+        counts = Counter(zip(bytes(target.ids), bytes(target.data)))
+        if (len(counts) > 0):
+            ((fill_id, fill_data), count) = counts.most_common(1)[0]
+            boxes.append((origin_x, origin_y, origin_z,
+                origin_x + target.size[0] - 1, origin_y + target.size[1] - 1, origin_z + target.size[2] - 1,
+                fill_id, fill_data))
+    else:
+        indexes = changed
+    for index in indexes:
+        if (changed == None and (target.ids[index], target.data[index]) == (fill_id, fill_data)):
+            continue
+        (x, y, z) = target.position(index)
+        boxes.append((origin_x + x, origin_y + y, origin_z + z,
+            origin_x + x, origin_y + y, origin_z + z, target.ids[index], target.data[index]))
+    return {'boxes':boxes, 'commands_before':len(boxes), 'commands_after':len(boxes)}
+
+
+# Sends the boxes from plan_restore, single blocks use setBlock
+# mc can be a connection or a BlockWriter (mcpwriter) to buffer writes
+# progress is an optional callback, returns True to cancel
+# Returns the number of commands sent, or None if cancelled
+def write_boxes (mc, boxes, progress = None):
+    for count in range (0, len(boxes)):
+        (x0, y0, z0, x1, y1, z1, block_id, block_data) = boxes[count]
+        if ((x0, y0, z0) == (x1, y1, z1)):
+            mc.setBlock(x0, y0, z0, block_id, block_data)
+        else:
+            mc.setBlocks(x0, y0, z0, x1, y1, z1, block_id, block_data)
+        if (progress != None and count % 1000 == 0):
+            if (progress((count / len(boxes)) * 100)):
+                return None
+    return len(boxes)
@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 import sys, os
 import math
-import platform
 from PyQt5.QtWidgets import QMainWindow, QApplication, QFileDialog, QProgressDialog
 from mcpgui import *
 #from mcpdialog import *
-from mcpi.minecraft import Minecraft
 import mcpi.block as block
 from blockarea import * 
+from mcpcore import McprintEngine, detect_platform, undo_buildplate_filename, undo_otherblocks_filename
+from mcpworker import EngineWorker
+from mcpcache import ConversionCache
 
 ##########################################################################
 # mcprint.py [args]
@@ -23,58 +24,34 @@ from blockarea import *
 #     --useundo  (enable auto undo creation for Minecraft Pi edition,
 #                 no effect on other editions.) 
 #                 Warning - performance issues for large capture areas
+#     --mergeblocks  (merge standard blocks into cubes in OpenSCAD files,
+#                 much faster to render in OpenSCAD)
+#     --incremental  (when saving over an earlier capture of the same area
+#                 only read the parts which have changed - a change to
+#                 only the direction of a stair etc. may be missed)
+#     --cache    (keep conversions in ~/.cache/minecraft-print so saving
+#                 again, eg. with a different block size, is faster)
 #
 ###########################################################################
 
 
-# x (longitude), y (height), z (latitude)
-# getBlocks returns in incrementing order of z, x, y
+# Time between updates of the status bar (ms) during an operation
+status_interval = 500
 
-undo_buildplate_filename = "undo-build.tmp"
-undo_otherblocks_filename = "undo-print.tmp"
-
-debug = True
-
-# No block is actually an air block
-no_block = block.AIR.id
-
-
-
-# stair blocks - data can be 0=East, 1=West, 2=South, 3=North
-# bit and with 0x4 to determine if upside down
-stair_blocks = [53,67,164,203]
-# half blocks - slabs / planks
-half_blocks = [5,44,126]
-# Exclude blocks (eg. air, lava, water)
-# These are kept in minecraft file, but excluded from OpenSCAD
-# For details of blocks see https://www.stuffaboutcode.com/p/minecraft-api-reference.html
-# Glass is excluded - so will be a gap
-exclude_blocks = [0,6,8,9,10,11,30,31,37,38,39,40,50,51,65,83,95,102]
 
 class Mcprint(QMainWindow):
 
-    mc = None
-        
     # Print area is the area that will be printed
     print_area = BlockArea()
     # Build plate is the area 1 block below the print area where the buildplate 
     # normally is. This will normally be set to a block type, but may be invisible
     build_plate = BlockArea()
-     
-    # Platform = other, can be linux or windows
-    # If change to RaspberryPi then drop use of getBlocks
-    mcpi_platform = 'raspberryjuice'
-    full_undo = True
     
     # When file saved store here so can use in OpenSCAD
     minecraft_saved_file = None
     
-    # Save smallest and largest x,y,z values for print size 
-    # These will be replaced with arrays
-    # Note that this uses xyz openscad rather than minecraft
-    # Excludes air blocks (includes all other blocks)
-    print_dimension_smallest = None
-    print_dimension_largest = None
+    # Background task currently running (only one at a time)
+    worker = None
     
     
     def __init__(self):
@@ -92,17 +69,25 @@ class Mcprint(QMainWindow):
         if any("--useundo" in this_arg for this_arg in sys.argv):
             override_undo = True
         
+        # All capture / restore / convert is handled by the engine
         # Detect if RaspberryPi (as Minecraft Pi has limited functionality)
-        # This is only approximate - detects arm processor if running full 
-        # minecraft client on a ARM processor then can override with --notpi
-        this_system = platform.platform()
-        if (not override_pi and "arm" in this_system):
+        self.engine = McprintEngine(detect_platform(override_pi))
+        if (self.engine.is_pi()):
             print ("Raspberry Pi detected - limited functionality")
-            # Set Raspberry Pi (eg. don't use getBlocks as not supported)
-            self.mcpi_platform = 'raspberrypi'
             # Disable undo for performance (unless override)
             if (not override_undo):
-                full_undo = False
+                self.engine.full_undo = False
+        # Cache conversions so saving again (eg. with a different block
+        # size) doesn't convert the whole file again
+        if any("--cache" in this_arg for this_arg in sys.argv):
+            self.engine.cache = ConversionCache()
+        # Merge standard blocks into cubes in the OpenSCAD file
+        if any("--mergeblocks" in this_arg for this_arg in sys.argv):
+            self.engine.scad_mode = 'merged'
+        # Saving a capture over a file of the same area only reads the
+        # chunks which have changed
+        if any("--incremental" in this_arg for this_arg in sys.argv):
+            self.engine.incremental_capture = True
         
         # Setup handlers (slots)
         self.ui.pushButtonCreate.clicked.connect(self.create_print_area)
@@ -127,26 +112,11 @@ class Mcprint(QMainWindow):
         if (os.path.isfile(undo_otherblocks_filename)):
             self.ui.pushButtonResetArea.setEnabled(True)
 
-        
-    # Returns true if we think this is a raspberry pi, else false
-    def is_pi (self):
-        if (self.mcpi_platform == 'raspberrypi'):
-            return True
-        return False
-        
-              
-    # Change blocks for buildplate
-    # Will only create on first layer - so size_y is ignored
-    # Undo file (if required) should be created before this
-    def draw_buildplate(self, start_position, size, block_type):
-        #print ("Drawing build plate {}".format(block_type))
-        (start_x,start_y,start_z) = start_position
-        (size_x,size_y,size_z) = size
-        
-        # Does not support data values (eg. different textures)
-        self.mc.postToChat ("Setting build plate blocks")
-        self.mc.setBlocks(start_x,start_y,start_z,start_x+size_x-1,start_y+size_y-1,start_z+size_z-1,block_type)
 
+    # Minecraft connection is owned by the engine
+    @property
+    def mc (self):
+        return self.engine.mc
 
 
     # Creates print area and sets buildplate 
@@ -191,13 +161,23 @@ class Mcprint(QMainWindow):
         
         # Create undo file for buildplate
         # Created for Pi or RaspberryJuice regardless
-        #print ("About to save blocks - start "+str(self.build_plate.get_start())+" size "+str(self.build_plate.get_size()))
-        self.save_blocks (undo_buildplate_filename, self.build_plate.get_start(), self.build_plate.get_size(), True)
+        # Build plate is drawn once the undo file is saved
+        self.save_blocks (undo_buildplate_filename, self.build_plate.get_start(), self.build_plate.get_size(), True,
+            lambda success: self.draw_buildplate(success, buildplate_block))
+
+
+    # Called when the build plate undo file is saved
+    # If the undo was cancelled then the build plate is not drawn
+    def draw_buildplate (self, success, buildplate_block):
+        if (not success):
+            return
+        print_area_size = self.print_area.get_size()
+        print_area_start = self.print_area.get_start()
         
         # Check if transparent (ie. don't create any buildplate)
         if (buildplate_block != -1):
             # Create buildplate
-            self.draw_buildplate (self.build_plate.get_start(), self.build_plate.get_size(), buildplate_block)
+            self.engine.draw_buildplate (self.build_plate.get_start(), self.build_plate.get_size(), buildplate_block)
             self.build_plate.set_visible(True)
         else:
             self.build_plate.set_visible(False)
@@ -212,216 +192,74 @@ class Mcprint(QMainWindow):
         self.ui.pushButtonSaveCapture.setEnabled(True)
          
     
+    # Runs an engine function in a background thread whilst showing a
+    # progress dialog (with cancel) - the GUI stays responsive
+    # The status bar shows the progress and the current phase, commands
+    # and blocks per second from the engine tracer (see mcptrace)
+    # on_done (optional) is called with True if completed successfully
+    def run_in_background (self, label, function, args, on_done = None):
+        # Only one operation at a time as they share the connection
+        if (self.worker != None):
+            return
+        progress = QProgressDialog(label, "Cancel", 0, 100, self)
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        progress.setValue(0)
+        
+        self.engine.tracer.reset()
+        self.worker = EngineWorker(function, *args, parent=self)
+        # Latest progress, shown with the tracer status
+        status = {'text':label}
+        
+        def update_status ():
+            self.ui.statusbar.showMessage("{} - {}".format(status['text'], self.engine.tracer.status_text()))
+        
+        timer = QtCore.QTimer(self)
+        timer.timeout.connect(update_status)
+        
+        def update_progress (value, eta):
+            progress.setValue(value)
+            progress.setLabelText("{} {}".format(label, eta))
+            status['text'] = "{} {}% {}".format(label, value, eta)
+            update_status()
+        
+        def finished ():
+            timer.stop()
+            success = self.worker.success
+            progress.close()
+            self.worker = None
+            if (success):
+                self.ui.statusbar.showMessage("{} - complete - {}".format(label, self.engine.tracer.status_text()), 5000)
+            else:
+                self.ui.statusbar.showMessage("{} - cancelled or failed".format(label), 5000)
+            if (on_done != None):
+                on_done(success)
+        
+        self.worker.progress.connect(update_progress)
+        self.worker.finished.connect(finished)
+        progress.canceled.connect(self.worker.cancel)
+        self.worker.start()
+        timer.start(status_interval)
+    
     
     # save minecraft block data (undo file or print export)
-    # overwrites contents of save_filename
-    # get_all_data is an optional parameter. If set to true then it will get the block
-    # data for all blocks. This is more accurate (less loss of information), but 
-    # much slower - recommended for build plate, but not large areas
-    def save_blocks (self, save_filename, start_position, size, get_all_data = False):
-        start_x,start_y,start_z = start_position
-        size_x,size_y,size_z = size
-        
-        #print ("Saving blocks {},{},{} size {},{},{} {}".format(
-        #    start_x,start_y,start_z,
-        #    size_x,size_y,size_z,
-        #    get_all_data))
-        
-        self.print_dimension_smallest = None
-        
-        cancelled = False
-        
-        # Enclose within try catch in case of file errors
-        try:
-            with open(save_filename, 'w') as file:               
-                # Show save dialog whilst reading data
-                #self.progress_bar.start()
-                #print ("Creating progress bar")
-                progress = QtWidgets.QProgressDialog("Reading blocks", "Cancel", 0, 100, self)
-                progress.setWindowFlags(QtCore.Qt.Dialog | QtCore.Qt.FramelessWindowHint | QtCore.Qt.CustomizeWindowHint)
-                progress.setModal(True)
-                progress.setMinimumDuration(0)
-                progress.setCancelButton(None)  # Remove the cancel button. Possibly add a slot that has load() check and cancel
-                progress.setValue(1)  # Set an initial value to show the dialog
-                
-                
-                if (not self.is_pi() and get_all_data == False):
-                    blocks = list(self.mc.getBlocks(start_x,start_y,start_z,start_x+size_x-1,start_y+size_y-1,start_z+size_z-1))
-                # Data from getBlocks is in z,x,y - so use that order to read out of getblocks (or test each block individually)     
-                index = 0
-                for y in range (0, size_y):
-                    for x in range(0, size_x):
-                        for z in range (0, size_z):
-                            block_pos = (start_x+x, start_y+y, start_z+z)
-                            if (self.is_pi() or get_all_data == True):
-                                # Todo - may take a while
-                                block_obj = self.mc.getBlockWithData(block_pos[0], block_pos[1], block_pos[2])
-                                block_id = block_obj.id
-                                block_data = block_obj.data
-                            else :
-                                block_data = 0
-                                block_id = blocks[index]
-                                # if either of these then retrieve again to get the data
-                                if (block_id in stair_blocks or block_id in half_blocks):
-                                    block_obj = self.mc.getBlockWithData(block_pos[0], block_pos[1], block_pos[2])
-                                    block_id = block_obj.id
-                                    block_data = block_obj.data
-                            # Get extra data
-                            file.write("{},{},{},{},{}\n".format(block_pos[0],block_pos[1],block_pos[2],block_id,block_data))
-                            
-                            # If id is > air block then count it as a valid block
-                            # record smallest and largest so we can workout size
-                            # x,y,z are in minecraft format so convert to scad
-                            if block_id > block.AIR.id:
-                                if (self.print_dimension_smallest == None):
-                                    # min / max values
-                                    self.print_dimension_smallest = [x, z, y]
-                                    self.print_dimension_largest = [x, z, y]
-                                else:
-                                    if (x < self.print_dimension_smallest[0]):
-                                        self.print_dimension_smallest[0] = x
-                                    if (z < self.print_dimension_smallest[1]):
-                                        self.print_dimension_smallest[1] = z
-                                    if (y < self.print_dimension_smallest[2]):
-                                        self.print_dimension_smallest[2] = y
-                                    if (x > self.print_dimension_largest[0]):
-                                        self.print_dimension_largest[0] = x
-                                    if (z > self.print_dimension_largest[1]):
-                                        self.print_dimension_largest[1] = z
-                                    if (y > self.print_dimension_largest[2]):
-                                        self.print_dimension_largest[2] = y
-                            
-                            
-                            index += 1
-                    if progress.wasCanceled():
-                        cancelled = True
-                        break
-
-                    progress.setValue((y / size_y ) * 100)
-                    
-                #print ("progress done")
-                #progress.close()
-                progress.setValue(100)
-
-        except Exception as e:
-            # Unable to write to file - warn to console
-            if (debug == True):
-                print ("Unable to write to file "+save_filename+str(e))
+    # Reads blocks in background, on_done is called when complete
+    def save_blocks (self, save_filename, start_position, size, get_all_data = False, on_done = None):
+        self.run_in_background ("Reading blocks", self.engine.save_blocks,
+            (save_filename, start_position, size, get_all_data), on_done)
 
 
 
     def restore_buildplate (self):
         self.connect_to_minecraft()
-        self.restore_undo (undo_buildplate_filename)
+        self.run_in_background ("Restoring blocks", self.engine.restore_undo, (undo_buildplate_filename,))
         
     def restore_area_above (self):
         self.connect_to_minecraft()
-        self.restore_undo (undo_otherblocks_filename)
-                
-    # Restores content of undo file - either just buildplate or entire
-    # use whichever file is appropriate - eg buildplate / area undo file
-    def restore_undo (self, filename):
-                
-        # Get stats about the restore file (bottomleft, topright, mostusedblockid)
-        info = self.get_file_info (filename)
-        
-        # Make sure we have returned a valid entry (valid file)
-        if (info['mostusedblock'] == None):
-            print ("No undo file, or undo file is corrupt")
-            return
-        
-        # First set all positions to most common block
-        # Most common block is used for performance reasons as each setBlock
-        # adds delay in executing
-        # Set all blocks to the most common and then replace those that don't 
-        # match. Improves time, more significant with large number of blocks
-        # of same type eg Air Blocks
-        # Alternative is to use getBlocks and compare to decide if need to change 
-        # block. Which could be faster in some circumstances 
-        # Disadvantage of alt is that this would not always improve performance
-        # if all blocks are different from the undo file and not with buildplate
-        # Also this alternative will not work with Raspberry Pi (which doesn't
-        # have getBlocks() )
-        # Note that mostusedblock assumes data = 0. The block is highly likely
-        # to be Air - so data is not relevant
-        
+        self.run_in_background ("Restoring blocks", self.engine.restore_undo, (undo_otherblocks_filename,))
 
-        self.mc.setBlocks(
-            info['bottomleft'][0],info['bottomleft'][1],info['bottomleft'][2],
-            info['topright'][0],info['topright'][1],info['topright'][2],
-            info['mostusedblock']
-            )
-        
-        # Now replace all blocks which don't match the most common (if match undo type)
-        with open(filename, 'r') as fp:
-            while True:
-                this_line = fp.readline()
-                if not this_line :
-                    break
-                # split based on comma into x,y,z,block_id
-                #split_line = this_line.split(",")
-                split_line = [int(x) for x in this_line.split(",")]
-                # skip if already matches mostcommon
-                if (split_line[3] == info['mostusedblock']):
-                    continue
-                # Reach here then we need to update
-                self.mc.setBlock(split_line[0], split_line[1], split_line[2], split_line[3])
-
-        # Move player on top of the highest block in current x,z position 
-        position = self.mc.player.getTilePos()
-        # Work through that position x,z looking for highest y with air
-        for y in range (info['topright'][1],info['bottomleft'][1],-1):
-            block_id = self.mc.getBlock(position.x, y, position.z)
-            if (block_id != no_block):
-                self.mc.player.setPos (position.x, y+1, position.z)
-                break
-
-                
-                
-    # From file get information on the restore file
-    # Restore file must be cuboid (eg buildplate or full undo file)
-    def get_file_info (self, filename):
-        lowest_pos = [None, None, None]
-        highest_pos = [None, None, None]
-        block_use = {}
-        
-        
-        with open(filename, 'r') as fp:
-            while True:
-                this_line = fp.readline()
-                if not this_line :
-                    break
-                # split based on comma into x,y,z,block_id
-                split_line = [int(x) for x in this_line.split(",")]
-                # If first line set as lowest and highest
-                if (lowest_pos[0] == None):
-                    lowest_pos = [split_line[0],split_line[1],split_line[2]]
-                    highest_pos = [split_line[0],split_line[1],split_line[2]]
-                # If any of the co-ordinate positions are lower then replace
-                # May result in swapping with one where that co-ord is lower,but a different higher
-                # eventually will result in finding the lowest for all as that 
-                # can't be swapped out - same for highest but opposite
-                elif (split_line[0] < lowest_pos[0] or split_line[1] < lowest_pos[1] or split_line[2] < lowest_pos[2]):
-                    lowest_pos = [split_line[0],split_line[1],split_line[2]]
-                elif (split_line[0] > highest_pos[0] or split_line[1] > highest_pos[1] or split_line[2] > highest_pos[2]):
-                    highest_pos = [split_line[0],split_line[1],split_line[2]]
-                    
-                # increment block count (or create if new) [only if data = 0]
-                if (split_line[4] == 0):
-                    if (split_line[3] in block_use):
-                        block_use[split_line[3]] += 1
-                    else:
-                        block_use[split_line[3]] = 1
-
-        most_common_block = None
-        most_common_block_count = 0
-        # get most common block from block_use
-        for key, value in block_use.items():
-            if (value > most_common_block_count):
-                most_common_block = key
-                most_common_block_count = value
-
-        return {'bottomleft':lowest_pos, 'topright':highest_pos, 'mostusedblock':most_common_block}      
 
     # Clears any blocks in the area above the buildplate
     def clear_area_above (self):       
@@ -429,17 +267,15 @@ class Mcprint(QMainWindow):
         size = self.print_area.get_size()
         
         ## TODO - prompt if unable to create backup
-        if (self.full_undo):
-            self.save_blocks (undo_otherblocks_filename, start_pos, size)
-            self.ui.pushButtonResetArea.setEnabled(True)
-        
-        (start_x,start_y,start_z) = start_pos
-        (size_x, size_y, size_z) = size
-        self.mc.setBlocks(
-            start_x,start_y,start_z,
-            start_x+size_x-1, start_y+size_y-1, start_z+size_z-1,
-            no_block
-            )
+        if (self.engine.full_undo):
+            # Only clear once the undo is saved (not if cancelled)
+            def undo_saved (success):
+                if (success):
+                    self.ui.pushButtonResetArea.setEnabled(True)
+                    self.engine.clear_area (start_pos, size)
+            self.save_blocks (undo_otherblocks_filename, start_pos, size, False, undo_saved)
+        else:
+            self.engine.clear_area (start_pos, size)
         
 
     # Converts from string (used in GUI) to blockid
@@ -488,10 +324,15 @@ class Mcprint(QMainWindow):
     def save_scad_as(self):
         options = QFileDialog.Options()
         options |= QFileDialog.DontUseNativeDialog
-        filename, _ = QFileDialog.getSaveFileName(self,"QFileDialog.getSaveFileName()","data-files","OpenSCAD File (*.scad);;All Files (*)", options=options)
+        filename, _ = QFileDialog.getSaveFileName(self,"QFileDialog.getSaveFileName()","data-files","OpenSCAD File (*.scad);;STL Mesh (*.stl);;3MF Mesh (*.3mf);;All Files (*)", options=options)
         # Check for extension - if none then add one 
         if not ("." in filename):
             filename += ".scad"
+        # STL / 3MF are exported directly as a mesh
+        if (os.path.splitext(filename)[1].lower() in ('.stl', '.3mf')):
+            self.run_in_background ("Exporting mesh", self.engine.export_mesh,
+                (self.minecraft_saved_file, filename, self.ui.doubleSpinBoxBlockSize.value()))
+            return
         self.convert_to_openscad_file(self.minecraft_saved_file, filename)
 
 
@@ -506,12 +347,11 @@ class Mcprint(QMainWindow):
         start_pos = self.print_area.get_start()
         size = self.print_area.get_size()
         #print ("Saving capture - start pos "+str(start_pos)+" - size "+str(size))
-        self.save_blocks (filename, start_pos, size)
-
-        #### Todo - confirmation complete (or for long saves - status bar)
         #### Todo - load file into openSCAD export tab
-                
-        self.set_mbf (filename)
+        def capture_saved (success):
+            if (success):
+                self.set_mbf (filename)
+        self.save_blocks (filename, start_pos, size, False, capture_saved)
         
         
     def create_openscad (self):
@@ -520,134 +360,33 @@ class Mcprint(QMainWindow):
     
     
     def convert_to_openscad_file (self, minecraft_filename, scad_filename):
-        # offset values for x, y, z
-        offset = [None,None,None]
-        with open(minecraft_filename, 'r') as infile:
-            with open(scad_filename, 'w') as outfile:
-                # import module file
-                outfile.write("include <minecraft-print.scad>\n")
-                # Set blocksize variable
-                outfile.write("block_size = {};\n".format(self.ui.doubleSpinBoxBlockSize.value()))
-
-                while True:
-                    this_line = infile.readline()
-                    if not this_line :
-                        break
-                    # split based on comma into x,y,z,block_id
-                    #split_line = [int(x) for x in this_line.split(",")]
-                    ### Minecraft uses z for y axis, so swap with y when loading as OpenSCAD
-                    (x,z,y,blockid,data) = [int(i) for i in this_line.split(",")]
-                    
-                    # minecraft x axis is the opposite way to openSCAD, so invert here
-                    x *= -1
-                    
-                    # If first line then set the offsets
-                    # This moves the blocks to be near to the 0,0,0 axis
-                    # Due to the way we have to invert the x axis (above) this means that the
-                    # x axis is negative. 
-                    # This is not classified as a bug as OpenSCAD works just as well with the 
-                    # X axis being negative as positive.
-                    # If want to change then need to read file in twice or to create
-                    # offset as a variable and then add that later.
-                    if (offset[0] == None):
-                        offset[0] = -1 * x
-                        offset[1] = -1 * y
-                        offset[2] = -1 * z
-                        
-                        
-                    # Ignore any air blocks
-                    if (blockid in exclude_blocks):
-                        continue
-                    # Ignore any less than 0 (although should not be any)
-                    elif (blockid < 0):
-                        continue
-                    elif (blockid in stair_blocks):
-                        # pass data to the stair_block
-                        outfile.write("translate([{},{},{}]){}({});\n".format(
-                            "block_size*" + str(x + offset[0]),
-                            "block_size*" + str(y + offset[1]),
-                            "block_size*" + str(z + offset[2]),
-                            "stair_block", data))
-                        
-                    ### Todo - analyze stair blocks. If stair has no adjacent
-                    # on one side, but does at right angle, then change to a 
-                    # corner block
-                    
-                    elif (blockid in half_blocks):
-                        outfile.write("translate([{},{},{}]){}({});\n".format(
-                            "block_size*" + str(x + offset[0]),
-                            "block_size*" + str(y + offset[1]),
-                            "block_size*" + str(z + offset[2]),
-                            "half_block", data))
-                        
-                    # If not handled above then use the default block
-                    else:
-                        outfile.write("translate([{},{},{}]){}();\n".format(
-                            "block_size*" + str(x + offset[0]),
-                            "block_size*" + str(y + offset[1]),
-                            "block_size*" + str(z + offset[2]),
-                            "standard_block"))
+        self.run_in_background ("Converting to OpenSCAD", self.engine.convert_to_openscad_file,
+            (minecraft_filename, scad_filename, self.ui.doubleSpinBoxBlockSize.value()))
                         
 
     # Read through mbf file looking for dimensions
     def load_mbf_dimensions (self, filename):
-        self.print_dimension_smallest = None
-        
-        with open(filename, 'r') as infile:
-            while True:
-                this_line = infile.readline()
-                if not this_line :
-                    break
-                ### Minecraft uses z for y axis, so swap with y when loading as OpenSCAD
-                (x,y,z,blockid,data) = [int(i) for i in this_line.split(",")]
-                # If id is not in exclude count it as a valid block
-                # record smallest and largest so we can workout size
-                # x,y,z are in minecraft format so convert to scad
-                if not blockid in exclude_blocks:
-                    if (self.print_dimension_smallest == None):
-                        # min / max values
-                        self.print_dimension_smallest = [x, z, y]
-                        self.print_dimension_largest = [x, z, y]
-                    else:
-                        if (x < self.print_dimension_smallest[0]):
-                            self.print_dimension_smallest[0] = x
-                        if (z < self.print_dimension_smallest[1]):
-                            self.print_dimension_smallest[1] = z
-                        if (y < self.print_dimension_smallest[2]):
-                            self.print_dimension_smallest[2] = y
-                        if (x > self.print_dimension_largest[0]):
-                            self.print_dimension_largest[0] = x
-                        if (z > self.print_dimension_largest[1]):
-                            self.print_dimension_largest[1] = z
-                        if (y > self.print_dimension_largest[2]):
-                            self.print_dimension_largest[2] = y
+        self.engine.load_mbf_dimensions (filename)
         self.update_print_size()
 
 
 
     def connect_to_minecraft (self):
-        if (self.mc == None):
-            try:
-                self.mc = Minecraft.create()
-            except Exception as e:
-                print ("Error connecting to Minecraft\nPlease ensure that Minecraft is running")
+        self.engine.connect_to_minecraft()
             
     
     # Updates the display of the print size
     def update_print_size(self):
+        # Get size of blocks
+        block_size = self.ui.doubleSpinBoxBlockSize.value()
+        print_size = self.engine.get_print_size(block_size)
         # if dimensions are not set then return empty string
-        if (self.print_dimension_largest == None or self.print_dimension_smallest == None):
+        if (print_size == None):
             self.ui.labelPrintSize.setText("")
             return
-        # Get size of blocks
-        block_size = self.ui.doubleSpinBoxBlockSize.value()
         
         # Create string for value
-        size_string = "{} , {} , {}".format(
-            (self.print_dimension_largest[0] - self.print_dimension_smallest[0] + 1) * block_size,
-            (self.print_dimension_largest[1] - self.print_dimension_smallest[1] + 1) * block_size,
-            (self.print_dimension_largest[2] - self.print_dimension_smallest[2] + 1) * block_size
-            )
+        size_string = "{} , {} , {}".format(*print_size)
         self.ui.labelPrintSize.setText(size_string)
 
 
@@ -0,0 +1,191 @@
+##########################################################################
+# mcpscad.py
+# OpenSCAD output - a module for each block, or merged where adjacent
+# standard blocks are written as a single cube
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Each block is converted through a pipeline of generators
+# (blocks -> filter -> classify -> lines) and the lines are written in
+# batches, so memory use does not depend on the size of the file.
+#
+# OpenSCAD has to union every object in the file, so tens of thousands
+# of blocks take hours to render. Standard blocks are merged into the
+# largest boxes that can be found (greedy - along z, then x, then y) which
+# is usually orders of magnitude fewer objects. Only shapes marked merge
+# in the block registry are merged, others (eg. stairs and half blocks)
+# are still written as their modules from minecraft-print.scad.
+# Without NumPy only runs along z are merged.
+#
+###########################################################################
+
+from mcpcapture import CancelledError
+from mcprestore import merge_boxes
+
+# NumPy is optional - used to merge in all directions
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Lines joined into a single write
+write_batch_size = 4096
+
+
+# Passes blocks through, calling progress at the start of each layer
+# (minecraft y) - bounds is (origin, size) from read_bounds
+def layer_progress (blocks, bounds, progress):
+    if (progress == None):
+        return blocks
+    return _layer_progress(blocks, bounds, progress)
+
+
+def _layer_progress (blocks, bounds, progress):
+    ((origin_x, origin_y, origin_z), (size_x, size_y, size_z)) = bounds
+    last_layer = None
+    for this_block in blocks:
+        if (this_block[1] != last_layer):
+            last_layer = this_block[1]
+            if (progress(((last_layer - origin_y) / size_y) * 100)):
+                raise CancelledError()
+        yield this_block
+
+
+# Removes blocks which are not printed (air, water etc.)
+def filter_blocks (blocks, registry):
+    table = registry.table
+    for this_block in blocks:
+        # Ignore any less than 0 (although should not be any)
+        if (this_block[3] < 0 or table[this_block[3]] == 0):
+            continue
+        yield this_block
+
+
+# Adds the shape (see mcpblocks) for each block - (x,y,z,id,data,shape)
+def classify_blocks (blocks, registry):
+    (table, shapes) = (registry.table, registry.shapes)
+    for (x, y, z, block_id, data) in blocks:
+        # Stair corners are in the data (see mcpneighbours)
+        yield (x, y, z, block_id, data, shapes[table[block_id]])
+
+
+# OpenSCAD line for each block
+# Minecraft uses z for y axis, so swap with y, and the x axis is the
+# opposite way to OpenSCAD so is inverted
+def block_lines (blocks, offset):
+    (offset_x, offset_y, offset_z) = offset
+    for (x, y, z, block_id, data, shape) in blocks:
+        if (shape.data):
+            # pass data to the module (eg. stair / half block)
+            yield "translate([block_size*%d,block_size*%d,block_size*%d])%s(%d);\n" % (
+                -x + offset_x, z + offset_y, y + offset_z, shape.module, data)
+        else:
+            yield "translate([block_size*%d,block_size*%d,block_size*%d])%s();\n" % (
+                -x + offset_x, z + offset_y, y + offset_z, shape.module)
+
+
+# Write lines in batches
+def write_lines (outfile, lines):
+    batch = []
+    for this_line in lines:
+        batch.append(this_line)
+        if (len(batch) >= write_batch_size):
+            outfile.write("".join(batch))
+            batch = []
+    outfile.write("".join(batch))
+
+
+# Writes a module for each block (x,y,z,id,data) from blocks, which must
+# be in file order (eg. iter_blocks)
+# progress is an optional callback, returns True to cancel (CancelledError)
+# registry is the BlockRegistry (see mcpblocks)
+def write_blocks (outfile, blocks, offset, bounds, registry, progress = None):
+    blocks = layer_progress(blocks, bounds, progress)
+    blocks = classify_blocks(filter_blocks(blocks, registry), registry)
+    write_lines(outfile, block_lines(blocks, offset))
+
+
+# Minecraft (x,y,z) relative to origin as OpenSCAD position string
+# offset is the same as used in convert_to_openscad_file
+def scad_position (capture, x, y, z, offset):
+    # Minecraft uses z for y axis, and x axis is the opposite way to OpenSCAD
+    return "[{},{},{}]".format(
+        "block_size*" + str(-1 * (capture.origin[0] + x) + offset[0]),
+        "block_size*" + str(capture.origin[2] + z + offset[1]),
+        "block_size*" + str(capture.origin[1] + y + offset[2]))
+
+
+# Boolean for each block (in capture order) of whether it is a block
+# that can be merged (eg. standard block)
+def merge_mask (capture, registry):
+    if (numpy != None):
+        (ids, data) = capture.as_arrays()
+        return registry.mask(ids, lambda shape: shape != None and shape.merge)
+    (table, shapes) = (registry.table, registry.shapes)
+    return [table[block_id] != 0 and shapes[table[block_id]].merge for block_id in bytes(capture.ids)]
+
+
+# Merge the standard blocks into boxes
+# Returns list of (x0,y0,z0,x1,y1,z1) relative and inclusive, in y order
+def merge_standard_blocks (capture, standard):
+    if (numpy != None):
+        return [box[0:6] for box in merge_boxes(standard.astype(numpy.uint8), standard, overlap=False)]
+    (size_x, size_y, size_z) = capture.size
+    boxes = []
+    index = 0
+    for y in range (0, size_y):
+        for x in range (0, size_x):
+            z = 0
+            while (z < size_z):
+                if (not standard[index + z]):
+                    z += 1
+                    continue
+                z0 = z
+                while (z < size_z and standard[index + z]):
+                    z += 1
+                boxes.append((x, y, z0, x, y, z-1))
+            index += size_z
+    return boxes
+
+
+# Writes the blocks in capture to outfile (after the include / block_size)
+# Single blocks use their module so the output is the same as the
+# unmerged file where blocks can't be merged
+# registry is the BlockRegistry (see mcpblocks)
+# progress is an optional callback, returns True to cancel (CancelledError)
+def write_merged (outfile, capture, offset, registry, progress = None):
+    (size_x, size_y, size_z) = capture.size
+    standard = merge_mask(capture, registry)
+    boxes = merge_standard_blocks(capture, standard)
+
+    # Blocks which can't be merged (eg. stairs and half blocks) by layer
+    special_blocks = [[] for y in range (0, size_y)]
+    for index in capture.solid_indexes():
+        shape = registry.shape(capture.ids[index])
+        if (shape == None or shape.merge):
+            continue
+        (x, y, z) = capture.position(index)
+        special_blocks[y].append((x, y, z, shape, capture.data[index]))
+
+    box_number = 0
+    for layer in range (0, size_y):
+        if (progress != None and progress((layer / size_y) * 100)):
+            raise CancelledError()
+        while (box_number < len(boxes) and boxes[box_number][1] == layer):
+            (x0, y0, z0, x1, y1, z1) = boxes[box_number]
+            box_number += 1
+            # x is inverted so the box starts from x1
+            if ((x0, y0, z0) == (x1, y1, z1)):
+                shape = registry.shape(capture.ids[capture.index(x0, y0, z0)])
+                outfile.write("translate({}){}();\n".format(scad_position(capture, x1, y0, z0, offset), shape.module))
+            else:
+                outfile.write("translate({})cube([block_size*{},block_size*{},block_size*{}]);\n".format(
+                    scad_position(capture, x1, y0, z0, offset), x1 - x0 + 1, z1 - z0 + 1, y1 - y0 + 1))
+        for (x, y, z, shape, data) in special_blocks[layer]:
+            if (shape.data):
+                outfile.write("translate({}){}({});\n".format(scad_position(capture, x, y, z, offset), shape.module, data))
+            else:
+                outfile.write("translate({}){}();\n".format(scad_position(capture, x, y, z, offset), shape.module))
+    return len(boxes)
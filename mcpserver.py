@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+import sys
+import argparse
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from mbffile import BlockCapture, load_mbf
+
+##########################################################################
+# mcpserver.py [options]
+# Stand in for a Minecraft server (RaspberryJuice) for testing capture
+# and restore without Minecraft
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Implements the mcpi commands used by minecraft-print on an in memory
+# world: world.getBlock, world.getBlockWithData, world.getBlocks,
+# world.setBlock, world.setBlocks, world.getHeight, player.getTile,
+# player.setTile, player.getPos, player.setPos and chat.post
+#
+# The network and server can be slowed down to match a real server:
+#     rtt          - round trip time (seconds)
+#     bandwidth    - bytes per second in each direction (0 = unlimited)
+#     command_cost - time the server takes for each command (seconds)
+#     block_cost   - extra time for each block read or set (seconds)
+# Commands are run as soon as they are received, but replies are not
+# sent until the time they would arrive at the client, so pipelined
+# requests overlap the round trip in the same way as a real network.
+#
+# Options (when run from the command line):
+#     --port 4711 --origin x y z --size x y z --load file.mbf
+#     --rtt seconds --bandwidth bytes --command-cost seconds
+#     --block-cost seconds
+#
+###########################################################################
+
+
+default_port = 4711
+default_world_origin = (-128, 0, -128)
+default_world_size = (256, 128, 256)
+
+
+# The world - a BlockCapture, blocks outside are air and can't be set
+class VoxelWorld():
+
+    def __init__ (self, origin = default_world_origin, size = default_world_size):
+        self.capture = BlockCapture(origin, size)
+        (origin_x, origin_y, origin_z) = origin
+        # Player starts above the centre of the world
+        self.player = [origin_x + size[0] / 2, origin_y + size[1] - 1, origin_z + size[2] / 2]
+        self.lock = threading.Lock()
+
+    # Index into the capture or None if outside the world
+    def _index (self, x, y, z):
+        (x, y, z) = (x - self.capture.origin[0], y - self.capture.origin[1], z - self.capture.origin[2])
+        (size_x, size_y, size_z) = self.capture.size
+        if (x < 0 or y < 0 or z < 0 or x >= size_x or y >= size_y or z >= size_z):
+            return None
+        return self.capture.index(x, y, z)
+
+    # Copy blocks from a capture into the world (at the same position)
+    def load (self, capture):
+        (origin_x, origin_y, origin_z) = capture.origin
+        (size_x, size_y, size_z) = capture.size
+        rows = self._rows(origin_x, origin_y, origin_z, origin_x+size_x-1, origin_y+size_y-1, origin_z+size_z-1)
+        # rows are in the same order as the capture
+        for (row, (index, before, length, after)) in enumerate(rows):
+            if (index != None):
+                start = row * size_z + before
+                self.capture.ids[index:index+length] = capture.ids[start:start+length]
+                self.capture.data[index:index+length] = capture.data[start:start+length]
+
+    def get_block (self, x, y, z):
+        index = self._index(x, y, z)
+        if (index == None):
+            return (0, 0)
+        return (self.capture.ids[index], self.capture.data[index])
+
+    def set_block (self, x, y, z, block_id, block_data = 0):
+        index = self._index(x, y, z)
+        if (index != None):
+            self.capture.ids[index] = block_id & 0xff
+            self.capture.data[index] = block_data & 0xff
+
+    # Returns list of ids from x0,y0,z0 to x1,y1,z1 in y, x, z order (the
+    # same as RaspberryJuice)
+    def get_blocks (self, x0, y0, z0, x1, y1, z1):
+        ids = bytearray()
+        for (index, before, length, after) in self._rows(x0, y0, z0, x1, y1, z1):
+            ids += bytes(before)
+            if (index != None):
+                ids += self.capture.ids[index:index+length]
+            ids += bytes(after)
+        return list(ids)
+
+    def set_blocks (self, x0, y0, z0, x1, y1, z1, block_id, block_data = 0):
+        for (index, before, length, after) in self._rows(x0, y0, z0, x1, y1, z1):
+            if (index != None):
+                self.capture.ids[index:index+length] = bytes([block_id & 0xff]) * length
+                self.capture.data[index:index+length] = bytes([block_data & 0xff]) * length
+
+    # Each z row of a cuboid in y, x order - (index of the part inside
+    # the world or None, blocks before, blocks inside, blocks after)
+    def _rows (self, x0, y0, z0, x1, y1, z1):
+        (origin_z, size_z) = (self.capture.origin[2], self.capture.size[2])
+        (z0, z1) = (min(z0, z1), max(z0, z1))
+        inside_z0 = max(z0, origin_z)
+        inside_z1 = min(z1, origin_z + size_z - 1)
+        for y in range (min(y0, y1), max(y0, y1) + 1):
+            for x in range (min(x0, x1), max(x0, x1) + 1):
+                index = self._index(x, y, inside_z0)
+                if (index == None or inside_z1 < inside_z0):
+                    yield (None, z1 - z0 + 1, 0, 0)
+                else:
+                    yield (index, inside_z0 - z0, inside_z1 - inside_z0 + 1, z1 - inside_z1)
+
+    # y of the highest non air block at x, z (bottom of the world if none)
+    def get_height (self, x, z):
+        for y in range (self.capture.origin[1] + self.capture.size[1] - 1, self.capture.origin[1] - 1, -1):
+            if (self.get_block(x, y, z)[0] != 0):
+                return y
+        return self.capture.origin[1]
+
+
+# Counts of what has been sent / received (all connections)
+class ServerStats():
+
+    def __init__ (self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset (self):
+        self.commands = {}
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.connections = 0
+
+    def total_commands (self):
+        return sum(self.commands.values())
+
+    def as_dict (self):
+        return {'commands':self.total_commands(), 'command_counts':dict(self.commands),
+            'bytes_received':self.bytes_received, 'bytes_sent':self.bytes_sent,
+            'connections':self.connections}
+
+
+# One client connection
+# The reader runs the commands and works out when each reply would reach
+# the client, the writer thread sends each reply at that time
+class McpiHandler(socketserver.StreamRequestHandler):
+
+    def setup (self):
+        socketserver.StreamRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.replies = deque()
+        self.replies_ready = threading.Condition()
+        self.closed = False
+        self.writer = threading.Thread(target=self.write_replies, daemon=True)
+        self.writer.start()
+        with self.server.stats.lock:
+            self.server.stats.connections += 1
+
+    def handle (self):
+        for line in self.rfile:
+            (reply, blocks) = self.run_command(line.decode("cp437").strip())
+            self.schedule(len(line), reply, blocks)
+
+    def finish (self):
+        with self.replies_ready:
+            self.closed = True
+            self.replies_ready.notify()
+        self.writer.join()
+        socketserver.StreamRequestHandler.finish(self)
+
+    # Work out when the reply reaches the client and queue it
+    def schedule (self, request_size, reply, blocks):
+        server = self.server
+        reply_bytes = b""
+        if (reply != None):
+            reply_bytes = (reply + "\n").encode("cp437")
+        with server.timing_lock:
+            # received at the server after half the round trip, and the
+            # bandwidth for the request
+            server.in_free = max(server.in_free, time.monotonic()) + server.transfer_time(request_size)
+            arrive = server.in_free + server.rtt / 2
+            server.busy_until = max(server.busy_until, arrive) + server.command_cost + server.block_cost * blocks
+            if (reply != None):
+                server.out_free = max(server.out_free, server.busy_until) + server.transfer_time(len(reply_bytes))
+                send_time = server.out_free + server.rtt / 2
+        with server.stats.lock:
+            server.stats.bytes_received += request_size
+            server.stats.bytes_sent += len(reply_bytes)
+        if (reply != None):
+            with self.replies_ready:
+                self.replies.append((send_time, reply_bytes))
+                self.replies_ready.notify()
+
+    def write_replies (self):
+        while True:
+            with self.replies_ready:
+                while (len(self.replies) == 0 and not self.closed):
+                    self.replies_ready.wait()
+                if (len(self.replies) == 0):
+                    return
+                (send_time, reply_bytes) = self.replies.popleft()
+            delay = send_time - time.monotonic()
+            if (delay > 0):
+                time.sleep(delay)
+            try:
+                self.wfile.write(reply_bytes)
+                self.wfile.flush()
+            except OSError:
+                return
+
+    # Returns (reply or None, number of blocks read / set)
+    def run_command (self, line):
+        server = self.server
+        world = server.world
+        if (not "(" in line):
+            return (None, 0)
+        (command, args) = line.split("(", 1)
+        args = [value for value in args.rstrip(")").split(",") if value != ""]
+        with server.stats.lock:
+            server.stats.commands[command] = server.stats.commands.get(command, 0) + 1
+        try:
+            values = [int(float(value)) for value in args]
+        except ValueError:
+            values = []
+        with world.lock:
+            if (command == "world.getBlock"):
+                return ("{}".format(world.get_block(*values[0:3])[0]), 1)
+            elif (command == "world.getBlockWithData"):
+                return ("{},{}".format(*world.get_block(*values[0:3])), 1)
+            elif (command == "world.getBlocks"):
+                ids = world.get_blocks(*values[0:6])
+                return (",".join(str(block_id) for block_id in ids), len(ids))
+            elif (command == "world.setBlock"):
+                world.set_block(*values[0:5])
+                return (None, 1)
+            elif (command == "world.setBlocks"):
+                world.set_blocks(*values[0:8])
+                (x0, y0, z0, x1, y1, z1) = values[0:6]
+                return (None, (abs(x1 - x0) + 1) * (abs(y1 - y0) + 1) * (abs(z1 - z0) + 1))
+            elif (command == "world.getHeight"):
+                return ("{}".format(world.get_height(*values[0:2])), 1)
+            elif (command == "player.getTile"):
+                return (",".join(str(int(value // 1)) for value in world.player), 0)
+            elif (command == "player.getPos"):
+                return (",".join(str(value) for value in world.player), 0)
+            elif (command == "player.setTile" or command == "player.setPos"):
+                world.player = [float(value) for value in args[0:3]]
+                return (None, 0)
+            elif (command == "chat.post"):
+                return (None, 0)
+        # Unknown commands (RaspberryJuice ignores these)
+        return (None, 0)
+
+
+class McpiServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__ (self, world = None, port = default_port, address = "localhost",
+            rtt = 0, bandwidth = 0, command_cost = 0, block_cost = 0):
+        if (world == None):
+            world = VoxelWorld()
+        self.world = world
+        self.rtt = rtt
+        self.bandwidth = bandwidth
+        self.command_cost = command_cost
+        self.block_cost = block_cost
+        self.stats = ServerStats()
+        # Time the link in / server / link out is next free - shared by
+        # all connections (RaspberryJuice runs commands one at a time)
+        self.timing_lock = threading.Lock()
+        self.in_free = self.busy_until = self.out_free = 0
+        self.thread = None
+        socketserver.ThreadingTCPServer.__init__(self, (address, port), McpiHandler)
+
+    @property
+    def port (self):
+        return self.server_address[1]
+
+    # Time to send size bytes
+    def transfer_time (self, size):
+        if (self.bandwidth <= 0):
+            return 0
+        return size / self.bandwidth
+
+    # Run the server in a background thread
+    def start (self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop (self):
+        self.shutdown()
+        self.server_close()
+
+
+def create_parser ():
+    parser = argparse.ArgumentParser(description="mcpi stand in server for minecraft-print")
+    parser.add_argument("--port", type=int, default=default_port, help="port to listen on")
+    parser.add_argument("--address", default="localhost", help="address to listen on")
+    parser.add_argument("--origin", type=int, nargs=3, default=default_world_origin, metavar=("X","Y","Z"))
+    parser.add_argument("--size", type=int, nargs=3, default=default_world_size, metavar=("X","Y","Z"))
+    parser.add_argument("--load", default=None, help="minecraft blocks file to load into the world")
+    parser.add_argument("--rtt", type=float, default=0, help="round trip time (seconds)")
+    parser.add_argument("--bandwidth", type=float, default=0, help="bytes per second (0 = unlimited)")
+    parser.add_argument("--command-cost", type=float, default=0, help="server time for each command (seconds)")
+    parser.add_argument("--block-cost", type=float, default=0, help="server time for each block (seconds)")
+    return parser
+
+
+def main (argv = None):
+    args = create_parser().parse_args(argv)
+    world = VoxelWorld(args.origin, args.size)
+    if (args.load != None):
+        with load_mbf(args.load) as capture:
+            world.load(capture)
+    server = McpiServer(world, args.port, args.address, args.rtt, args.bandwidth, args.command_cost, args.block_cost)
+    print ("Listening on {}:{}".format(args.address, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print ("Commands {commands} received {bytes_received} bytes sent {bytes_sent} bytes".format(**server.stats.as_dict()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+##########################################################################
+# mcpshard.py
+# Conversion of large captures over a pool of processes
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# The capture is split into shards which are converted in separate
+# processes (so all the cores are used) and the results are joined in
+# shard order, so the output does not depend on the number of workers.
+# OpenSCAD blocks and statistics are sharded by layers (minecraft y),
+# in the same order as the file, so the output is the same as converting
+# in a single process. The mesh is sharded along minecraft x (OpenSCAD X
+# is inverted so the shards are joined from the highest x) with an extra
+# column of blocks either side so that faces between shards are hidden
+# in the same way - the mesh is also the same as a single process.
+# Merged OpenSCAD boxes can't cross between shards, so a merged file
+# is different (a few more boxes) - merged_shard_layers is fixed so that
+# it is the same for any number of workers. Otherwise the shard size is
+# set from the number of workers (shards_per_worker each, so the work is
+# balanced if some shards are slower).
+# Each shard is a copy of its blocks, made as the pool is ready for it
+# so only a few shards are in memory at a time. The offset is the same
+# for all shards (from the origin of the whole capture).
+# Neighbour shapes and hollowing (see McprintEngine._prepare_capture)
+# are done on the whole capture in this process before it is sharded.
+#
+###########################################################################
+
+import io
+import os
+from multiprocessing import Pool
+from mbffile import BlockCapture, block_stats
+from mcpcapture import CancelledError, extract_tile
+from mcpscad import write_blocks, write_merged
+from mcpmesh import exposed_faces, face_triangles, grid_base, half_block_grid
+
+# NumPy is optional - required for the mesh
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Layers (minecraft y) in each merged OpenSCAD shard
+merged_shard_layers = 16
+
+# Number of shards for each worker process
+shards_per_worker = 4
+
+# Smallest mesh shard (minecraft x) - each shard has an extra column
+# either side
+min_shard_columns = 4
+
+
+# Returns list of (start, end) splitting length into shards of size
+def split_shards (length, size):
+    return [(start, min(start + size, length)) for start in range (0, length, size)]
+
+
+# Size of each shard to split length between workers processes (None is
+# one per core), at least minimum
+def shard_size (length, workers = None, minimum = 1):
+    if (workers == None):
+        workers = os.cpu_count() or 1
+    shards = workers * shards_per_worker
+    return max(minimum, (length + shards - 1) // shards)
+
+
+# Copy of layers start to end (minecraft y, relative) of capture
+# Layers are contiguous (y is the outer axis) so this is a single slice
+def layer_shard (capture, start, end):
+    layer_size = capture.size[0] * capture.size[2]
+    return BlockCapture((capture.origin[0], capture.origin[1] + start, capture.origin[2]),
+        (capture.size[0], end - start, capture.size[2]),
+        bytearray(capture.ids[start * layer_size:end * layer_size]),
+        bytearray(capture.data[start * layer_size:end * layer_size]))
+
+
+# Runs function on each item of shards (an iterable of num_shards items,
+# created as the pool takes them) over a pool of workers processes
+# Generator returning the results in the same order as shards
+# progress is called as each shard completes (start to end), returns
+# True to cancel (CancelledError)
+def map_shards (function, shards, num_shards, workers, progress = None, start = 0, end = 100):
+    with Pool(workers) as pool:
+        for (count, result) in enumerate(pool.imap(function, shards), 1):
+            if (progress != None and progress(start + (count / num_shards) * (end - start))):
+                # Pool is terminated when the with block exits
+                raise CancelledError()
+            yield result
+
+
+def _blocks_shard (args):
+    (capture, offset, registry) = args
+    outfile = io.StringIO()
+    write_blocks(outfile, capture.solid_blocks(), offset, (capture.origin, capture.size), registry)
+    return outfile.getvalue()
+
+
+def _merged_shard (args):
+    (capture, offset, registry) = args
+    outfile = io.StringIO()
+    write_merged(outfile, capture, offset, registry)
+    return outfile.getvalue()
+
+
+# Same as mcpscad.write_blocks for a capture - over workers processes
+def write_blocks_sharded (outfile, capture, offset, registry, workers = None, progress = None):
+    layers = split_shards(capture.size[1], shard_size(capture.size[1], workers))
+    shards = ((layer_shard(capture, start, end), offset, registry) for (start, end) in layers)
+    for text in map_shards(_blocks_shard, shards, len(layers), workers, progress):
+        outfile.write(text)
+
+
+# Same as mcpscad.write_merged - over workers processes, boxes are only
+# merged within each shard
+def write_merged_sharded (outfile, capture, offset, registry, workers = None, progress = None):
+    layers = split_shards(capture.size[1], merged_shard_layers)
+    shards = ((layer_shard(capture, start, end), offset, registry) for (start, end) in layers)
+    for text in map_shards(_merged_shard, shards, len(layers), workers, progress):
+        outfile.write(text)
+
+
+def _stats_shard (args):
+    (capture, exclude_blocks) = args
+    return block_stats(capture, exclude_blocks)
+
+
+# Same as mbffile.block_stats - over workers processes
+def block_stats_sharded (capture, exclude_blocks = (), workers = None):
+    layers = split_shards(capture.size[1], shard_size(capture.size[1], workers))
+    shards = ((layer_shard(capture, start, end), exclude_blocks) for (start, end) in layers)
+    stats = {'origin':capture.origin, 'size':capture.size, 'lowest':None, 'highest':None,
+        'histogram':[0] * 256, 'histogram_no_data':[0] * 256, 'solid':0, 'printed':0}
+    for shard_stats in map_shards(_stats_shard, shards, len(layers), workers):
+        for key in ('histogram', 'histogram_no_data'):
+            stats[key] = [a + b for (a, b) in zip(stats[key], shard_stats[key])]
+        stats['solid'] += shard_stats['solid']
+        stats['printed'] += shard_stats['printed']
+        if (shard_stats['lowest'] == None):
+            continue
+        if (stats['lowest'] == None):
+            (stats['lowest'], stats['highest']) = (shard_stats['lowest'], shard_stats['highest'])
+        stats['lowest'] = tuple(min(a, b) for (a, b) in zip(stats['lowest'], shard_stats['lowest']))
+        stats['highest'] = tuple(max(a, b) for (a, b) in zip(stats['highest'], shard_stats['highest']))
+    return stats
+
+
+# Faces of the columns start to end (minecraft x, relative) of a capture
+# size_x wide. shard has an extra column either side (unless at the edge)
+# to end_x which hides the faces between shards, but only the faces of
+# the blocks from start to end are returned
+# Returns list of (triangles, normals) in the same (axis, direction)
+# order as exposed_faces, in half blocks from the base of the capture
+def _mesh_shard (args):
+    (shard, start, end, end_x, size_x, offset, registry) = args
+    (grid, base) = half_block_grid(shard, offset, registry)
+    # Grid x is inverted - so starts from the highest minecraft x
+    first = (end_x - end) * 2
+    last = (end_x - start) * 2
+    faces = []
+    for (axis, direction, cells) in exposed_faces(grid):
+        cells = cells[(cells[:, 0] >= first) & (cells[:, 0] < last)]
+        # position in the grid of the whole capture
+        cells[:, 0] += (size_x - end_x) * 2
+        (triangles, normals) = face_triangles(axis, direction, cells)
+        faces.append((triangles.astype(numpy.int32), normals))
+    return faces
+
+
+# Same as mcpmesh.build_mesh_faces - over workers processes
+def build_mesh_faces_sharded (capture, offset, registry, workers = None, progress = None):
+    if (numpy == None):
+        raise ImportError("Mesh export requires NumPy")
+    (size_x, size_y, size_z) = capture.size
+    # Highest x first (the start of the grid)
+    columns = list(reversed(split_shards(size_x, shard_size(size_x, workers, min_shard_columns))))
+
+    def shards ():
+        for (start, end) in columns:
+            (start_x, end_x) = (max(start - 1, 0), min(end + 1, size_x))
+            shard = extract_tile(capture, (capture.origin[0] + start_x, capture.origin[1], capture.origin[2]),
+                (end_x - start_x, size_y, size_z))
+            yield (shard, start, end, end_x, size_x, offset, registry)
+
+    all_faces = list(map_shards(_mesh_shard, shards(), len(columns), workers, progress, 0, 50))
+    # Join each (axis, direction) from all the shards, then the same
+    # order as build_mesh_faces
+    all_triangles = []
+    all_normals = []
+    for face in range (0, len(all_faces[0]) if len(all_faces) > 0 else 0):
+        for faces in all_faces:
+            all_triangles.append(faces[face][0])
+            all_normals.append(faces[face][1])
+    if (len(all_triangles) == 0):
+        return (numpy.zeros((0, 3, 3), dtype=numpy.int32), numpy.zeros((0, 3), dtype=numpy.float32),
+            grid_base(capture, offset))
+    return (numpy.concatenate(all_triangles), numpy.concatenate(all_normals), grid_base(capture, offset))
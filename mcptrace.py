@@ -0,0 +1,241 @@
+##########################################################################
+# mcptrace.py
+# Instrumentation - time spent in each phase of an operation (eg.
+# capture, writing the file), mcpi commands sent, bytes on the wire,
+# blocks processed and file I/O
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# Commands are counted by wrapping the socket of each mcpi connection
+# (see trace_connection) so that the pipelined requests (mcpcapture and
+# mcpwriter) are counted as well as the mcpi methods. The time for each
+# command is from sending it until its reply is received (commands
+# without a reply, eg. setBlock, are only counted).
+# Counts are added to the innermost phase that is running. The time of a
+# phase includes any phases inside it.
+#
+###########################################################################
+
+import json
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# Commands which have a reply (mcpi getters and events)
+def has_reply (command):
+    return ".get" in command or command.startswith("events.")
+
+
+class Tracer():
+
+    def __init__ (self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset (self):
+        with self.lock:
+            self.start_time = time.perf_counter()
+            self.phases = {}
+            # Phases running (name, start time) innermost last
+            self.running = []
+
+    def _phase_stats (self, name):
+        if (not name in self.phases):
+            self.phases[name] = {'calls':0, 'seconds':0.0, 'blocks':0, 'file_read':0, 'file_written':0,
+                'file_seconds':0.0, 'bytes_sent':0, 'bytes_received':0, 'commands':{}}
+        return self.phases[name]
+
+    # Stats of the innermost phase (or 'other' if none running)
+    def _current (self):
+        if (len(self.running) == 0):
+            return self._phase_stats('other')
+        return self._phase_stats(self.running[-1][0])
+
+    def _command_stats (self, command):
+        commands = self._current()['commands']
+        if (not command in commands):
+            commands[command] = {'count':0, 'replies':0, 'bytes_sent':0, 'bytes_received':0,
+                'seconds':0.0, 'max_seconds':0.0}
+        return commands[command]
+
+    # with tracer.phase("capture"):
+    @contextmanager
+    def phase (self, name):
+        running = (name, time.perf_counter())
+        with self.lock:
+            self._phase_stats(name)['calls'] += 1
+            self.running.append(running)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self._phase_stats(name)['seconds'] += time.perf_counter() - running[1]
+                if (running in self.running):
+                    self.running.remove(running)
+
+    # Number of blocks processed (read, converted or set) in this phase
+    def add_blocks (self, count):
+        with self.lock:
+            self._current()['blocks'] += count
+
+    # File read / written - seconds is the time spent on the file if known
+    def add_file_io (self, read = 0, written = 0, seconds = 0.0):
+        with self.lock:
+            stats = self._current()
+            stats['file_read'] += read
+            stats['file_written'] += written
+            stats['file_seconds'] += seconds
+
+    def command_sent (self, command, size):
+        with self.lock:
+            self._current()['bytes_sent'] += size
+            stats = self._command_stats(command)
+            stats['count'] += 1
+            stats['bytes_sent'] += size
+
+    # command is None if the reply does not match a command (eg. drained)
+    def reply_received (self, command, size, seconds):
+        with self.lock:
+            self._current()['bytes_received'] += size
+            if (command == None):
+                return
+            stats = self._command_stats(command)
+            stats['replies'] += 1
+            stats['bytes_received'] += size
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    # Returns all the stats (can be saved as json)
+    def as_dict (self):
+        with self.lock:
+            phases = json.loads(json.dumps(self.phases))
+            total_seconds = time.perf_counter() - self.start_time
+        for stats in phases.values():
+            stats['blocks_per_second'] = stats['blocks'] / stats['seconds'] if stats['seconds'] > 0 else None
+            stats['total_commands'] = sum(command['count'] for command in stats['commands'].values())
+        return {'total_seconds':total_seconds, 'phases':phases}
+
+    def write_json (self, filename):
+        with open(filename, 'w') as fp:
+            json.dump(self.as_dict(), fp, indent=1)
+
+    # One line summary eg. for a status bar
+    def status_text (self):
+        trace = self.as_dict()
+        with self.lock:
+            current = self.running[-1] if len(self.running) > 0 else None
+        phases = list(trace['phases'].values())
+        commands = sum(stats['total_commands'] for stats in phases)
+        sent = sum(stats['bytes_sent'] for stats in phases)
+        received = sum(stats['bytes_received'] for stats in phases)
+        text = "{} commands, {} sent, {} received".format(commands, format_bytes(sent), format_bytes(received))
+        if (current != None):
+            (name, start_time) = current
+            stats = trace['phases'][name]
+            text = "{}: ".format(name) + text
+            # blocks per second of the phase so far (including this call)
+            seconds = stats['seconds'] + time.perf_counter() - start_time
+            if (stats['blocks'] > 0 and seconds > 0):
+                text += ", {:.0f} blocks/s".format(stats['blocks'] / seconds)
+        return text
+
+
+# Readable size in bytes
+def format_bytes (value):
+    for unit in ["B", "KB", "MB"]:
+        if (value < 1024):
+            return "{:.0f}{}".format(value, unit)
+        value /= 1024
+    return "{:.1f}GB".format(value)
+
+
+# Socket which counts the commands sent and replies received
+# Anything else is passed to the real socket
+class TracedSocket():
+
+    def __init__ (self, sock, tracer):
+        self._sock = sock
+        self._tracer = tracer
+        # Commands waiting for a reply (command, time sent)
+        self._waiting = deque()
+        # Part of a line sent / received (without the newline)
+        self._sent_part = b""
+        self._received_size = 0
+        # Files from makefile (see socket.makefile)
+        self._io_refs = 0
+        self._closed = False
+
+    def __getattr__ (self, name):
+        return getattr(self._sock, name)
+
+    def sendall (self, data, *flags):
+        self._sent(data)
+        return self._sock.sendall(data, *flags)
+
+    def send (self, data, *flags):
+        sent = self._sock.send(data, *flags)
+        self._sent(data[:sent])
+        return sent
+
+    def recv (self, size, *flags):
+        data = self._sock.recv(size, *flags)
+        self._received(data)
+        return data
+
+    def recv_into (self, buffer, size = 0, *flags):
+        received = self._sock.recv_into(buffer, size, *flags)
+        self._received(memoryview(buffer)[:received].tobytes())
+        return received
+
+    # Same as socket.makefile, but reads through this object so that
+    # the replies are counted
+    def makefile (self, *args, **kwargs):
+        return socket.socket.makefile(self, *args, **kwargs)
+
+    def _decref_socketios (self):
+        if (self._io_refs > 0):
+            self._io_refs -= 1
+
+    def close (self):
+        self._closed = True
+        self._sock.close()
+
+    def _sent (self, data):
+        lines = (self._sent_part + bytes(data)).split(b"\n")
+        self._sent_part = lines.pop()
+        now = time.perf_counter()
+        for line in lines:
+            command = line.split(b"(", 1)[0].decode("cp437")
+            self._tracer.command_sent(command, len(line) + 1)
+            if (has_reply(command)):
+                self._waiting.append((command, now))
+
+    def _received (self, data):
+        now = time.perf_counter()
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if (end < 0):
+                self._received_size += len(data) - start
+                return
+            size = self._received_size + end + 1 - start
+            self._received_size = 0
+            start = end + 1
+            if (len(self._waiting) > 0):
+                (command, sent_time) = self._waiting.popleft()
+                self._tracer.reply_received(command, size, now - sent_time)
+            else:
+                self._tracer.reply_received(None, size, 0)
+
+
+# Count the commands on an mcpi connection (Minecraft object)
+# Returns mc
+def trace_connection (mc, tracer):
+    conn = getattr(mc, 'conn', None)
+    if (getattr(conn, 'socket', None) != None and not isinstance(conn.socket, TracedSocket)):
+        conn.socket = TracedSocket(conn.socket, tracer)
+    return mc
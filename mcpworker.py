@@ -0,0 +1,59 @@
+import time
+import threading
+from PyQt5.QtCore import QThread, pyqtSignal
+
+##########################################################################
+# mcpworker.py
+# Runs long engine operations (capture, restore, convert) in a background
+# thread so that the GUI does not freeze.
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+###########################################################################
+
+
+class EngineWorker(QThread):
+
+    # percentage complete, text eg. "ETA 0:42"
+    progress = pyqtSignal(int, str)
+
+    # function is called with args and a progress keyword argument
+    # It should return True if successful
+    def __init__ (self, function, *args, parent = None):
+        super().__init__(parent)
+        self.function = function
+        self.args = args
+        self.cancel_event = threading.Event()
+        self.start_time = None
+        # True if completed successfully, False if failed or cancelled
+        # Valid once the thread has finished (finished signal)
+        self.success = False
+
+    def run (self):
+        self.start_time = time.time()
+        try:
+            result = self.function(*self.args, progress=self.update_progress)
+        except Exception as e:
+            print ("Error in background task "+str(e))
+            result = False
+        self.success = bool(result) and not self.cancel_event.is_set()
+
+    # Called from the engine (in the worker thread)
+    # Returns True if the operation should be cancelled
+    def update_progress (self, value):
+        self.progress.emit(int(value), self.eta(value))
+        return self.cancel_event.is_set()
+
+    # Estimated time remaining based on progress so far
+    def eta (self, value):
+        elapsed = time.time() - self.start_time
+        if (value <= 1 or elapsed < 1):
+            return ""
+        remaining = int(elapsed * (100 - value) / value)
+        return "ETA {}:{:02d}".format(remaining // 60, remaining % 60)
+
+    # Can be called from the GUI thread, the engine will stop at the
+    # next progress update
+    def cancel (self):
+        self.cancel_event.set()
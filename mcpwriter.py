@@ -0,0 +1,86 @@
+##########################################################################
+# mcpwriter.py
+# Buffered block writes for a Minecraft (mcpi) connection
+#
+# Copyright 2019 Stewart Watkiss
+# Licensed under GPL-3.0-or-later
+#
+# setBlock / setBlocks commands (including data values) are queued and
+# sent in large buffers rather than a separate socket write for each.
+# BlockWriter has the same setBlock / setBlocks methods as mcpi so it can
+# be used in place of the connection for writes. Any buffered writes
+# must be flushed (or sync) before reading from the connection.
+#
+###########################################################################
+
+
+# Bytes queued before sending
+default_buffer_size = 64 * 1024
+
+
+class BlockWriter():
+
+    def __init__ (self, mc, buffer_size = default_buffer_size):
+        self.mc = mc
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered_bytes = 0
+        # Position of last block written - used for sync
+        self.last_position = None
+        # Stats - commands queued and bytes sent
+        self.commands = 0
+        self.bytes_sent = 0
+        # If not an mcpi socket connection then pass commands straight through
+        conn = getattr(mc, 'conn', None)
+        self.socket = getattr(conn, 'socket', None)
+
+    def setBlock (self, x, y, z, block_id, block_data = 0):
+        self.last_position = (x, y, z)
+        if (self.socket == None):
+            self.commands += 1
+            self.mc.setBlock(x, y, z, block_id, block_data)
+            return
+        self._queue(b"world.setBlock(%d,%d,%d,%d,%d)\n" % (x, y, z, block_id, block_data))
+
+    def setBlocks (self, x0, y0, z0, x1, y1, z1, block_id, block_data = 0):
+        self.last_position = (x0, y0, z0)
+        if (self.socket == None):
+            self.commands += 1
+            self.mc.setBlocks(x0, y0, z0, x1, y1, z1, block_id, block_data)
+            return
+        self._queue(b"world.setBlocks(%d,%d,%d,%d,%d,%d,%d,%d)\n" % (x0, y0, z0, x1, y1, z1, block_id, block_data))
+
+    def _queue (self, command):
+        self.buffer.append(command)
+        self.buffered_bytes += len(command)
+        self.commands += 1
+        if (self.buffered_bytes >= self.buffer_size):
+            self.flush()
+
+    # Send any queued commands
+    def flush (self):
+        if (len(self.buffer) == 0):
+            return
+        data = b"".join(self.buffer)
+        self.buffer = []
+        self.buffered_bytes = 0
+        # Discard anything left on the socket from earlier commands
+        self.mc.conn.drain()
+        self.mc.conn.lastSent = data
+        self.socket.sendall(data)
+        self.bytes_sent += len(data)
+
+    # Flush and then wait until the server has processed all the commands
+    # Commands are handled in order, so a reply to a getBlock means that
+    # all the writes before it are complete
+    def sync (self):
+        self.flush()
+        if (self.last_position != None):
+            self.mc.getBlock(*self.last_position)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc_value, traceback):
+        if (exc_type == None):
+            self.flush()